@@ -0,0 +1,326 @@
+#
+# Admission control for card generation.
+#
+# One user pasting a wall of links, or a bot relaying a feed, shouldn't
+# be able to fill every worker and delay cards for everyone else. Cards
+# are generated on a small worker pool instead of the Ice dispatch
+# thread. Before a job is queued it has to get past token buckets for
+# its user and every channel it's replying to. Queued jobs are then
+# picked round-robin across users, and each user can only have a few
+# running at once, so one user's backlog never holds up anyone else.
+#
+# Jobs are also split into lanes by how long they're expected to take,
+# from a moving average of recent run times for their kind of card.
+# Cheap jobs (cache hits, images, known oEmbed sites) share a fast
+# lane that's always served first and has a worker reserved for it.
+# Every slow kind (Twitter, Steam, page scrapes, ...) gets its own lane
+# with a bounded number of workers, so one slow provider can't occupy
+# the whole pool.
+#
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, deque
+
+from .cache import TTLCache
+from .metrics import Counter, QUEUE_DEPTH, STAGE_DURATION
+from .ratelimit import TokenBucket
+
+logger = logging.getLogger('Mumble.admission')
+
+FAST_LANE = 'fast'
+
+# Expected seconds per job for kinds of card we haven't timed yet.
+# Anything not listed is assumed to be slow.
+DEFAULT_COSTS = {
+    'cache': 0.01,
+    'image': 0.3,
+    'oembed': 0.3,
+}
+DEFAULT_COST = 1.0
+
+# Weight of the latest run time in each kind's moving average
+COST_SMOOTHING = 0.2
+
+REJECTED = Counter(
+    'mumble_card_rejected_total',
+    'Card requests turned away by flood control',
+    ('reason',))
+
+
+class Job:
+    def __init__(self, user, func: callable, args: tuple, kind: str, lane: str):
+        self.user = user
+        self.func = func
+        self.args = args
+        self.kind = kind
+        self.lane = lane
+        self.context = contextvars.copy_context()
+        self.enqueued = time.perf_counter()
+
+    def run(self):
+        # Keeps the submitter's trace as this job's parent span
+        self.context.run(self.func, *self.args)
+
+
+class FairScheduler:
+    """Worker pool with per-user and per-channel flood control
+
+    Args:
+        workers:            Worker threads generating cards
+        user_rate:          (burst, period) token bucket for each user
+        channel_rate:       (burst, period) token bucket for each channel
+        user_concurrency:   Jobs a single user may have running at once
+        user_queue:         Jobs a single user may have waiting
+        fast_threshold:     Jobs expected to take less than this many
+                            seconds go in the fast lane
+        fast_reserved:      Workers that only take fast jobs
+        slow_lane_workers:  Workers each slow lane may use at once
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        user_rate: tuple = (5, 60),
+        channel_rate: tuple = (20, 60),
+        user_concurrency: int = 2,
+        user_queue: int = 10,
+        fast_threshold: float = 0.5,
+        fast_reserved: int = 1,
+        slow_lane_workers: int = 2
+    ):
+        self.workers = workers
+        self.user_rate = user_rate
+        self.channel_rate = channel_rate
+        self.user_concurrency = user_concurrency
+        self.user_queue = user_queue
+        self.fast_threshold = fast_threshold
+        self.slow_lane_workers = slow_lane_workers
+
+        # Slow jobs can use whatever isn't reserved, but always at least one worker
+        self.slow_workers = max(1, workers - fast_reserved)
+
+        # An idle bucket refills completely within its period,
+        # so there's no point keeping it around any longer
+        self._user_buckets = TTLCache(ttl=user_rate[1], max_size=10000)
+        self._channel_buckets = TTLCache(ttl=channel_rate[1], max_size=10000)
+
+        self._cond = threading.Condition()
+        self._costs = dict(DEFAULT_COSTS)
+
+        # Lane -> user -> jobs, both in round-robin order
+        self._lanes = OrderedDict()
+        self._queued = {}
+        self._running = {}
+        self._lane_running = {}
+        self._threads = []
+        self._stopped = False
+
+    @classmethod
+    def from_environ(cls, environ: dict = os.environ) -> 'FairScheduler':
+        """Scheduler configured from CARD_* envvars"""
+        return cls(
+            workers=int(environ.get('CARD_WORKERS', 4)),
+            user_rate=(
+                int(environ.get('CARD_USER_BURST', 5)),
+                float(environ.get('CARD_USER_PERIOD', 60))),
+            channel_rate=(
+                int(environ.get('CARD_CHANNEL_BURST', 20)),
+                float(environ.get('CARD_CHANNEL_PERIOD', 60))),
+            user_concurrency=int(environ.get('CARD_USER_CONCURRENCY', 2)),
+            user_queue=int(environ.get('CARD_USER_QUEUE', 10)),
+            fast_threshold=float(environ.get('CARD_FAST_THRESHOLD', 0.5)),
+            fast_reserved=int(environ.get('CARD_FAST_RESERVED', 1)),
+            slow_lane_workers=int(environ.get('CARD_SLOW_LANE_WORKERS', 2)),
+        )
+
+    def expected_cost(self, kind: str) -> float:
+        """Moving average of recent run times for a kind of job, in seconds"""
+        return self._costs.get(kind, DEFAULT_COST)
+
+    def lane_for(self, kind: str) -> str:
+        if self.expected_cost(kind) < self.fast_threshold:
+            return FAST_LANE
+
+        return kind
+
+    def _bucket(self, cache: TTLCache, key, rate: tuple) -> TokenBucket:
+        bucket = cache.get(key)
+        if bucket is None:
+            bucket = TokenBucket(*rate)
+
+        # Refresh the expiry while the bucket is in use
+        cache.set(key, bucket)
+        return bucket
+
+    def _admit(self, user, channels: list) -> '(str | None)':
+        """Spend tokens for a job. Returns the reason if it was rejected"""
+        if self._queued.get(user, 0) >= self.user_queue:
+            return 'user_queue'
+
+        user_bucket = self._bucket(self._user_buckets, user, self.user_rate)
+        if not user_bucket.try_acquire():
+            return 'user_rate'
+
+        acquired = []
+        for channel in channels:
+            bucket = self._bucket(self._channel_buckets, channel, self.channel_rate)
+            if not bucket.try_acquire():
+                user_bucket.release()
+                for b in acquired:
+                    b.release()
+                return 'channel_rate'
+
+            acquired.append(bucket)
+
+        return None
+
+    def submit(self, user, channels: list, func: callable, *args, kind: str = None) -> bool:
+        """Queue `func(*args)` for `user` if flood control allows it
+
+        Args:
+            user:       Hashable key for the requesting user
+            channels:   Hashable keys for every channel the result goes to
+            func:       Job to run on a worker thread
+            kind:       What sort of job this is (e.g. a provider name),
+                        which decides its lane from past run times
+
+        :return bool: False if the job was rejected
+        """
+        with self._cond:
+            reason = self._admit(user, channels)
+            if reason:
+                REJECTED.inc(reason=reason)
+                logger.info('Rejected card request from %s (%s)', user, reason)
+                return False
+
+            if not self._threads:
+                self._start()
+
+            kind = kind or 'default'
+            lane = self.lane_for(kind)
+            queues = self._lanes.setdefault(lane, OrderedDict())
+            queues.setdefault(user, deque()).append(Job(user, func, args, kind, lane))
+            self._queued[user] = self._queued.get(user, 0) + 1
+            QUEUE_DEPTH.inc()
+            self._cond.notify()
+
+        return True
+
+    def _take(self, queues: OrderedDict) -> '(Job | None)':
+        """Take a lane's next job round-robin across users under their concurrency limit"""
+        for user, jobs in queues.items():
+            if self._running.get(user, 0) < self.user_concurrency:
+                job = jobs.popleft()
+                if jobs:
+                    # Back of the line for this user's next job
+                    queues.move_to_end(user)
+                else:
+                    del queues[user]
+
+                return job
+
+        return None
+
+    def _next_job(self) -> '(Job | None)':
+        """Take the next job, from the fast lane first, then round-robin across slow lanes"""
+        job = self._take(self._lanes.get(FAST_LANE, {}))
+
+        slow_running = sum(n for lane, n in self._lane_running.items() if lane != FAST_LANE)
+        if job is None and slow_running < self.slow_workers:
+            for lane, queues in self._lanes.items():
+                if lane == FAST_LANE or self._lane_running.get(lane, 0) >= self.slow_lane_workers:
+                    continue
+
+                job = self._take(queues)
+                if job:
+                    self._lanes.move_to_end(lane)
+                    break
+
+        if job is None:
+            return None
+
+        if not self._lanes[job.lane]:
+            del self._lanes[job.lane]
+
+        self._queued[job.user] -= 1
+        if not self._queued[job.user]:
+            del self._queued[job.user]
+
+        self._running[job.user] = self._running.get(job.user, 0) + 1
+        self._lane_running[job.lane] = self._lane_running.get(job.lane, 0) + 1
+        return job
+
+    def _finished(self, job: Job, duration: float):
+        self._costs[job.kind] = (
+            COST_SMOOTHING * duration + (1 - COST_SMOOTHING) * self.expected_cost(job.kind))
+
+        self._running[job.user] -= 1
+        if not self._running[job.user]:
+            del self._running[job.user]
+
+        self._lane_running[job.lane] -= 1
+        if not self._lane_running[job.lane]:
+            del self._lane_running[job.lane]
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None and not self._stopped:
+                    self._cond.wait()
+                    job = self._next_job()
+
+                if job is None:
+                    return
+
+            start = time.perf_counter()
+            STAGE_DURATION.observe(start - job.enqueued, stage='queue', provider=job.lane)
+            try:
+                job.run()
+            except Exception:
+                logger.exception('Card job failed')
+            finally:
+                with self._cond:
+                    self._finished(job, time.perf_counter() - start)
+                    QUEUE_DEPTH.dec()
+
+                    # Users and lanes under their limits again may have jobs waiting
+                    self._cond.notify_all()
+
+    def _start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name='card-worker-{}'.format(i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        """Stop the workers once they've finished any running jobs
+
+        Jobs still waiting in the queue are discarded.
+
+        :param timeout: Seconds to wait for running jobs in total
+        """
+        with self._cond:
+            self._stopped = True
+            dropped = sum(self._queued.values())
+            QUEUE_DEPTH.dec(dropped)
+            self._lanes.clear()
+            self._queued.clear()
+            self._cond.notify_all()
+
+        if dropped:
+            logger.warning('Dropped %d queued card request(s) while stopping', dropped)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+
+        running = sum(thread.is_alive() for thread in self._threads)
+        if running:
+            logger.warning('Stopped with %d card job(s) still running', running)
+
+
+scheduler = FairScheduler.from_environ()
@@ -0,0 +1,108 @@
+#
+# Micro-batching for upstream APIs that accept many IDs per request.
+#
+import threading
+import time
+from concurrent.futures import Future
+
+from . import tracing
+
+
+class Batcher:
+    """Coalesce concurrent single-key lookups into batched calls
+
+    The first caller to request a key becomes the leader for the pending
+    batch: it waits `window` seconds for other threads to add their keys,
+    then resolves everything collected with a single call to `func`.
+    Everyone else blocks until the leader's call completes.
+
+    Args:
+        func:       Callable accepting a list of keys and returning a dict
+                    of key -> result. Keys missing from the dict resolve
+                    to None.
+        window:     Seconds to collect additional keys before flushing
+        max_size:   Maximum keys per call to `func`. A full batch is
+                    flushed immediately by whoever filled it.
+    """
+
+    def __init__(self, func: callable, window: float = 0.01, max_size: int = 100):
+        self.func = func
+        self.window = window
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def get(self, key):
+        """Resolve a single key, batched with any concurrent requests"""
+        return self.get_many([key])[key]
+
+    def get_many(self, keys: list) -> dict:
+        """Resolve multiple keys, batched with any concurrent requests"""
+        futures = {}
+        leader = False
+        full = []
+
+        with self._lock:
+            for key in keys:
+                if key in self._pending:
+                    futures[key] = self._pending[key]
+                    continue
+
+                if not self._pending:
+                    leader = True
+
+                futures[key] = self._pending[key] = Future()
+                if len(self._pending) >= self.max_size:
+                    full.append(self._take())
+
+        for batch in full:
+            self._resolve(batch)
+
+        if leader:
+            time.sleep(self.window)
+            self.flush()
+
+        results = {key: future.result() for key, future in futures.items()}
+        self._link_trace(futures.values())
+        return results
+
+    def _link_trace(self, futures):
+        """Point our trace at the one the batched call was traced in, if it isn't ours"""
+        span = tracing.current_span()
+        if not span:
+            return
+
+        for future in futures:
+            trace_id = getattr(future, 'trace_id', None)
+            if trace_id and trace_id != span.trace_id:
+                span.set('batch_trace_id', trace_id)
+                return
+
+    def flush(self):
+        """Resolve everything currently pending"""
+        with self._lock:
+            batch = self._take()
+
+        if batch:
+            self._resolve(batch)
+
+    def _take(self) -> dict:
+        batch = self._pending
+        self._pending = {}
+        return batch
+
+    def _resolve(self, batch: dict):
+        # Everyone waiting on this batch can find the call in our trace
+        span = tracing.current_span()
+        for future in batch.values():
+            future.trace_id = span.trace_id if span else None
+
+        try:
+            results = self.func(list(batch.keys()))
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+            return
+
+        for key, future in batch.items():
+            future.set_result(results.get(key))
@@ -0,0 +1,367 @@
+#
+# Caches for provider data that is expensive to fetch upstream.
+#
+# Caches are in-memory by default. When CACHE_PATH is set, caches made
+# with `create_cache` are stored in a SQLite database (in WAL mode) at
+# that path instead, so that every process on the host - shards and
+# extra instances alike - shares what any one of them has fetched.
+#
+import os
+import time
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from . import tracing
+from .metrics import CACHE_REQUESTS
+
+_MISSING = object()
+
+
+class Uncached:
+    """Result of a `get_or_set` fill that should be returned but not stored
+
+    e.g. a fallback built while an upstream was failing, which may well
+    be better the next time around.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Cache:
+    """Shared behaviour of the cache backends
+
+    Subclasses implement `_lookup`, `_fill`, `set`, `delete`, `clear` and `__len__`.
+    """
+
+    name = None
+
+    def _lookup(self, key):
+        """Return the cached value for `key`, or `_MISSING`"""
+        raise NotImplementedError()
+
+    def get(self, key, default=None):
+        """Return the cached value for `key`, or `default` if missing or expired"""
+        value = self._lookup(key)
+
+        if self.name:
+            result = 'miss' if value is _MISSING else 'hit'
+            CACHE_REQUESTS.inc(cache=self.name, result=result)
+            tracing.annotate(**{'cache.' + self.name: result})
+
+        return default if value is _MISSING else value
+
+    def __contains__(self, key) -> bool:
+        """Whether `key` is cached, without counting it as a hit or miss"""
+        return self._lookup(key) is not _MISSING
+
+    def get_or_set(self, key, func: callable):
+        """Return the cached value for `key`, calling `func()` to fill it if missing
+
+        Concurrent callers missing the same key wait for a single call
+        to `func` rather than all calling it. Exceptions from `func` are
+        raised to everyone waiting and nothing is cached. Neither is a
+        result `func` wraps in `Uncached`.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        return self._fill(key, func)
+
+    def _fill(self, key, func: callable):
+        raise NotImplementedError()
+
+    def _call(self, key, func: callable):
+        """Call `func` for a missing key, storing the result unless it's `Uncached`"""
+        value = func()
+        if isinstance(value, Uncached):
+            return value.value
+
+        self.set(key, value)
+        return value
+
+
+class TTLCache(Cache):
+    """Thread-safe in-memory cache with per-cache expiry
+
+    Entries expire `ttl` seconds after they were set. Once `max_size`
+    entries are stored, the least recently used entries are evicted.
+
+    Args:
+        ttl:        Seconds an entry stays valid
+        max_size:   Maximum number of entries to keep
+        name:       Name to report hits and misses under, if any
+    """
+
+    def __init__(self, ttl: float, max_size: int = 1024, name: str = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.name = name
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._loading = {}
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return _MISSING
+
+            self._entries.move_to_end(key)
+            return value
+
+    def _fill(self, key, func: callable):
+        with self._lock:
+            future = self._loading.get(key)
+            leader = future is None
+            if leader:
+                future = self._loading[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = self._lookup(key)
+            if value is _MISSING:
+                value = self._call(key, func)
+
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[key]
+
+    def set(self, key, value):
+        """Store `value` for `key` for the next `ttl` seconds"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedCache(Cache):
+    """Cache shared between processes through a SQLite database
+
+    Same interface as `TTLCache`. Values are stored as JSON, so they come
+    back as plain data (tuples as lists), and nothing read from the file
+    can run code. Keys are stored by `repr`, so they should be plain data
+    too. Expiry uses wall clock time, as that's the only clock processes
+    agree on.
+
+    `get_or_set` holds a lock row in the database while filling a key,
+    so only one process on the host fetches a missing entry.
+
+    Args:
+        path:           Database file, shared by every cache using it
+        name:           Cache name, which keeps caches in one file apart
+        ttl:            Seconds an entry stays valid
+        max_size:       Maximum number of entries to keep. Entries closest
+                        to expiring are evicted first.
+        lock_timeout:   Seconds another process may hold the lock for a
+                        key before we stop waiting and fill it ourselves
+    """
+
+    # Expired entries and excess rows are cleaned up every this many sets
+    PURGE_INTERVAL = 100
+
+    # Seconds between checks while another process fills a key
+    POLL_INTERVAL = 0.05
+
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        ttl: float,
+        max_size: int = 1024,
+        lock_timeout: float = 30
+    ):
+        self.path = path
+        self.name = name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock_timeout = lock_timeout
+        self._local = threading.local()
+        self._sets = 0
+
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    cache TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    expires REAL NOT NULL,
+                    value BLOB NOT NULL,
+                    PRIMARY KEY (cache, key)
+                )
+            ''')
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS locks (
+                    cache TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    expires REAL NOT NULL,
+                    PRIMARY KEY (cache, key)
+                )
+            ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connection for the current thread"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+
+        return db
+
+    def _lookup(self, key):
+        row = self._connect().execute(
+            'SELECT value FROM entries WHERE cache = ? AND key = ? AND expires >= ?',
+            (self.name, repr(key), time.time())
+        ).fetchone()
+
+        if row is None:
+            return _MISSING
+
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            # Written by an older version, or otherwise unreadable
+            return _MISSING
+
+    def set(self, key, value):
+        """Store `value` for `key` for the next `ttl` seconds"""
+        self._connect().execute(
+            'INSERT OR REPLACE INTO entries (cache, key, expires, value) VALUES (?, ?, ?, ?)',
+            (self.name, repr(key), time.time() + self.ttl, json.dumps(value))
+        )
+
+        self._sets += 1
+        if self._sets % self.PURGE_INTERVAL == 0:
+            self.purge()
+
+    def purge(self):
+        """Drop expired entries and anything over `max_size`"""
+        db = self._connect()
+        db.execute(
+            'DELETE FROM entries WHERE cache = ? AND expires < ?',
+            (self.name, time.time()))
+        db.execute('''
+            DELETE FROM entries WHERE cache = ? AND key IN (
+                SELECT key FROM entries WHERE cache = ?
+                ORDER BY expires DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.name, self.name, self.max_size))
+
+    def _try_lock(self, key) -> bool:
+        """Take the fill lock for `key`, unless someone else holds an unexpired one"""
+        db = self._connect()
+        now = time.time()
+
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(
+                'DELETE FROM locks WHERE cache = ? AND key = ? AND expires < ?',
+                (self.name, repr(key), now))
+            cursor = db.execute(
+                'INSERT OR IGNORE INTO locks (cache, key, expires) VALUES (?, ?, ?)',
+                (self.name, repr(key), now + self.lock_timeout))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+        return cursor.rowcount == 1
+
+    def _unlock(self, key):
+        self._connect().execute(
+            'DELETE FROM locks WHERE cache = ? AND key = ?', (self.name, repr(key)))
+
+    def _fill(self, key, func: callable):
+        deadline = time.monotonic() + self.lock_timeout
+
+        while not self._try_lock(key):
+            time.sleep(self.POLL_INTERVAL)
+
+            value = self._lookup(key)
+            if value is not _MISSING:
+                return value
+
+            if time.monotonic() > deadline:
+                # Whoever holds the lock is stuck, don't wait on them forever
+                value = func()
+                return value.value if isinstance(value, Uncached) else value
+
+        try:
+            value = self._lookup(key)
+            if value is _MISSING:
+                value = self._call(key, func)
+
+            return value
+        finally:
+            self._unlock(key)
+
+    def delete(self, key):
+        self._connect().execute(
+            'DELETE FROM entries WHERE cache = ? AND key = ?', (self.name, repr(key)))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM entries WHERE cache = ?', (self.name,))
+
+    def __len__(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM entries WHERE cache = ? AND expires >= ?',
+            (self.name, time.time())
+        ).fetchone()[0]
+
+
+# Every cache made with `create_cache`, so they can be cleared together
+named_caches = []
+
+
+def create_cache(name: str, ttl: float, max_size: int = 1024) -> Cache:
+    """Create a named cache, shared between processes if CACHE_PATH is set
+
+    Args:
+        name:       Cache name, used for metrics and to keep shared caches apart
+        ttl:        Seconds an entry stays valid
+        max_size:   Maximum number of entries to keep
+    """
+    path = os.environ.get('CACHE_PATH')
+    if path:
+        cache = SharedCache(path, name, ttl, max_size)
+    else:
+        cache = TTLCache(ttl, max_size, name)
+
+    named_caches.append(cache)
+    return cache
+
+
+def clear_caches():
+    """Empty every cache made with `create_cache` (e.g. between benchmark runs)"""
+    for cache in named_caches:
+        cache.clear()
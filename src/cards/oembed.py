@@ -0,0 +1,201 @@
+#
+# oEmbed (https://oembed.com) cards for video and audio sites.
+#
+# Sites like Vimeo, SoundCloud and Spotify serve heavy app-shell HTML
+# but also publish a small JSON summary of each page. Known sites are
+# mapped to their endpoints directly; anything else can advertise one
+# with a <link rel="alternate" type="application/json+oembed"> tag,
+# which we only use for videos, photos and other thumbnailed media.
+#
+import re
+import codecs
+import logging
+import ipaddress
+import requests
+from datetime import timedelta
+from urllib.parse import urljoin, urlparse
+
+from src.metrics import stage
+from src.render import Template
+from src.util import url_to_data_uri
+
+# Stop reading a page after this many bytes if </head> hasn't shown up yet
+MAX_HEAD_BYTES = 64 * 1024
+
+OEMBED_LINK_PATTERN = re.compile(
+    r'<link\b[^>]*\btype=["\']application/json\+oembed["\'][^>]*>', re.IGNORECASE)
+HREF_PATTERN = re.compile(r'\bhref=["\']([^"\']+)["\']', re.IGNORECASE)
+# Both `<meta charset="...">` and `<meta http-equiv="Content-Type" content="...; charset=...">`
+META_CHARSET_PATTERN = re.compile(rb'<meta\b[^>]*\bcharset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+# oEmbed response types worth a card of their own
+MEDIA_TYPES = ('video', 'photo')
+
+logger = logging.getLogger('Mumble.oembed')
+
+OEMBED_CARD = Template('''
+    <table>
+        <tr>
+            <td>
+                <a href="{url}"><img src="{thumbnail}" /></a>
+            </td>
+            <td>
+                <a href="{url}"><b>{title}</b></a>
+                <br/>
+                {details}
+            </td>
+        </tr>
+    </table>
+''')
+
+
+def create_card_for_endpoint(endpoint: str, url: str) -> '(str | None)':
+    """Card a URL through a known provider's oEmbed endpoint"""
+    request_url = requests.Request('GET', endpoint, params={
+        'url': url,
+        'format': 'json',
+    }).prepare().url
+
+    return create_oembed_card(url, request_url)
+
+
+def read_head(url: str, headers: dict = None) -> '(str | None)':
+    """Read a page only up to the end of its <head>
+
+    :return str|None: Everything up to and including </head>, or None if
+                      the page couldn't be read or its <head> didn't end
+                      within MAX_HEAD_BYTES
+    """
+    try:
+        with stage('page', url=url), requests.get(url, headers=headers, stream=True) as r:
+            if not r.ok:
+                return None
+
+            content = b''
+            for chunk in r.iter_content(chunk_size=8192):
+                content += chunk
+                end = content.lower().find(b'</head>')
+                if end >= 0:
+                    head = content[:end + len('</head>')]
+                    return head.decode(head_encoding(r, head), errors='replace')
+
+                if len(content) >= MAX_HEAD_BYTES:
+                    break
+    except requests.RequestException as e:
+        logger.debug('Could not read page head: %s', e, extra={'url': url})
+
+    return None
+
+
+def head_encoding(r: requests.Response, head: bytes) -> str:
+    """Character encoding of a page's <head>
+
+    requests assumes ISO-8859-1 for text/html without a charset in the
+    Content-Type header, so that's only used when the server actually
+    sent one. Otherwise the page's own <meta charset> wins, then UTF-8.
+    """
+    if 'charset=' in r.headers.get('Content-Type', '').lower() and r.encoding:
+        return r.encoding
+
+    match = META_CHARSET_PATTERN.search(head)
+    if match:
+        encoding = match.group(1).decode('ascii')
+        try:
+            codecs.lookup(encoding)
+            return encoding
+        except LookupError:
+            pass
+
+    return 'utf-8'
+
+
+def site_of(host: str) -> str:
+    """Registrable part of a host name, e.g. `vimeo.com` for `player.vimeo.com`"""
+    labels = host.lower().rstrip('.').split('.')
+
+    # Keep `example.co.uk` rather than `co.uk`
+    count = 3 if len(labels) > 2 and len(labels[-1]) == 2 and len(labels[-2]) <= 3 else 2
+    return '.'.join(labels[-count:])
+
+
+def is_same_site(url: str, other: str) -> bool:
+    host = urlparse(url).hostname or ''
+    other_host = urlparse(other).hostname or ''
+
+    try:
+        # Addresses have to match exactly
+        ipaddress.ip_address(other_host)
+        return host == other_host
+    except ValueError:
+        return bool(other_host) and site_of(host) == site_of(other_host)
+
+
+def find_endpoint(url: str, head: str) -> '(str | None)':
+    """Find an oEmbed endpoint advertised in a page's <head>
+
+    Relative links are resolved against the page. Endpoints are only
+    trusted on the same site as the page, so a page can't point us at
+    arbitrary (e.g. internal) hosts.
+
+    :return str|None: Complete oEmbed request URL
+    """
+    link = OEMBED_LINK_PATTERN.search(head)
+    href = HREF_PATTERN.search(link.group(0)) if link else None
+    if not href:
+        return None
+
+    endpoint = urljoin(url, href.group(1).replace('&amp;', '&'))
+    if urlparse(endpoint).scheme not in ('http', 'https') or not is_same_site(url, endpoint):
+        logger.debug('Ignoring oEmbed endpoint %s', endpoint, extra={'url': url})
+        return None
+
+    return endpoint
+
+
+def format_duration(seconds) -> str:
+    return str(timedelta(seconds=int(seconds)))
+
+
+def create_oembed_card(url: str, endpoint: str, media_only: bool = False) -> '(str | None)':
+    """Build a card from an oEmbed JSON response
+
+    :param url: Original link
+    :param endpoint: Complete oEmbed request URL
+    :param media_only: Only card videos, photos and anything with a thumbnail.
+                       Blogs and social sites advertise `rich`/`link` responses
+                       without one, and their meta tags make a better card.
+
+    :return str|None: Card HTML, or None if the provider had nothing for us
+    """
+    try:
+        with stage('api', 'oembed', url=endpoint) as span:
+            r = requests.get(endpoint)
+            span.set('bytes', len(r.content))
+
+        if r.status_code != 200:
+            return None
+
+        data = r.json()
+    except (requests.RequestException, ValueError) as e:
+        # Let the caller fall back to a card from meta tags
+        logger.debug('oEmbed request failed: %s', e, extra={'url': url})
+        return None
+
+    if not isinstance(data, dict) or not data.get('title'):
+        return None
+
+    if media_only and data.get('type') not in MEDIA_TYPES and not data.get('thumbnail_url'):
+        return None
+
+    # e.g. `Vimeo · Some Channel · 0:04:13`
+    details = [data.get('provider_name'), data.get('author_name')]
+    if data.get('duration'):
+        details.append(format_duration(data['duration']))
+
+    return OEMBED_CARD.render(
+        url=url,
+        thumbnail=url_to_data_uri(data.get('thumbnail_url')),
+        title=data['title'],
+        details=' · '.join([d for d in details if d])
+    )
+
@@ -4,31 +4,183 @@
 #
 import requests
 import re
+import html
 from bs4 import BeautifulSoup
 
+from src import ratelimit
+from src.batch import Batcher
+from src.cache import create_cache
+from src.metrics import stage
+from src.render import Markup, Template, join
 from src.util import url_to_data_uri
 
-STEAM_WORKSHOP__ITEM_PATTERN = r'https?://steamcommunity.com/(sharedfiles|workshop)/filedetails/.*\?id=(?P<itemid>[\d]+).*'
-STEAM_APP_PATTERN = r'https?://store.steampowered.com/app/(?P<appid>[\d]+)'
+APP_DETAILS_API = 'https://store.steampowered.com/api/appdetails/'
+APP_DETAILS_FILTERS = 'basic,price_overview,release_date,genres'
+APP_PRICE_FILTERS = 'price_overview'
+PUBLISHED_FILE_DETAILS_API = 'https://api.steampowered.com/ISteamRemoteStorage/GetPublishedFileDetails/v1/'
+
+# App facts (name, description, genres, header image, reviews) rarely
+# change, but prices and discounts do. Cache them separately so a repeat
+# card only needs a price refresh, or nothing at all.
+STATIC_CACHE_TTL = 3 * 24 * 60 * 60
+PRICE_CACHE_TTL = 5 * 60
+
+static_app_cache = create_cache('steam_app', STATIC_CACHE_TTL)
+price_cache = create_cache('steam_price', PRICE_CACHE_TTL)
+
+# Workshop cards only need the name of the item's app
+app_name_cache = create_cache('steam_app_name', STATIC_CACHE_TTL)
 
 class SteamApiException(Exception):
     pass
 
+def steam_request(method: str, url: str, **kwargs) -> requests.Response:
+    """Make a request against Steam's shared rate limit budget"""
+    ratelimit.acquire('steam')
+
+    with stage('api', 'steam', url=url) as span:
+        r = requests.request(method, url, **kwargs)
+        span.set('bytes', len(r.content))
+
+    ratelimit.check_response('steam', r.headers, r.status_code)
+    return r
+
+def get_published_file_details(itemids: list) -> dict:
+    """Look up many workshop items with a single call to the Steam Web API
+
+    GetPublishedFileDetails doesn't need an API key and accepts any number
+    of IDs per POST. Items that are private, deleted, or otherwise not
+    returned by the API are omitted from the result.
+
+    :param itemids: Workshop file IDs
+
+    :return dict: Item ID -> publishedfiledetails entry
+    """
+    data = {'itemcount': len(itemids)}
+    for i, itemid in enumerate(itemids):
+        data['publishedfileids[{}]'.format(i)] = itemid
+
+    r = steam_request('POST', PUBLISHED_FILE_DETAILS_API, data=data)
+    r.raise_for_status()
+
+    details = r.json().get('response', {}).get('publishedfiledetails', [])
+    return {
+        d['publishedfileid']: d for d in details
+        # result is an EResult code, 1 = OK
+        if d.get('result') == 1 and d.get('title')
+    }
+
+# Concurrent workshop lookups are collected for a few ms and resolved together
+workshop_details = Batcher(get_published_file_details, window=0.01)
+
+def request_app_details(appids: list, filters: str = APP_DETAILS_FILTERS) -> '(dict | None)':
+    """Single appdetails request for one or more app IDs
+
+    Steam only answers queries for more than one app when they're
+    filtered to just `price_overview`.
+
+    `filters` only trims the payload down to field groups. The card needs
+    `basic` for name, short_description, is_free and header_image, which
+    still brings along the HTML descriptions, system requirements and
+    supported languages. What's saved is everything outside those groups:
+    screenshots, movies, DLC lists, packages, achievements and so on.
+
+    :return dict|None: Raw appdetails JSON, or None if Steam rejected the query
+    """
+    r = steam_request('GET', APP_DETAILS_API, params={
+        'appids': ','.join(appids),
+        'filters': filters,
+        'cc': 'us',
+        'l': 'en',
+    })
+
+    if r.status_code != 200:
+        return None
+
+    return r.json() or None
+
+def get_app_details(appid: str) -> '(dict | None)':
+    """Look up the details of a single Steam app
+
+    These can't be batched like prices, since Steam refuses multi-app
+    queries for any filters other than `price_overview`.
+
+    :param appid: Steam App ID
+
+    :return dict|None: appdetails `data`, or None for invalid apps
+    """
+    entry = (request_app_details([appid]) or {}).get(appid)
+    if entry and entry.get('success'):
+        return entry.get('data')
+
+    return None
+
+def get_app_prices(appids: list) -> dict:
+    """Look up only the current price of many Steam apps at once
+
+    Steam always accepts multi-app queries filtered to `price_overview`.
+
+    :param appids: Steam App IDs
+
+    :return dict: App ID -> price_overview, or None for apps without a price
+    """
+    details = request_app_details(appids, APP_PRICE_FILTERS) or {}
+
+    prices = {}
+    for appid, entry in details.items():
+        if entry and entry.get('success'):
+            # Free and unreleased apps come back with an empty list as `data`
+            data = entry.get('data')
+            prices[appid] = {
+                'price_overview': data.get('price_overview') if isinstance(data, dict) else None
+            }
+
+    return prices
+
+# Price refreshes for Steam links that arrive together (sale threads,
+# link dumps) share one request
+app_prices = Batcher(get_app_prices, window=0.01)
+
+def get_app_name(appid: str) -> '(str | None)':
+    """Retrieve just the display name of a Steam app
+
+    The name is only a nicety on workshop cards, so this returns None
+    instead of failing the card if Steam can't tell us.
+    """
+    cached = static_app_cache.get(appid)
+    if cached:
+        return cached['data']['name']
+
+    def fetch():
+        entry = (request_app_details([appid], 'basic') or {}).get(appid)
+        if not entry or not entry.get('success'):
+            raise SteamApiException('Invalid App ID')
+
+        return entry['data']['name']
+
+    try:
+        return app_name_cache.get_or_set(appid, fetch)
+    except (SteamApiException, ratelimit.RateLimited, requests.RequestException):
+        return None
+
+def strip_bbcode(text: str) -> str:
+    """Strip out BBCode tags (e.g. `[b]`, `[url=...]`) from workshop descriptions"""
+    return re.sub(r'\[/?[a-z0-9*]+(=[^\]]*)?\]', '', text, flags=re.IGNORECASE)
+
 class SteamApp:
     """Information about a specific Steam app on the store
 
     Attributes are pulled directly from the `data` of the appdetails API,
-    as well as some custom calculated attributes.
+    as well as some custom calculated attributes. Only the field groups
+    listed in `APP_DETAILS_FILTERS` are requested.
 
     Useful attributes include:
         - name
         - short_description
-        - logo_url
-        - movies
+        - header_image
+        - is_free
+        - price_overview
         - release_date [.coming_soon, .date]
-        - publishers
-        - developers
-        - controller_support
 
     :param appid: Steam App ID
     """
@@ -41,32 +193,62 @@ class SteamApp:
     def __init__(self, appid: str):
         self.appid = appid
         self.loaded = False
+        self._logo_b64 = None
         self.scraped = {
             'reviews': []
         }
 
     def load_from_api(self):
-        """Populate attributes from available Steam APIs"""
+        """Populate attributes from available Steam APIs
 
-        details_api = 'https://store.steampowered.com/api/appdetails/?appids={}&cc=us&l=en&json=1'
-        # reviews_api = 'https://store.steampowered.com/appreviews/{}?json=1'
-        store_url = 'https://store.steampowered.com/app/{}'
+        Static app facts and prices are cached separately, so this will
+        only hit Steam for whatever has expired.
+        """
+        cached = static_app_cache.get(self.appid)
+        price = price_cache.get(self.appid) if cached else None
 
-        # TODO: Async this up
-        r = requests.get(details_api.format(self.appid))
-        details_json = r.json()
+        if cached and not price:
+            price = app_prices.get(self.appid)
+            if price:
+                price_cache.set(self.appid, price)
 
-        # Make sure the API is bringing back real app data
-        if not details_json or not details_json[self.appid]['success']:
-            raise SteamApiException('Invalid App ID')
+        if not cached or not price:
+            data = get_app_details(self.appid)
 
-        self.data = details_json[self.appid]['data']
+            # Make sure the API is bringing back real app data
+            if not data:
+                raise SteamApiException('Invalid App ID')
+
+            static = {k: v for k, v in data.items() if k != 'price_overview'}
+            cached = {
+                'data': static,
+                'reviews': self.scrape_reviews(),
+            }
+            price = {'price_overview': data.get('price_overview')}
+
+            static_app_cache.set(self.appid, cached)
+            price_cache.set(self.appid, price)
+
+        self.data = dict(cached['data'])
+        if price['price_overview']:
+            self.data['price_overview'] = price['price_overview']
+
+        self.scraped['reviews'] = list(cached['reviews'])
+        self.loaded = True
 
-        # Reviews - scraped from the store page since the official API only
-        # provides overall review aggregation and not a split for recent vs all
-        r = requests.get(store_url.format(self.appid))
+    def scrape_reviews(self) -> list:
+        """Scrape review summaries from the store page
+
+        The official API only provides overall review aggregation
+        and not a split for recent vs all.
+        """
+        # reviews_api = 'https://store.steampowered.com/appreviews/{}?json=1'
+        store_url = 'https://store.steampowered.com/app/{}'
+
+        r = steam_request('GET', store_url.format(self.appid))
         soup = BeautifulSoup(r.content, features='html.parser')
 
+        reviews = []
         for subtitle in soup.select('div.subtitle'):
             for caption in subtitle.stripped_strings:
                 if caption == 'Recent Reviews:' or caption == 'All Reviews:':
@@ -77,16 +259,19 @@ class SteamApp:
                     # desc = subtitle.parent.select('span.responsive_reviewdesc')
 
                     if summary and count:
-                        self.scraped['reviews'].append({
+                        reviews.append({
                             'type': caption[:-1],
                             'summary': summary[0].get_text(strip=True),
                             'count': count[0].get_text(strip=True)[1:-1]
                         })
 
-        self.loaded = True
+        return reviews
 
     @property
     def title(self) -> str:
+        if not self.loaded:
+            self.load_from_api()
+
         return self.data['name']
 
     @property
@@ -130,7 +315,7 @@ class SteamApp:
         if not self.loaded:
             self.load_from_api()
 
-        return [c['description'] for c in self.data['categories']]
+        return [c['description'] for c in self.data.get('categories', [])]
 
     @property
     def genres(self) -> list:
@@ -141,7 +326,7 @@ class SteamApp:
         if not self.loaded:
             self.load_from_api()
 
-        return [g['description'] for g in self.data['genres']]
+        return [g['description'] for g in self.data.get('genres', [])]
 
     @property
     def reviews(self) -> list:
@@ -201,7 +386,8 @@ class SteamApp:
 class SteamWorkshopItem:
     """Information about a specific item on the Steam Workshop
 
-    Attributes are primarily pulled from web scraping since there's no API (afaik?)
+    Attributes are pulled from the batched GetPublishedFileDetails API,
+    falling back to web scraping the item page if the API has no data.
 
     Properties:
         itemid (str): Workshop file ID
@@ -218,9 +404,27 @@ class SteamWorkshopItem:
         }
 
     def load_from_api(self):
+        details = workshop_details.get(self.itemid)
+        if not details:
+            return self.load_from_html()
+
+        self.scraped['appname'] = get_app_name(str(details['consumer_app_id']))
+        self.scraped['title'] = details['title']
+        self.scraped['description'] = strip_bbcode(details.get('description', ''))
+        self.scraped['logo'] = details.get('preview_url')
+
+        # The API only provides a flat list of tags, unlike the store page
+        # which groups them into categories (e.g. "Assets: Scripting, Dice")
+        tags = [t['tag'] for t in details.get('tags', [])]
+        if tags:
+            self.scraped['tags'].append(['Tags', ', '.join(tags)])
+
+        self.loaded = True
+
+    def load_from_html(self):
         workshop_url = 'https://steamcommunity.com/sharedfiles/filedetails/?id={}'
 
-        r = requests.get(workshop_url.format(self.itemid))
+        r = steam_request('GET', workshop_url.format(self.itemid))
         soup = BeautifulSoup(r.content, features='html.parser')
 
         # Extract basic info (item name, app name)
@@ -263,8 +467,106 @@ class SteamWorkshopItem:
         return self.scraped['logo']
 
 
+PRICE_BOX = Template('''
+    <table border="2" style="border-color: #000000; border-style: solid" cellpadding="2" cellspacing="0">
+        <tr>
+            <td style="background-color: #000000; color: #acdbf5">{price}</td>
+        </tr>
+    </table>
+''')
+
+DISCOUNTED_PRICE_BOX = Template('''
+    <table border="2" style="border-color: #000000; border-style: solid" cellpadding="2" cellspacing="0">
+        <tr>
+            <td style="font-size: large; background-color: #4c6b22; color: #a4d007">{discount}</td>
+            <td style="background-color: #000000; color: #acdbf5">{price}</td>
+        </tr>
+    </table>
+''')
+
+WORKSHOP_TAG = Template('<br/><b>{name}:</b> {values}')
+
+WORKSHOP_APP = Template('<span> for {app}</span>')
+
+WORKSHOP_ITEM_CARD = Template('''
+    <table>
+        <tr>
+            <td>
+                <a href="{url}"><img src="{thumbnail}" /></a>
+            </td>
+            <td>
+                <a href="{url}">{title}</a>{app}
+                <p>{description}</p>
+            </td>
+        </tr>
+    </table>
+    <table>
+        <tr>
+            <td>
+                <p style="font-size: small; color:#666666">{tags_left}</p>
+            </td>
+            <td>
+                <p style="font-size: small; color:#666666">{tags_right}</p>
+            </td>
+        </tr>
+    </table>
+''')
+
+RELEASE_DATE = Template('<b>{label}:</b> {date}')
+
+REVIEW_SUMMARY = Template('<b>{type}:</b> {summary} ({count})')
+
+EARLY_ACCESS_WARNING = Template('''
+    <table border="3" style="margin-top: 10px; border-style: solid; border-color: #000000" cellspacing="1">
+        <tr>
+            <td style="background: #000000; color: #fc9403">
+            ⚠️Early Access Meme⚠️
+            </td>
+        </tr>
+    </table>
+''').render()
+
+APP_CARD = Template('''
+    <table>
+        <tr>
+            <td>
+                <a href="{url}"><img src="{thumbnail}" /></a>
+                {price_box}
+            </td>
+            <td>
+                <a href="{url}">{title}</a>
+
+                {early_access_warning}
+
+                <p>{description}</p>
+
+                <p style="font-size: small; color: #666666">
+                    {small_text}
+                </p>
+            </td>
+        </tr>
+    </table>
+''')
+
+GENERIC_STEAM_CARD = Template('''
+    <table>
+        <tr>
+            <td>
+                <a href="{url}"><img src="{thumbnail}" /></a>
+            </td>
+            <td>
+                <a href="{url}"><b>{title}</b></a>
+                <p>{description}</p>
+            </td>
+        </tr>
+    </table>
+''')
+
 def format_description(text: str) -> str:
-    """Htmlize and trim description content"""
+    """Decode and trim description content"""
+    # Store descriptions come with HTML entities (&quot; etc) pre-encoded
+    text = html.unescape(text)
+
     if len(text) > 200:
         text = text[:200] + '...'
 
@@ -276,22 +578,9 @@ def open_with_steam(url: str) -> str:
 def create_steam_price_box(app: SteamApp) -> str:
     # Note that some qt table CSS rules don't apply to Mumble's renderer.
     if app.discount:
-        return '''
-            <table border="2" style="border-color: #000000; border-style: solid" cellpadding="2" cellspacing="0">
-                <tr>
-                    <td style="font-size: large; background-color: #4c6b22; color: #a4d007">{discount}</td>
-                    <td style="background-color: #000000; color: #acdbf5">{price}</td>
-                </tr>
-            </table>
-        '''.format(price=app.price, discount=app.discount)
-
-    return '''
-            <table border="2" style="border-color: #000000; border-style: solid" cellpadding="2" cellspacing="0">
-                <tr>
-                    <td style="background-color: #000000; color: #acdbf5">{price}</td>
-                </tr>
-            </table>
-    '''.format(price=app.price)
+        return DISCOUNTED_PRICE_BOX.render(price=app.price, discount=app.discount)
+
+    return PRICE_BOX.render(price=app.price)
 
 def create_content_for_workshop_item(meta: dict, item: SteamWorkshopItem) -> str:
     # Tag list (different per item and workshop app)
@@ -299,110 +588,45 @@ def create_content_for_workshop_item(meta: dict, item: SteamWorkshopItem) -> str
     # Example: Tabletop Simulator games have 8 tags (Category, complexity,
     # number of players, play time, etc) and contain lists for tags, like
     # "Assets: Scripting, Sounds, Dice, Cards, Figurines, Rules".
-    tags_left = ''
-    tags_right = ''
+    tags_left = []
+    tags_right = []
     left = True
     for tag in item.tags:
         if left:
-            tags_left += '<br/><b>{}:</b> {}'.format(tag[0], tag[1])
+            tags_left.append(WORKSHOP_TAG.render(name=tag[0], values=tag[1]))
         else:
-            tags_right += '<br/><b>{}:</b> {}'.format(tag[0], tag[1])
+            tags_right.append(WORKSHOP_TAG.render(name=tag[0], values=tag[1]))
         left = not left
 
-    return '''
-        <table>
-            <tr>
-                <td>
-                    <a href="{url}"><img src="{thumbnail}" /></a>
-                </td>
-                <td>
-                    <a href="{url}">{title}</a> for {app}
-                    <p>{description}</p>
-                </td>
-            </tr>
-        </table>
-        <table>
-            <tr>
-                <td>
-                    <p style="font-size: small; color:#666666">{tags_left}</p>
-                </td>
-                <td>
-                    <p style="font-size: small; color:#666666">{tags_right}</p>
-                </td>
-            </tr>
-        </table>
-    '''.format(
+    return WORKSHOP_ITEM_CARD.render(
         url=open_with_steam(meta['url']),
         thumbnail=meta['thumbnail'],
         title=item.title,
         description=format_description(item.description),
-        app=item.appname,
-        tags_left=tags_left,
-        tags_right=tags_right,
+        app=WORKSHOP_APP.render(app=item.appname) if item.appname else '',
+        tags_left=join(tags_left),
+        tags_right=join(tags_right),
     )
 
 def create_content_for_app(meta: dict, app: SteamApp) -> str:
-    # Additional context-aware information about the app.
-    release_date = ''
-    if app.is_early_access:
-        if app.is_unreleased:
-            release_date = '<br/><b>Unreleased Early Access Meme</b>'
-        else:
-            release_date = '<br/><b>Early Access Meme</b>'
-    else:
-        if app.is_unreleased:
-            release_date = '<b>Releases:</b> {}'.format(app.release_date['date'])
-        else:
-            release_date = '<b>Released:</b> {}'.format(app.release_date['date'])
-
     # Review aggregation if we have any
     small_text = ''
     if not app.is_unreleased and app.reviews:
-        small_text = ' · '.join([
-            '<b>{type}:</b> {summary} ({count})'.format(**x) for x in app.reviews
-        ])
+        small_text = join([REVIEW_SUMMARY.render(**x) for x in app.reviews], ' · ')
     else:
         # No reviews, is it early access / to be released?
         if app.is_unreleased:
-            small_text = '<b>Releases:</b> {}'.format(app.release_date['date'])
+            small_text = RELEASE_DATE.render(label='Releases', date=app.release_date['date'])
         elif app.release_date['date']:
-            small_text = '<b>Released:</b> {}'.format(app.release_date['date'])
+            small_text = RELEASE_DATE.render(label='Released', date=app.release_date['date'])
         else:
-            small_text = '<b>No release date</b>'
+            small_text = Markup('<b>No release date</b>')
 
     early_access_warning = ''
     if app.is_early_access:
-        early_access_warning = '''
-            <table border="3" style="margin-top: 10px; border-style: solid; border-color: #000000" cellspacing="1">
-                <tr>
-                    <td style="background: #000000; color: #fc9403">
-                    ⚠️Early Access Meme⚠️
-                    </td>
-                </tr>
-            </table>
-        '''
-
-    return '''
-        <table>
-            <tr>
-                <td>
-                    <a href="{url}"><img src="{thumbnail}" /></a>
-                    {price_box}
-                </td>
-                <td>
-                    <a href="{url}">{title}</a>
-
-                    {early_access_warning}
-
-                    <p>{description}</p>
-
-                    <p style="font-size: small; color: #666666">
-                        {small_text}
-                    </p>
-                </td>
-            </tr>
-        </table>
-    '''.format(
+        early_access_warning = EARLY_ACCESS_WARNING
+
+    return APP_CARD.render(
         url=open_with_steam(meta['url']),
         thumbnail=meta['thumbnail'],
         early_access_warning=early_access_warning,
@@ -410,41 +634,34 @@ def create_content_for_app(meta: dict, app: SteamApp) -> str:
         description=format_description(app.short_description),
         price_box=create_steam_price_box(app),
         small_text=small_text,
-        release_date=release_date,
     )
 
+def create_card_for_workshop_url(url: str, itemid: str) -> str:
+    item = SteamWorkshopItem(itemid)
+    item.load_from_api()
+
+    meta = {
+        'url': url,
+        'thumbnail': url_to_data_uri(item.logo_url),
+    }
+
+    return create_content_for_workshop_item(meta, item)
+
+def create_card_for_app_url(url: str, appid: str) -> str:
+    app = SteamApp(appid)
+
+    meta = {
+        'url': url,
+        'thumbnail': app.logo_base64,
+    }
+
+    return create_content_for_app(meta, app)
+
 def create_steam_card(meta: dict) -> str:
-    # Try the app/workshop specific parsers. If they fail because our web scraping
-    # didn't get what it needed or it's some other steam page (like a profile)
-    # then fallback to the default thumbnail + description handler.
-    # try:
-    match = re.match(STEAM_WORKSHOP__ITEM_PATTERN, meta['url'])
-    if match:
-        item = SteamWorkshopItem(match.group('itemid'))
-        item.load_from_api()
-        return create_content_for_workshop_item(meta, item)
-
-    match = re.match(STEAM_APP_PATTERN, meta['url'])
-    if match:
-        app = SteamApp(match.group('appid'))
-        return create_content_for_app(meta, app)
-    # except:
-    #     pass
-
-    # Everything else - fallback to meta tags
-    return '''
-        <table>
-            <tr>
-                <td>
-                    <a href="{url}"><img src="{thumbnail}" /></a>
-                </td>
-                <td>
-                    <a href="{url}"><b>{title}</b></a>
-                    <p>{description}</p>
-                </td>
-            </tr>
-        </table>
-    '''.format(
+    # Apps and workshop items are routed to their own providers by URL.
+    # Everything else (profiles, community hubs, etc) gets a Steam-flavored
+    # generic card that opens within the Steam client.
+    return GENERIC_STEAM_CARD.render(
         url=open_with_steam(meta['url']),
         thumbnail=meta['thumbnail'],
         title=meta['title'],
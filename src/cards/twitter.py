@@ -3,8 +3,14 @@
 #
 import os
 import re
+import html
+import threading
 import tweepy
 
+from src import ratelimit
+from src.batch import Batcher
+from src.metrics import stage
+from src.render import Markup, Template, escape, join
 from src.util import pretty_datetime, url_to_data_uri
 
 # A bearer token is sufficient - we only need read-only access to public info
@@ -12,6 +18,133 @@ TWITTER_API_BEARER_TOKEN = None
 if "TWITTER_BEARER_TOKEN" in os.environ:
     TWITTER_API_BEARER_TOKEN = os.environ['TWITTER_BEARER_TOKEN']
 
+# get_tweets accepts up to 100 IDs per request
+TWEETS_API_MAX_IDS = 100
+
+client = None
+client_lock = threading.Lock()
+
+EMBED_CARD = Template('''
+    <a href="{url}">
+        <table>
+            <tr>
+                <td>
+                    <img src="{thumbnail}" />
+                </td>
+                <td>
+                    {title}
+
+                    <p style="font-size: small; color:#666666">
+                        {description}
+                    </p>
+                </td>
+            </tr>
+        </table>
+    </a>
+''')
+
+MEDIA_THUMBNAIL = Template('<a href="{url}"><img src="{thumbnail}" /></a>')
+
+# Create Mumble-compliant DOM
+# https://doc.qt.io/qt-5/richtext-html-subset.html
+TWEET_CARD = Template('''
+    <table>
+        <tr>
+            <td>
+                <a href="https://twitter.com/{username}">
+                    <img src="{profile_thumbnail}" />
+                </a>
+            </td>
+            <td>
+                <a href="https://twitter.com/{username}">
+                    {name}
+                    <br/>
+                    <span style="color: #666666">@{username}</span>
+                </a>
+            </td>
+        </tr>
+    </table>
+
+    <p>{text}</p>
+    {embeds}
+    <p>{thumbnails}</p>
+
+    <a href="https://twitter.com/twitter/status/{tweet_id}">
+        <span style="font-size: small; color: #666666">
+            {date} · <b>{retweets:,}</b> Retweets · <b>{likes:,}</b> Likes
+        </span>
+    </a>
+''')
+
+
+class RateLimitedClient(tweepy.Client):
+    """API client that spends from (and corrects) Twitter's rate limit budget"""
+
+    def request(self, method, route, params=None, json=None, user_auth=False):
+        ratelimit.acquire('twitter')
+
+        try:
+            with stage('api', 'twitter', route=route):
+                response = super().request(method, route, params, json, user_auth)
+        except tweepy.HTTPException as e:
+            ratelimit.update_from_headers(
+                'twitter', e.response.headers, e.response.status_code)
+
+            if e.response.status_code == 429:
+                raise ratelimit.RateLimited(
+                    'twitter', ratelimit.buckets['twitter'].retry_after()) from e
+            raise
+
+        ratelimit.update_from_headers('twitter', response.headers)
+        return response
+
+
+def get_client() -> tweepy.Client:
+    """Shared, long-lived API client (and its HTTP connection pool)"""
+    global client
+
+    with client_lock:
+        if client is None:
+            client = RateLimitedClient(bearer_token=TWITTER_API_BEARER_TOKEN)
+
+        return client
+
+
+def get_tweets(tweet_ids: list) -> dict:
+    """Look up many tweets, with their authors and media, in one request
+
+    :param tweet_ids: Up to 100 tweet IDs
+
+    :return dict: Tweet ID -> dict of `tweet`, `user` and `media`.
+                  Deleted or protected tweets are omitted.
+    """
+    r = get_client().get_tweets(
+        tweet_ids,
+        tweet_fields=['created_at', 'public_metrics', 'entities', 'attachments'],
+        user_fields=['verified', 'profile_image_url'],
+        media_fields=['preview_image_url', 'url'],
+        expansions=['attachments.media_keys', 'author_id']
+    )
+
+    # Expansions for every tweet in the batch are merged into one `includes`
+    users = {user.id: user for user in r.includes.get('users', [])}
+    media = {m.media_key: m for m in r.includes.get('media', [])}
+
+    results = {}
+    for tweet in r.data or []:
+        media_keys = (tweet.attachments or {}).get('media_keys', [])
+        results[str(tweet.id)] = {
+            'tweet': tweet,
+            'user': users.get(tweet.author_id),
+            'media': [media[key] for key in media_keys if key in media],
+        }
+
+    return results
+
+
+# Tweets requested at the same time are combined into a single lookup
+tweets = Batcher(get_tweets, window=0.02, max_size=TWEETS_API_MAX_IDS)
+
 
 def create_card_for_misc(meta: dict) -> str:
     """Handle non-tweets (by not presenting anything)"""
@@ -29,7 +162,7 @@ def create_cards_for_embedded_urls(entities: dict) -> str:
     if 'urls' not in entities:
         return ''
 
-    html = ''
+    cards = []
     for url in entities['urls']:
         # We skip anything that's just an embedded url
         # that wasn't thumbnail-ized by Twitter. These
@@ -37,31 +170,14 @@ def create_cards_for_embedded_urls(entities: dict) -> str:
         if 'images' not in url:
             continue
 
-        html += '''
-            <a href="{url}">
-                <table>
-                    <tr>
-                        <td>
-                            <img src="{thumbnail}" />
-                        </td>
-                        <td>
-                            {title}
-
-                            <p style="font-size: small; color:#666666">
-                                {description}
-                            </p>
-                        </td>
-                    </tr>
-                </table>
-            </a>
-        '''.format(
+        cards.append(EMBED_CARD.render(
             url=url['unwound_url'],  # t.co -> zpr.io -> youtube
             description=url['description'],
             title=url['title'],
             thumbnail=url_to_data_uri(url['images'][0]['url'], 128)
-        )
+        ))
 
-    return html
+    return join(cards)
 
 
 def link_to_tweet(tweet_id: str) -> str:
@@ -73,19 +189,13 @@ def link_to_tweet(tweet_id: str) -> str:
     return 'https://twitter.com/twitter/status/' + tweet_id
 
 
-def create_card_for_tweet(tweet_id: str, meta: dict) -> str:
-    client = tweepy.Client(bearer_token=TWITTER_API_BEARER_TOKEN)
-
-    # Pull down the tweet
-    r = client.get_tweets(
-        tweet_id,
-        tweet_fields=['created_at', 'public_metrics', 'entities'],
-        user_fields=['verified', 'profile_image_url'],
-        media_fields=['preview_image_url', 'url'],
-        expansions=['attachments.media_keys', 'author_id']
-    )
+def create_card_for_tweet(tweet_id: str) -> str:
+    # Pull down the tweet (batched with any other tweets being carded)
+    result = tweets.get(tweet_id)
+    if not result or not result['user']:
+        return ''
 
-    tweet = r.data[0]
+    tweet = result['tweet']
 
     text = tweet.text
 
@@ -94,12 +204,14 @@ def create_card_for_tweet(tweet_id: str, meta: dict) -> str:
     if 'entities' in tweet:
         text = tweet.text[:-23]
 
-    text = re.sub(r'\n', '<br/>', text)  # nl2br
+    # Tweet text comes with &amp; &lt; &gt; already encoded
+    text = escape(html.unescape(text))
+    text = Markup(re.sub(r'\n', '<br/>', text))  # nl2br
 
     metrics = tweet.public_metrics
 
     # Parse out the author
-    user = r.includes['users'][0]
+    user = result['user']
     profile_thumbnail = url_to_data_uri(user.profile_image_url, 64, True)
 
     # Parse out embedded content (urls) and convert into inline blocks
@@ -109,9 +221,9 @@ def create_card_for_tweet(tweet_id: str, meta: dict) -> str:
 
     # Parse out attached media, if any, and convert into inline thumbnails
     thumbnails = []
-    if 'media' in r.includes:
-        media_count = len(r.includes['media'])
-        for media in r.includes['media']:
+    if result['media']:
+        media_count = len(result['media'])
+        for media in result['media']:
             # If we have multiple media, we generate a thumbnail grid instead
             size = 128 if media_count > 1 else 256
 
@@ -126,48 +238,18 @@ def create_card_for_tweet(tweet_id: str, meta: dict) -> str:
                 url = link_to_tweet(tweet_id)
 
             thumbnails.append(
-                '<a href="{}"><img src="{}" /></a>'.format(url, data_uri))
+                MEDIA_THUMBNAIL.render(url=url, thumbnail=data_uri))
 
     # TODO: Embed posts that someone was replying to?
 
-    # Create Mumble-compliant DOM
-    # https://doc.qt.io/qt-5/richtext-html-subset.html
-    return '''
-        <table>
-            <tr>
-                <td>
-                    <a href="https://twitter.com/{username}">
-                        <img src="{profile_thumbnail}" />
-                    </a>
-                </td>
-                <td>
-                    <a href="https://twitter.com/{username}">
-                        {name}
-                        <br/>
-                        <span style="color: #666666">@{username}</span>
-                    </a>
-                </td>
-            </tr>
-        </table>
-
-        <p>{text}</p>
-        {embeds}
-        <p>{thumbnails}</p>
-
-        <a href="https://twitter.com/twitter/status/{tweet_id}">
-            <span style="font-size: small; color: #666666">
-                {date} · <b>{retweets:,}</b> Retweets · <b>{likes:,}</b> Likes
-            </span>
-        </a>
-
-    '''.format(
+    return TWEET_CARD.render(
         tweet_id=tweet_id,
         profile_thumbnail=profile_thumbnail,
         name=user.name,
         username=user.username,
         date=pretty_datetime(tweet.created_at, relative=False),
         text=text,
-        thumbnails=''.join(thumbnails),
+        thumbnails=join(thumbnails),
         embeds=embeds,
         replies=metrics['reply_count'],
         retweets=metrics['retweet_count'],
@@ -176,9 +258,17 @@ def create_card_for_tweet(tweet_id: str, meta: dict) -> str:
     )
 
 
+def create_card_for_tweet_url(url: str, id: str) -> '(str | None)':
+    """Status links are carded from the API, Twitter pages have no meta tags"""
+    if not TWITTER_API_BEARER_TOKEN:
+        return None
+
+    return create_card_for_tweet(id)
+
+
 def create_twitter_card(meta: dict) -> str:
     match = re.search(r'status/(?P<id>\d+)', meta['url'])
     if match and TWITTER_API_BEARER_TOKEN:
-        return create_card_for_tweet(match.group('id'), meta)
+        return create_card_for_tweet(match.group('id'))
 
     return create_card_for_misc(meta)
@@ -1,9 +1,64 @@
 import os
+import logging
+import threading
 import requests
-import random
 from datetime import datetime, timedelta
 
-from src.util import parse_isoduration, pretty_datetime
+from src import ratelimit
+from src.batch import Batcher
+from src.metrics import stage
+from src.render import Markup, Template
+from src.util import parse_isoduration, pretty_datetime, url_to_data_uri
+
+
+VIDEOS_API = 'https://www.googleapis.com/youtube/v3/videos'
+
+# Partial response - only what the cards actually render.
+# Skips descriptions, tags, localizations and the extra thumbnail sizes.
+VIDEOS_API_FIELDS = (
+    'items('
+    'id,'
+    'snippet(title,channelTitle,publishedAt,thumbnails(default/url,medium/url)),'
+    'contentDetails/duration,'
+    'statistics/viewCount'
+    ')'
+)
+
+# videos.list accepts up to 50 IDs and costs 1 quota unit per call
+VIDEOS_API_MAX_IDS = 50
+VIDEOS_API_QUOTA_COST = 1
+
+logger = logging.getLogger('Mumble.youtube')
+
+VIDEO_CARD = Template('''
+    <table>
+        <tr>
+            <td>
+                <a href="{url}"><img src="{thumbnail}" /></a>
+            </td>
+            <td>
+                <a href="{url}"><b>{title}</b></a>
+                <br/>
+                {description}
+            </td>
+        </tr>
+    </table>
+''')
+
+# We're going to kinda mimic google results here
+VIDEO_DESCRIPTION = Template('''
+    YouTube · {channel} · {duration}
+
+    <p style="font-size: small; color: #666666">
+        <b>{views:,}</b> Views · {date}
+    </p>
+''')
+
+quota_lock = threading.Lock()
+quota_usage = {
+    'units': 0,
+    'videos': 0,
+}
 
 
 def get_api_key() -> str:
@@ -13,25 +68,100 @@ def get_api_key() -> str:
     return None
 
 
+def get_videos(video_ids: list) -> dict:
+    """Retrieve many video resources with one YouTube Data API call
+
+    :param video_ids: Up to 50 video IDs
+
+    :return dict: Video ID -> video resource. Missing videos are omitted.
+    """
+    ratelimit.acquire('youtube', VIDEOS_API_QUOTA_COST)
+
+    with stage('api', 'youtube', ids=len(video_ids)) as span:
+        r = requests.get(VIDEOS_API, params={
+            'id': ','.join(video_ids),
+            'key': get_api_key(),
+            'part': 'snippet,contentDetails,statistics',
+            'fields': VIDEOS_API_FIELDS,
+        })
+        span.set('bytes', len(r.content))
+
+    ratelimit.check_response('youtube', r.headers, r.status_code)
+
+    # Daily quota is gone. It resets at midnight Pacific, but we don't
+    # know how far off that is - check back in an hour.
+    if r.status_code == 403 and 'quotaExceeded' in r.text:
+        ratelimit.buckets['youtube'].block_for(60 * 60)
+        raise ratelimit.RateLimited('youtube', 60 * 60)
+
+    r.raise_for_status()
+
+    with quota_lock:
+        quota_usage['units'] += VIDEOS_API_QUOTA_COST
+        quota_usage['videos'] += len(video_ids)
+
+        logger.info(
+            'YouTube quota: %d unit(s) for %d video(s), %d units for %d videos total',
+            VIDEOS_API_QUOTA_COST,
+            len(video_ids),
+            quota_usage['units'],
+            quota_usage['videos']
+        )
+
+    return {item['id']: item for item in r.json().get('items', [])}
+
+
+# Video IDs requested within a short window share one API call
+videos = Batcher(get_videos, window=0.02, max_size=VIDEOS_API_MAX_IDS)
+
+
+def get_video(video_id: str) -> '(dict | None)':
+    """Retrieve a single video resource from the YouTube Data API
+
+    Batched with any other videos being requested at the same time.
+
+    :return dict|None: The video resource, or None if it doesn't exist
+    """
+    return videos.get(video_id)
+
+
+def get_thumbnail_url(info: dict) -> '(str | None)':
+    """Pick the smallest API thumbnail that's still big enough for a card"""
+    thumbnails = info['snippet'].get('thumbnails', {})
+    for size in ('medium', 'default'):
+        if size in thumbnails:
+            return thumbnails[size]['url']
+
+    return None
+
+
+def create_card_for_video(url: str, id: str) -> '(str | None)':
+    """Build a video card purely from the Data API, without the watch page
+
+    :return str|None: Card HTML, or None if the video couldn't be found
+                      or we don't have access to the Data API.
+    """
+    if get_api_key() is None:
+        return None
+
+    info = get_video(id)
+    if not info:
+        return None
+
+    return VIDEO_CARD.render(
+        url=url,
+        thumbnail=url_to_data_uri(get_thumbnail_url(info)),
+        title=info['snippet']['title'],
+        description=format_video_description(info)
+    )
+
+
 def create_youtube_card(meta: dict) -> str:
     if get_api_key() is None:
         raise ValueError(
             'This feature requires an API key for YouTube Data API v3')
 
-    return '''
-        <table>
-            <tr>
-                <td>
-                    <a href="{url}"><img src="{thumbnail}" /></a>
-                </td>
-                <td>
-                    <a href="{url}"><b>{title}</b></a>
-                    <br/>
-                    {description}
-                </td>
-            </tr>
-        </table>
-    '''.format(
+    return VIDEO_CARD.render(
         url=meta['url'],
         thumbnail=meta['thumbnail'],
         title=meta['title'],
@@ -60,18 +190,15 @@ def create_youtube_video_description(meta: dict) -> str:
     if video_id.find('?') > 0:
         video_id = video_id[:video_id.find('?')]
 
-    url = 'https://www.googleapis.com/youtube/v3/videos?id={video_id}&key={key}&part=snippet,contentDetails,statistics,status'.format(
-        video_id=video_id,
-        key=YOUTUBE_DATA_API_KEY
-    )
+    info = get_video(video_id)
+    if not info:
+        return ''
 
-    r = requests.get(url)
-    json = r.json()
+    return format_video_description(info)
 
-    if len(json['items']) < 1:
-        return ''
 
-    info = json['items'][0]
+def format_video_description(info: dict) -> str:
+    """Summarize channel, duration, views and publish date of a video resource"""
     published_at = datetime.strptime(
         info['snippet']['publishedAt'], "%Y-%m-%dT%H:%M:%S%z")
     duration = info['contentDetails']['duration']
@@ -81,26 +208,14 @@ def create_youtube_video_description(meta: dict) -> str:
         td = timedelta(**t)
         duration = td
     except:  # Live videos don't have a valid duration
-        duration = '<b>Live</b>'
-
-    views = int(info['statistics']['viewCount'])
-    likes = int(info['statistics']['likeCount'])
-
-    random.seed(views)
-    dislikes = int(likes * random.random() * 3)  # lol
+        duration = Markup('<b>Live</b>')
 
-    # We're going to kinda mimic google results here
-    return '''
-        YouTube · {channel} · {duration}
+    # Channels can hide view counts
+    views = int(info['statistics'].get('viewCount', 0))
 
-        <p style="font-size: small; color: #666666">
-            <b>{views:,}</b> Views · {date}
-        </p>
-    '''.format(
+    return VIDEO_DESCRIPTION.render(
         duration=duration,
         channel=info['snippet']['channelTitle'],
         views=views,
-        likes=likes,
-        dislikes=dislikes,
         date=pretty_datetime(published_at, relative=False, include_time=False)
     )
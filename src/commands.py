@@ -1,12 +1,19 @@
 
+import os
 import re
+import logging
 import functools
 import requests
 import MumbleServer
-from .factories import create_card
+from . import admission, profiler
+from .factories import card_kind, create_card
+from .metrics import BYTES_SENT, stage
+from .tracing import span
 
 command_subscribers = []
 
+logger = logging.getLogger('Mumble.commands')
+
 
 class TextMessage(MumbleServer.TextMessage):
     """Wrapper for Mumble TextMessages to add additional message context
@@ -87,7 +94,8 @@ def publish(
     for command in command_subscribers:
         match = command['prog'].search(msg.text)
         if match:
-            command['func'](wrapped, **match.groupdict())
+            with span('publish', command=command['func'].__name__, user=getattr(user, 'name', None)):
+                command['func'](wrapped, **match.groupdict())
             return
 
 
@@ -132,10 +140,96 @@ def any_url(msg: TextMessage, url: str):
         msg (TextMessage):  TextMessage that triggered this command response
         url (str):          URL to cardify
     """
-    # try:
-    html = create_card(url)
-    for channel in msg.channels:
-        msg.server.sendMessageChannel(channel, False, html)
-    # except:
-    #     # Ignore anything we can't cardify
-    #     logger.error()
+    # Cards are generated on the admission workers, subject to flood
+    # control. Cheap cards skip ahead of slow providers.
+    admitted = admission.scheduler.submit(
+        user_key(msg), msg.channels + msg.trees, card_and_reply, msg, url, kind=card_kind(url))
+
+    if not admitted:
+        logger.info('Flood control dropped a card', extra={'url': url})
+
+
+def user_key(msg: TextMessage) -> tuple:
+    """Identify the sender of a message across virtual servers
+
+    Sessions are only unique within a virtual server, so the key
+    includes the identity of the server's proxy.
+    """
+    return (msg.server.ice_getIdentity().name, msg.user.session if msg.user else None)
+
+
+def card_and_reply(msg: TextMessage, url: str):
+    reply_to_channels(msg, create_card(url))
+
+
+def reply_to_channels(msg: TextMessage, text: str):
+    """Send a reply to every channel and channel tree the message went to
+
+    All sends are issued at once as async Ice invocations, so a message
+    posted to many channels costs one round-trip instead of one each.
+    A targeted tree is covered by a single `tree` send.
+
+    Args:
+        msg (TextMessage):  TextMessage to reply to
+        text (str):         The reply (text or HTML)
+    """
+    targets = [(tree, True) for tree in msg.trees]
+    targets += [
+        (channel, False) for channel in msg.channels
+        # Already covered by its tree
+        if channel not in msg.trees
+    ]
+
+    with stage('send', targets=len(targets), bytes=len(text.encode('utf-8'))):
+        futures = [
+            (channel, tree, msg.server.sendMessageChannelAsync(channel, tree, text))
+            for channel, tree in targets
+        ]
+
+        errors = []
+        for channel, tree, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors.append((channel, tree, e))
+
+    BYTES_SENT.inc(len(text.encode('utf-8')) * (len(targets) - len(errors)))
+
+    for channel, tree, e in errors:
+        logger.error(
+            'Failed to send to %s %d: %s', 'tree' if tree else 'channel', channel, e)
+
+
+def is_admin(user: MumbleServer.User) -> bool:
+    """Check if a registered user is listed in the comma separated ADMIN_USERS envvar
+
+    Unregistered users (userid -1) can connect under any name, so their
+    names are never trusted.
+    """
+    admins = [name.strip() for name in os.environ.get('ADMIN_USERS', '').split(',')]
+    return user is not None and user.userid >= 0 and bool(user.name) and user.name in admins
+
+
+@command(r'^\s*!profile(\s+(?P<seconds>\d+))?\s*$', '!profile [seconds]')
+def profile(msg: TextMessage, seconds: str = None):
+    """Sample the worker threads for a while and write a collapsed-stack profile
+
+    Only available to ADMIN_USERS. Replies privately once the profile is written.
+
+    Args:
+        msg (TextMessage):  TextMessage that triggered this command response
+        seconds (str):      How long to profile for, defaults to 30 seconds
+    """
+    if not is_admin(msg.user):
+        return
+
+    def reply(text):
+        msg.server.sendMessage(msg.user.session, text)
+
+    duration = min(int(seconds or profiler.DEFAULT_DURATION), 600)
+    path = profiler.start(duration, callback=lambda path: reply('Profile written to ' + path))
+
+    if path is None:
+        reply('A profile is already running')
+    else:
+        reply('Profiling for {} seconds'.format(duration))
@@ -1,46 +1,102 @@
 
+import os
+import time
+import logging
 import requests
 import re
-import metadata_parser
+from urllib.parse import urlparse
 
+from .cache import TTLCache, Uncached, create_cache
+from .metrics import CARDS, stage
+from .tracing import annotate
+from .providers import invoke, match_provider
+from .ratelimit import RateLimited
+from .render import Template, escape
 from .util import first_or_default, url_to_data_uri
-from .cards.steam import create_steam_card
-from .cards.twitter import create_twitter_card
-from .cards.youtube import create_youtube_card
+from .cards.oembed import create_oembed_card, find_endpoint, read_head
 
+logger = logging.getLogger('Mumble.cards')
 
-def meta_from_url(url: str) -> dict:
+# Rendered cards for recently posted links. Kept no longer than Steam
+# prices are, since those show up in cards.
+CARD_CACHE_TTL = 5 * 60
+card_cache = create_cache('card', CARD_CACHE_TTL, max_size=2048)
+
+# URLs this process has cached cards for, so jobs can be scheduled as
+# cache hits without querying a shared cache on an Ice dispatch thread
+recent_cards = TTLCache(CARD_CACHE_TTL, max_size=2048)
+
+# What we've learned about each host: its site name and its default
+# og:image (plus thumbnail), which many sites use on every page.
+SITE_CACHE_TTL = 24 * 60 * 60
+site_cache = create_cache('site', SITE_CACHE_TTL, max_size=512)
+
+IMAGE_CARD = Template('<a href="{url}"><img src="{thumbnail}" /></a>')
+
+LINK_CARD = Template('<a href="{url}">{url}</a>')
+
+GENERIC_CARD = Template('''
+    <table>
+        <tr>
+            <td>
+                <a href="{url}"><img src="{thumbnail}" /></a>
+            </td>
+            <td>
+                <a href="{url}"><b>{title}</b></a>
+                <p>{description}</p>
+            </td>
+        </tr>
+    </table>
+''')
+
+# Links that are most likely images, going by their path
+IMAGE_PATH_PATTERN = re.compile(r'\.(png|jpe?g|gif|webp|bmp)$', re.IGNORECASE)
+
+CRAWLER_HEADERS = {
+    # 'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+
+    # So far, spoofing twitter's crawler generates the best results.
+    # Many sites, like Spotify, block Google's or the default UA.
+    # UA list available at: https://github.com/monperrus/crawler-user-agents/blob/master/crawler-user-agents.json
+    'User-Agent': 'Twitterbot/1.0'
+}
+
+
+def meta_from_url(url: str, html: str = None) -> dict:
     """Extract metadata and thumbnails from a URL
+
+    Args:
+        url:    Page URL
+        html:   The page's <head>, if it's already been read.
+                Otherwise the page is downloaded.
     """
-    headers = {
-        # 'User-Agent': 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+    import metadata_parser
 
-        # So far, spoofing twitter's crawler generates the best results.
-        # Many sites, like Spotify, block Google's or the default UA.
-        # UA list available at: https://github.com/monperrus/crawler-user-agents/blob/master/crawler-user-agents.json
-        'User-Agent': 'Twitterbot/1.0'
-    }
+    with stage('meta', url=url):
+        page = metadata_parser.MetadataParser(
+            url=url,
+            html=html,
+            url_headers=CRAWLER_HEADERS,
+            # Try to work with whatever terrible content we get
+            search_head_only=False,
+            force_parse_invalid_content_type=True,
+            support_malformed=True,
+            # strategy=['og', 'dc', 'meta', 'page', 'twitter']
+        )
 
-    page = metadata_parser.MetadataParser(
-        url=url,
-        url_headers=headers,
-        # Try to work with whatever terrible content we get
-        search_head_only=False,
-        force_parse_invalid_content_type=True,
-        support_malformed=True,
-        # strategy=['og', 'dc', 'meta', 'page', 'twitter']
-    )
+    # Canonical site name such as @youtube, @steam, etc. and a thumbnail
+    # for the link. Could be a video thumbnail or the site's logo.
+    site, thumbnail = site_defaults(
+        urlparse(url).netloc.lower(),
+        first_or_default(page.get_metadatas('site')),
+        page.get_metadata_link('image'))
 
     res = {
         'url': url,
         'discrete_url': page.get_discrete_url(),
         'title': first_or_default(page.get_metadatas('title'), 'No title'),
-
-        # Canonical site name such as @youtube, @steam, etc.
-        'site': first_or_default(page.get_metadatas('site'), 'Unknown'),
-
-        # Generate a thumbnail for the link. Could be a video thumbnail or site.
-        'thumbnail': url_to_data_uri(page.get_metadata_link('image')),
+        'site': site or 'Unknown',
+        'thumbnail': thumbnail,
 
         # YouTube and related will provide an og:video:url
         # e.g. 'https://www.youtube.com/embed/pHKVSfcAO2g'
@@ -60,9 +116,54 @@ def meta_from_url(url: str) -> dict:
     return res
 
 
+def site_defaults(host: str, site: str, image: str) -> tuple:
+    """Fill in a page's site name and thumbnail from what we know about its host
+
+    The first page we see from a host is remembered. If another page
+    has the same og:image, that's the site's default image, and every
+    later page using it reuses the stored thumbnail instead of
+    downloading and encoding it again. Pages without a site name or
+    image fall back to the host's.
+
+    Args:
+        host:   Host the page was served from
+        site:   Site name from the page's meta tags, if any
+        image:  og:image URL from the page's meta tags, if any
+
+    :return tuple: (site name or None, thumbnail data URI or None)
+    """
+    known = site_cache.get(host) or {}
+    learned = dict(known)
+
+    if site:
+        learned['site'] = site
+    else:
+        site = known.get('site')
+
+    if image and image == known.get('image'):
+        learned['default'] = True
+        thumbnail = known.get('thumbnail')
+        annotate(thumbnail='site')
+    elif image:
+        thumbnail = url_to_data_uri(image)
+        if not known.get('default'):
+            # Might be the default, we'll know once another page uses it
+            learned.update(image=image, thumbnail=thumbnail)
+    elif known.get('default'):
+        thumbnail = known.get('thumbnail')
+        annotate(thumbnail='site')
+    else:
+        thumbnail = None
+
+    if learned != known:
+        site_cache.set(host, learned)
+
+    return site, thumbnail
+
+
 def create_card_for_image_url(url: str) -> str:
     """Direct links to images get thumbnailed automatically"""
-    return '<a href="{url}"><img src="{thumbnail}" /></a>'.format(
+    return IMAGE_CARD.render(
         url=url,
         thumbnail=url_to_data_uri(url, 300)
     )
@@ -77,7 +178,7 @@ def create_card_for_video_url(url: str) -> str:
     if url.find('4cdn.org') > 0 and url.endswith('.webm'):
         # https://i.4cdn.org/wsg/1651135239075.webm
         # -> https://i.4cdn.org/wsg/1651135239075s.jpg
-        return '<a href="{url}"><img src="{thumbnail}" /></a>'.format(
+        return IMAGE_CARD.render(
             url=url,
             thumbnail=url_to_data_uri(url[:-5] + 's.jpg', 300)
         )
@@ -87,41 +188,63 @@ def create_card_for_video_url(url: str) -> str:
 
 
 def create_card_for_unhandled_mime_type(mime: str, url: str) -> str:
-    return mime
+    return escape(mime)
 
 
 def create_card_for_html(url: str) -> str:
-    info = meta_from_url(url)
+    # The page's <head> is only read once. Video and photo pages that
+    # advertise oEmbed give us a small JSON summary, and everything else
+    # gets its meta tags parsed from the same <head>.
+    head = read_head(url, CRAWLER_HEADERS)
+    endpoint = find_endpoint(url, head) if head else None
+    if endpoint:
+        card = create_oembed_card(url, endpoint, media_only=True)
+        if card:
+            count_card('oembed')
+            return card
+
+    # Without a complete <head>, the scrape downloads the page itself
+    info = meta_from_url(url, head)
 
+    # Site-specific renderers are imported on first use, so sites
+    # we never see (or aren't configured for) never load their dependencies
     try:
         # Twitter is annoying and doesn't expose meta tags
         if re.search('https?://twitter.com', url):
-            return create_twitter_card(info)
+            if not os.environ.get('TWITTER_BEARER_TOKEN'):
+                return ''
+
+            from .cards.twitter import create_twitter_card
+            with stage('render', 'twitter'):
+                card = create_twitter_card(info)
+
+            count_card('twitter')
+            return card
 
         # Meta tags can be used to map specific sites to custom renderers
         if info['site'] == '@youtube':
-            return create_youtube_card(info)
+            from .cards.youtube import create_youtube_card
+            with stage('render', 'youtube'):
+                card = create_youtube_card(info)
+
+            count_card('youtube')
+            return card
         elif info['site'].lower().endswith('steam'):
-            return create_steam_card(info)
+            from .cards.steam import create_steam_card
+            with stage('render', 'steam'):
+                card = create_steam_card(info)
+
+            count_card('steam')
+            return card
     except Exception as e:
-        print(e)
         # Log exception but fallback to a generic card from
         # meta tags so at least we have something.
+        logger.warning('Site card failed: %s', e, extra={'url': url, 'provider': info['site']})
+        annotate(fallback=info['site'])
 
     # Otherwise, use a generic card
-    return '''
-        <table>
-            <tr>
-                <td>
-                    <a href="{url}"><img src="{thumbnail}" /></a>
-                </td>
-                <td>
-                    <a href="{url}"><b>{title}</b></a>
-                    <p>{description}</p>
-                </td>
-            </tr>
-        </table>
-    '''.format(
+    count_card('generic')
+    return GENERIC_CARD.render(
         url=info['url'],
         thumbnail=info['thumbnail'],
         title=info['title'],
@@ -129,16 +252,115 @@ def create_card_for_html(url: str) -> str:
     )
 
 
+def create_degraded_card(url: str) -> str:
+    """Bare link card for when a provider has no budget left"""
+    return LINK_CARD.render(url=url)
+
+
+def count_card(provider: str):
+    """Record which provider built the card for the current URL"""
+    CARDS.inc(provider=provider)
+    annotate(provider=provider)
+
+
+def card_kind(url: str) -> str:
+    """Guess which path will build the card for a URL, without any I/O
+
+    Used on the Ice dispatch thread to schedule cheap cards ahead of slow
+    ones. Only cards built by this process are known to be cached.
+
+    :return str: `cache`, a provider name (`oembed` for sites with known
+                 oEmbed endpoints), `image` or `generic`
+    """
+    if url in recent_cards:
+        return 'cache'
+
+    provider, _ = match_provider(url)
+    if provider:
+        return provider['name']
+
+    if IMAGE_PATH_PATTERN.search(urlparse(url).path):
+        return 'image'
+
+    return 'generic'
+
+
 def create_card(url: str) -> str:
+    start = time.perf_counter()
+    with stage('card', url=url, host=urlparse(url).netloc) as span:
+        built = []
+
+        def build():
+            built.append(True)
+            card = create_card_for_url(url)
+            provider = span.attributes.get('provider')
+
+            # Fallbacks for a failing provider, and empty cards, may be
+            # better the next time the link is posted
+            if not card or 'fallback' in span.attributes:
+                return Uncached((card, provider))
+
+            recent_cards.set(url, True)
+            return card, provider
+
+        try:
+            # The same link is often posted to several channels or
+            # servers at once, so only one of them builds the card.
+            # Hits are counted under the provider that built the card.
+            card, provider = card_cache.get_or_set(url, build)
+            if not built:
+                count_card(provider)
+        except RateLimited as e:
+            # Don't wait around for the provider to recover
+            span.set('rate_limited', e.provider)
+            count_card('degraded')
+            card = create_degraded_card(url)
+
+        span.set('bytes', len(card or ''))
+
+    logger.info('Created card', extra={
+        'url': url,
+        'provider': span.attributes.get('provider'),
+        'duration': '{:.3f}s'.format(time.perf_counter() - start),
+    })
+    return card
+
+
+def create_card_for_url(url: str) -> str:
+    # Known sites are routed from the URL alone. Their providers build
+    # cards from APIs, skipping the pre-flight and the page scrape.
+    provider, groups = match_provider(url)
+    if provider:
+        try:
+            with stage('provider', provider['name'], url=url):
+                card = invoke(provider, url, groups)
+
+            if card:
+                count_card(provider['name'])
+                return card
+        except RateLimited:
+            raise
+        except Exception as e:
+            # Log exception but fallback to a generic card from
+            # meta tags so at least we have something.
+            logger.warning('Provider failed: %s', e, extra={'url': url, 'provider': provider['name']})
+            annotate(fallback=provider['name'])
+
     # Do a pre-flight request for content info
-    head = requests.head(url, allow_redirects=True)
+    with stage('head', url=url) as span:
+        head = requests.head(url, allow_redirects=True)
+        span.set('content_type', head.headers.get('content-type'))
+
     ct = head.headers['content-type']
 
     if ct.startswith('image/'):
+        count_card('image')
         return create_card_for_image_url(url)
     elif ct.startswith('video/'):
+        count_card('video')
         return create_card_for_video_url(url)
     elif ct.startswith('text/html'):
         return create_card_for_html(url)
 
+    count_card('mime')
     return create_card_for_unhandled_mime_type(ct, url)
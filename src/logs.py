@@ -0,0 +1,101 @@
+#
+# Application logging.
+#
+# Handlers that write to files or stdout can block, so loggers only put
+# records on a queue and a single listener thread does the writing.
+# Other loggers (e.g. trace spans) can share that thread through
+# `add_queued_handler`.
+# Card logs carry structured fields (url, provider, duration) through
+# `extra`, which are appended as `key=value` pairs.
+#
+import sys
+import queue
+import logging
+import logging.handlers
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formatter that appends known `extra` fields as `key=value` pairs"""
+
+    FIELDS = ('url', 'provider', 'duration')
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+
+        fields = [
+            '{}={}'.format(name, getattr(record, name))
+            for name in self.FIELDS if getattr(record, name, None) is not None
+        ]
+        if fields:
+            message += ' | ' + ' '.join(fields)
+
+        return message
+
+
+def configure_logging(
+    logger: logging.Logger,
+    level: int,
+    path: str = 'output.log',
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    backups: int = DEFAULT_BACKUPS
+) -> logging.handlers.QueueListener:
+    """Send `logger` records through a queue to a rotating file and stdout
+
+    Stop the returned listener on shutdown to flush anything still queued.
+
+    Args:
+        logger:     Logger to configure, e.g. `Mumble`
+        level:      Minimum level to log
+        path:       Log file, rotated once it reaches `max_bytes`
+        max_bytes:  Size to rotate the log file at
+        backups:    Number of rotated files to keep
+    """
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+    file_handler.setLevel(level)
+    file_handler.setFormatter(StructuredFormatter(
+        '%(asctime)s | %(pathname)s:%(lineno)d | %(funcName)s | %(levelname)s | %(message)s'))
+
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.setLevel(level)
+    stdout_handler.setFormatter(StructuredFormatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        log_queue, file_handler, stdout_handler, respect_handler_level=True)
+
+    logger.setLevel(level)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    listener.start()
+    return listener
+
+
+def add_queued_handler(
+    listener: logging.handlers.QueueListener,
+    logger: logging.Logger,
+    handler: logging.Handler
+):
+    """Write `logger` records to `handler` from `listener`'s thread
+
+    Records on the shared queue are routed by logger name, so `handler`
+    only gets records from `logger`, and the listener's other handlers
+    no longer do.
+
+    Args:
+        listener:   Listener returned by `configure_logging`
+        logger:     Logger to queue records from, e.g. `Mumble.trace`
+        handler:    Handler to write them, e.g. a RotatingFileHandler
+    """
+    routed = logging.Filter(logger.name)
+    for existing in listener.handlers:
+        existing.addFilter(lambda record: not routed.filter(record))
+
+    handler.addFilter(routed)
+    listener.handlers = listener.handlers + (handler,)
+
+    logger.addHandler(logging.handlers.QueueHandler(listener.queue))
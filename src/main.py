@@ -1,44 +1,209 @@
 
 import os
+import signal
 import logging
-import sys
+import time
+import threading
+import multiprocessing
+import multiprocessing.connection
 
 # Import isn't used here, but it needs to happen before zeroc-ice
 # is ever imported, otherwise we get segfaults on https requests.
 # (Still unsolved as to why - may need to open a ticket with zeroc-ice)
 import requests  # nopep8
 
-from src.mumble import mumble_connect  # nopep8
+# Providers load their own dependencies on first use, so this should
+# stay cheap. Reported at startup to catch anything that regresses it.
+import_start = time.perf_counter()
+from src.mumble import mumble_connect, server_filter  # nopep8
+import_duration = time.perf_counter() - import_start
 
+from src import admission, metrics, profiler, tracing  # nopep8
+from src.logs import DEFAULT_BACKUPS, DEFAULT_MAX_BYTES, configure_logging  # nopep8
 
-def main():
-    debug = os.environ.get('DEBUG', '0') != '0'
-    if os.environ.get('ICE_HOST') is None:
-        raise KeyError('Missing required ICE_HOST envvar')
+# Seconds to wait before restarting a shard that exited
+RESTART_DELAY = 5
+
+# Seconds a shard gets to shut down cleanly before it's killed
+STOP_TIMEOUT = 10
+
+# Seconds a stopping shard waits for running card jobs, well within STOP_TIMEOUT
+JOB_STOP_TIMEOUT = 5
+
+
+def shard_path(path: str, index: int, count: int) -> str:
+    """Give each shard its own file, e.g. `output.log` -> `output.shard1.log`
+
+    Rotating file handlers can't share a file between processes.
+    """
+    if count < 2:
+        return path
+
+    root, ext = os.path.splitext(path)
+    return '{}.shard{}{}'.format(root, index, ext)
+
+
+def parse_server_ids(value: str) -> '(list | None)':
+    """Parse a comma separated SERVER_IDS envvar"""
+    if not value:
+        return None
+
+    return [int(server_id) for server_id in value.split(',') if server_id.strip()]
 
+
+def setup_logging(index: int = 0, count: int = 1):
+    """Configure application logging. Records are written from a
+    background thread so logging never blocks an Ice dispatch thread.
+
+    Returns:
+        (logger, listener to stop on shutdown)
+    """
+    debug = os.environ.get('DEBUG', '0') != '0'
     log_level = logging.DEBUG if debug else logging.INFO
 
-    # Configure application logging
-    file_formatter = logging.Formatter(
-        "%(asctime)s | %(pathname)s:%(lineno)d | %(funcName)s | %(levelname)s | %(message)s ")
-    file_handler = logging.FileHandler('output.log')
-    file_handler.setLevel(log_level)
-    file_handler.setFormatter(file_formatter)
+    logger = logging.getLogger('Mumble')
+    listener = configure_logging(
+        logger,
+        log_level,
+        shard_path(os.environ.get('LOG_FILE', 'output.log'), index, count),
+        int(os.environ.get('LOG_MAX_BYTES', DEFAULT_MAX_BYTES)),
+        int(os.environ.get('LOG_BACKUPS', DEFAULT_BACKUPS)))
+
+    return logger, listener
+
+
+def run_shard(index: int = 0, count: int = 1):
+    """Serve the virtual servers assigned to one shard
 
-    stdout_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    stdout_handler = logging.StreamHandler(sys.stdout)
-    stdout_handler.setLevel(log_level)
-    stdout_handler.setFormatter(stdout_formatter)
+    Each shard has its own Ice connection, callback adapter and card
+    queue. With a single shard, that's every virtual server.
+    """
+    logger, log_listener = setup_logging(index, count)
+    if count > 1:
+        logger.info('Starting shard %d of %d', index + 1, count)
+
+    logger.info('Application modules imported in %.1f ms', import_duration * 1000)
+
+    # Prometheus metrics on the port the Dockerfile exposes, and the ones
+    # after it for additional shards. Set to 0 to disable.
+    metrics_port = int(os.environ.get('METRICS_PORT', 5000))
+    if metrics_port:
+        metrics.start_server(metrics_port + index)
+
+    # Per-card span timelines, see src/tracing.py
+    trace_file = os.environ.get('TRACE_FILE')
+    if trace_file:
+        trace_file = shard_path(trace_file, index, count)
+        tracing.configure(
+            trace_file,
+            int(os.environ.get('TRACE_MAX_BYTES', tracing.DEFAULT_MAX_BYTES)),
+            int(os.environ.get('TRACE_BACKUPS', tracing.DEFAULT_BACKUPS)),
+            log_listener)
+        logger.info('Writing traces to %s', trace_file)
+
+    # `kill -USR1` starts a profile of the running bot, see src/profiler.py
+    profiler.install_signal_handler()
+
+    accepts = server_filter(index, count, parse_server_ids(os.environ.get('SERVER_IDS')))
 
     # Open an Ice channel to Mumble
-    logger = logging.getLogger('Mumble')
-    logger.setLevel(log_level)
-    logger.addHandler(file_handler)
-    logger.addHandler(stdout_handler)
+    try:
+        conn = mumble_connect(logger, accepts)
+
+        # The supervisor (or Docker) stops us with SIGTERM. Shut down
+        # cleanly so anything still queued gets logged.
+        def stop(signum, frame):
+            logger.info('Shutting down')
+            conn.shutdown()
+
+        signal.signal(signal.SIGTERM, stop)
+
+        conn.waitForShutdown()
+
+        # No new messages come in after shutdown, but replies can still be
+        # sent until the connection is destroyed. Let running cards finish.
+        admission.scheduler.stop(JOB_STOP_TIMEOUT)
+        conn.destroy()
+    finally:
+        log_listener.stop()
+
+
+def supervise(count: int):
+    """Run `count` shards as separate processes, restarting any that exit
+
+    Virtual servers are split between shards by ID, so a busy server can
+    only starve the others in its own shard, and cards for different
+    shards are generated on different cores.
+    """
+    logger, log_listener = setup_logging()
+    logger.info('Starting %d shards', count)
+
+    # Spawned rather than forked, Ice doesn't survive a fork
+    context = multiprocessing.get_context('spawn')
+    processes = {}
+    stopping = threading.Event()
+
+    def start(index):
+        process = context.Process(target=run_shard, args=(index, count), name='shard-{}'.format(index))
+        process.start()
+        processes[index] = process
+
+    def stop(signum, frame):
+        stopping.set()
+
+    def forward(signum, frame):
+        for process in processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Profile every shard, see src/profiler.py
+    signal.signal(signal.SIGUSR1, forward)
+
+    for index in range(count):
+        start(index)
+
+    try:
+        while not stopping.is_set():
+            multiprocessing.connection.wait([p.sentinel for p in processes.values()], timeout=1)
+
+            for index, process in list(processes.items()):
+                if process.is_alive() or stopping.is_set():
+                    continue
+
+                logger.error(
+                    'Shard %d exited with code %s, restarting in %d seconds',
+                    index, process.exitcode, RESTART_DELAY)
+
+                # Returns early if we're asked to stop in the meantime
+                if stopping.wait(RESTART_DELAY):
+                    break
+
+                start(index)
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning('Shard %s did not stop in time, killing it', process.name)
+                process.kill()
+                process.join()
+
+        log_listener.stop()
+
+
+def main():
+    if os.environ.get('ICE_HOST') is None:
+        raise KeyError('Missing required ICE_HOST envvar')
 
-    conn = mumble_connect(logger)
-    conn.waitForShutdown()
+    shards = int(os.environ.get('SHARDS', 1))
+    if shards > 1:
+        supervise(shards)
+    else:
+        run_shard()
 
 
 if __name__ == '__main__':
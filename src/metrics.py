@@ -0,0 +1,249 @@
+#
+# Prometheus metrics for the card pipeline.
+#
+# A card goes through several slow stages (HEAD, page fetch and parse,
+# provider APIs, thumbnails, the Ice send) and it's hard to tell from the
+# outside which one is to blame. Each stage is timed with `stage()` and
+# everything is served in the Prometheus text format on METRICS_PORT.
+# Stages are also traced as spans, see `src.tracing`.
+#
+import time
+import logging
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import tracing
+
+logger = logging.getLogger('Mumble.metrics')
+
+registry = []
+
+# Seconds. Cards range from a cache hit to several upstream calls.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Base for metrics with an optional set of label names
+
+    Args:
+        name:   Metric name, e.g. `mumble_cards_total`
+        help:   Description shown in the exposition
+        labels: Label names. Values are passed as keyword arguments.
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self) -> list:
+        """Return (suffix, label string, value) for every series"""
+        with self._lock:
+            return [
+                ('', format_labels(self.labels, key), value)
+                for key, value in sorted(self._values.items())
+            ]
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def expose(self) -> str:
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} {}'.format(self.name, self.type),
+        ]
+        for suffix, labels, value in self.samples():
+            lines.append('{}{}{} {}'.format(self.name, suffix, labels, format_value(value)))
+
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Cumulative histogram of observed values
+
+    Args:
+        buckets: Upper bounds, in ascending order. `+Inf` is implied.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def value(self, **labels) -> tuple:
+        """Return (count, sum) for a series"""
+        with self._lock:
+            counts, total = self._values.get(self._key(labels), ([0] * len(self.buckets), 0))
+            return counts[-1], total
+
+    def samples(self) -> list:
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+
+        samples = []
+        for key, (counts, total) in series:
+            for bound, count in zip(self.buckets, counts):
+                le = 'le="{}"'.format(format_value(bound))
+                samples.append(('_bucket', format_labels(self.labels, key, le), count))
+
+            labels = format_labels(self.labels, key)
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, counts[-1]))
+
+        return samples
+
+
+CARDS = Counter(
+    'mumble_cards_total',
+    'Cards sent, by the provider that built them',
+    ('provider',))
+
+STAGE_DURATION = Histogram(
+    'mumble_card_stage_duration_seconds',
+    'Time spent in each stage of building and sending a card',
+    ('stage', 'provider'))
+
+FAILURES = Counter(
+    'mumble_card_failures_total',
+    'Exceptions raised out of a card stage',
+    ('stage', 'provider'))
+
+CACHE_REQUESTS = Counter(
+    'mumble_cache_requests_total',
+    'Cache lookups, by cache and whether they hit',
+    ('cache', 'result'))
+
+QUEUE_DEPTH = Gauge(
+    'mumble_card_queue_depth',
+    'Card requests waiting for or being processed')
+
+BYTES_SENT = Counter(
+    'mumble_bytes_sent_total',
+    'Bytes of message HTML sent to Murmur')
+
+
+@contextlib.contextmanager
+def stage(name: str, provider: str = '', **attributes):
+    """Time a block as a card stage, counting it as failed if it raises
+
+    The block is also traced as a span, which is yielded so that
+    attributes only known afterwards (e.g. response size) can be added.
+
+    Args:
+        name:       Stage name, e.g. `head`, `meta`, `thumbnail`, `api`
+        provider:   Provider the stage ran for, if any
+        attributes: Span attributes, e.g. `url`
+    """
+    start = time.perf_counter()
+    with tracing.span(name, provider=provider or None, **attributes) as span:
+        try:
+            yield span
+        except BaseException:
+            FAILURES.inc(stage=name, provider=provider)
+            raise
+        finally:
+            STAGE_DURATION.observe(time.perf_counter() - start, stage=name, provider=provider)
+
+
+def expose() -> str:
+    """Render every registered metric in the Prometheus text format"""
+    return '\n'.join(metric.expose() for metric in registry) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_server(port: int, host: str = '') -> ThreadingHTTPServer:
+    """Serve metrics on a background thread
+
+    Args:
+        port:   Port to listen on. 0 picks a free port.
+        host:   Interface to bind, all of them by default
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+    thread.start()
+
+    logger.info('Serving metrics on port %d', server.server_address[1])
+    return server
@@ -1,6 +1,8 @@
 import os
+import logging
 import Ice
-Ice.loadSlice('', ['-I' + Ice.getSliceDir(), 'ice/MumbleServer.ice'])
+from src.slice import load_slice
+load_slice(logging.getLogger('Mumble'))
 
 # Import from Ice slice
 import MumbleServer  # nopep8
@@ -8,11 +10,34 @@ from src.commands import publish  # nopep8
 
 meta = None
 
+# Ice properties that can be tuned through envvars, with production defaults.
+#
+# Murmur delivers callbacks for every virtual server over the same
+# connection, so with Ice's default of one dispatch thread a single slow
+# card blocks every other text message. Dispatch is unserialized so
+# events on that one connection can run in parallel.
+ICE_ENV_PROPERTIES = {
+    # envvar: (property, default)
+    'ICE_SERVER_THREADS': ('Ice.ThreadPool.Server.Size', '4'),
+    'ICE_SERVER_THREADS_MAX': ('Ice.ThreadPool.Server.SizeMax', '16'),
+    'ICE_SERVER_SERIALIZE': ('Ice.ThreadPool.Server.Serialize', '0'),
+    'ICE_CLIENT_THREADS': ('Ice.ThreadPool.Client.Size', '2'),
+    'ICE_CLIENT_THREADS_MAX': ('Ice.ThreadPool.Client.SizeMax', '8'),
+    'ICE_CLIENT_SERIALIZE': ('Ice.ThreadPool.Client.Serialize', '0'),
+    # Keep the (often idle) connections to Murmur alive: always send
+    # heartbeats, and never close them on our side for being idle.
+    'ICE_ACM_TIMEOUT': ('Ice.ACM.Timeout', '60'),
+    'ICE_ACM_HEARTBEAT': ('Ice.ACM.Heartbeat', '3'),
+    'ICE_ACM_CLOSE': ('Ice.ACM.Close', '0'),
+    'ICE_MESSAGE_SIZE_MAX': ('Ice.MessageSizeMax', '65535'),
+}
+
 
 class MetaCallback(MumbleServer.MetaCallback):
-    def __init__(self, logger, adapter):
+    def __init__(self, logger, adapter, accepts: callable = None):
         self.logger = logger
         self.adapter = adapter
+        self.accepts = accepts
 
     def started(self, server, current=None):
         """ Called when a server is started.
@@ -22,11 +47,8 @@ class MetaCallback(MumbleServer.MetaCallback):
         """
         self.logger.info('metaCallback started')
 
-        serverR = MumbleServer.ServerCallbackPrx.uncheckedCast(
-            self.adapter.addWithUUID(ServerCallback(server, current.adapter))
-        )
-
-        server.addCallback(serverR)
+        if self.accepts is None or self.accepts(server.id()):
+            attach_server(self.logger, self.adapter, server)
 
     def stopped(self, server, current=None):
         """ Called when a server is stopped.
@@ -64,8 +86,62 @@ def get_mumble_meta():
     return meta
 
 
-def mumble_connect(logger):
+def server_filter(index: int = 0, count: int = 1, server_ids: list = None) -> callable:
+    """Pick the virtual servers a process is responsible for
+
+    Args:
+        index:      This process's shard, from 0 to `count` - 1
+        count:      Number of shards virtual servers are split between
+        server_ids: Only ever accept these virtual server IDs
+
+    Returns:
+        callable accepting a virtual server ID
+    """
+    def accepts(server_id: int) -> bool:
+        if server_ids is not None and server_id not in server_ids:
+            return False
+
+        return server_id % count == index
+
+    return accepts
+
+
+def attach_server(logger, adapter, server):
+    """Attach a ServerCallback to a virtual server's events"""
+    serverR = MumbleServer.ServerCallbackPrx.uncheckedCast(
+        adapter.addWithUUID(ServerCallback(logger, server, adapter))
+    )
+
+    server.addCallback(serverR)
+
+
+def ice_properties(environ: dict = os.environ) -> dict:
+    """Build the Ice properties for connecting to Mumble
+
+    Args:
+        environ:    Environment to read overrides from (see ICE_ENV_PROPERTIES)
+
+    Returns:
+        dict of Ice property name -> value
+    """
+    props = {
+        'Ice.ImplicitContext': 'Shared',
+        'Ice.Default.EncodingVersion': '1.0',
+    }
+
+    for envvar, (name, default) in ICE_ENV_PROPERTIES.items():
+        props[name] = environ.get(envvar, default)
+
+    return props
+
+
+def mumble_connect(logger, accepts: callable = None):
     """
+    Args:
+        logger:     Application logger
+        accepts:    Callable accepting a virtual server ID, to only attach
+                    to some servers (see `server_filter`). Defaults to all.
+
     Returns:
         Mumble Ice runtime
     """
@@ -74,9 +150,9 @@ def mumble_connect(logger):
     logger.info('Configuring Ice')
 
     props = Ice.createProperties()
-    props.setProperty('Ice.ImplicitContext', 'Shared')
-    props.setProperty('Ice.MessageSizeMax', '65535')
-    props.setProperty('Ice.Default.EncodingVersion', '1.0')
+    for name, value in ice_properties().items():
+        logger.debug('%s=%s', name, value)
+        props.setProperty(name, value)
 
     idd = Ice.InitializationData()
     idd.properties = props
@@ -97,18 +173,17 @@ def mumble_connect(logger):
     # Attach event handlers for "meta" events (server start/stop)
     adapter = comm.createObjectAdapterWithEndpoints('Callback.Client', 'tcp')
     metaR = MumbleServer.MetaCallbackPrx.uncheckedCast(
-        adapter.addWithUUID(MetaCallback(logger, adapter))
+        adapter.addWithUUID(MetaCallback(logger, adapter, accepts))
     )
 
     adapter.activate()
     meta.addCallback(metaR)
 
-    # Attach event handlers to all already running server instances
+    # Attach event handlers to already running server instances
     for server in meta.getBootedServers():
-        serverR = MumbleServer.ServerCallbackPrx.uncheckedCast(
-            adapter.addWithUUID(ServerCallback(logger, server, adapter))
-        )
-
-        server.addCallback(serverR)
+        server_id = server.id()
+        if accepts is None or accepts(server_id):
+            logger.info('Attaching to virtual server %d', server_id)
+            attach_server(logger, adapter, server)
 
     return comm
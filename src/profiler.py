@@ -0,0 +1,129 @@
+#
+# On-demand sampling profiler.
+#
+# When production gets slow we want to see where CPU goes (parsing,
+# Pillow, regex work) without restarting and losing that state. While a
+# profile runs, a background thread samples the stack of every other
+# thread and counts them. The result is written as collapsed stacks, one
+# `frame;frame;frame count` line each, ready for flamegraph.pl or
+# https://www.speedscope.app
+#
+# Profiles are started with SIGUSR1 or the admin-only `!profile` command.
+#
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger('Mumble.profiler')
+
+DEFAULT_DURATION = 30
+DEFAULT_INTERVAL = 0.005
+
+# Only one profile at a time, they'd just be sampling each other
+_running = threading.Lock()
+
+
+def format_frame(frame) -> str:
+    code = frame.f_code
+    return '{} ({}:{})'.format(
+        code.co_name, os.path.basename(code.co_filename), frame.f_lineno)
+
+
+def collapse_stack(frame, thread_name: str) -> str:
+    """Collapse a thread's stack into `thread;outermost;...;innermost`"""
+    frames = []
+    while frame is not None:
+        frames.append(format_frame(frame))
+        frame = frame.f_back
+
+    frames.append(thread_name)
+    return ';'.join(reversed(frames))
+
+
+def sample(counts: Counter, ignore: set = ()):
+    """Add the current stack of every thread (except `ignore`) to `counts`"""
+    names = {t.ident: t.name for t in threading.enumerate()}
+
+    for ident, frame in sys._current_frames().items():
+        if ident in ignore:
+            continue
+
+        counts[collapse_stack(frame, names.get(ident, str(ident)))] += 1
+
+
+def profile(duration: float, interval: float = DEFAULT_INTERVAL) -> Counter:
+    """Sample all other threads for `duration` seconds
+
+    :return Counter: Collapsed stack -> number of samples
+    """
+    counts = Counter()
+    ignore = {threading.get_ident()}
+
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        sample(counts, ignore)
+        time.sleep(interval)
+
+    return counts
+
+
+def write_collapsed(counts: Counter, path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in counts.most_common():
+            f.write('{} {}\n'.format(stack, count))
+
+
+def start(
+    duration: float = DEFAULT_DURATION,
+    directory: str = None,
+    callback: callable = None
+) -> '(str | None)':
+    """Profile in the background and write the result to `directory`
+
+    Args:
+        duration:   Seconds to sample for
+        directory:  Where to write the profile. Defaults to PROFILE_DIR
+                    or the working directory.
+        callback:   Called with the output path once written
+
+    :return str|None: Output path, or None if a profile is already running
+    """
+    if not _running.acquire(blocking=False):
+        return None
+
+    directory = directory or os.environ.get('PROFILE_DIR', '.')
+    # Shards may be profiled at the same time, so the PID keeps their files apart
+    path = os.path.join(directory, 'profile-{}-{}.folded'.format(
+        time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+
+    def run():
+        try:
+            logger.info('Profiling for %d seconds', duration)
+            counts = profile(duration)
+            write_collapsed(counts, path)
+            logger.info('Wrote %d samples to %s', sum(counts.values()), path)
+        except Exception:
+            logger.exception('Profile failed')
+            return
+        finally:
+            _running.release()
+
+        if callback:
+            callback(path)
+
+    threading.Thread(target=run, name='profiler', daemon=True).start()
+    return path
+
+
+def install_signal_handler(signum: int = signal.SIGUSR1):
+    """Start a PROFILE_SECONDS profile whenever `signum` is received"""
+    def handler(signum, frame):
+        duration = int(os.environ.get('PROFILE_SECONDS', DEFAULT_DURATION))
+        if start(duration) is None:
+            logger.warning('Profile already running')
+
+    signal.signal(signum, handler)
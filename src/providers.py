@@ -0,0 +1,193 @@
+#
+# URL router for site-specific card providers.
+#
+# Providers declare the hosts and paths they handle, and a single
+# precompiled regex picks the provider from the URL alone - before any
+# network work is done. Only URLs that no provider claims go through the
+# generic HEAD + OpenGraph scrape.
+#
+# Built-in providers are declared at the bottom of this module by import
+# path, so their modules (and heavy dependencies like tweepy or bs4) are
+# only imported the first time one of their URLs is carded. Providers
+# that need credentials are skipped entirely when those aren't configured.
+#
+import os
+import re
+import time
+import logging
+import importlib
+import threading
+
+provider_subscribers = []
+
+logger = logging.getLogger('Mumble.providers')
+
+_import_lock = threading.Lock()
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+# Named groups in provider patterns are only resolved for the winning
+# provider, so they're stripped from the combined matcher where they'd
+# otherwise collide (e.g. multiple providers capturing an `id`)
+NAMED_GROUP_PATTERN = re.compile(r'\(\?P<\w+>')
+
+
+def register(
+    name: str,
+    host: str,
+    path: str,
+    func: '(callable | str)',
+    requires: str = None,
+    args: tuple = ()
+):
+    """Register a card provider for URLs matching `host` and `path`
+
+    Args:
+        name:       Provider name, used for logging and metrics
+        host:       Regex for the URL host, e.g. `(www\\.)?youtube\\.com`
+        path:       Regex for everything after the host. Named groups are
+                    passed to `func` as keyword arguments.
+        func:       Callable accepting the URL and named groups, returning
+                    card HTML or None to fall back to the generic card.
+                    May be a `module:function` path, imported on first use.
+        requires:   Environment variable that must be set for this
+                    provider to be enabled (e.g. an API key)
+        args:       Extra positional arguments passed to `func` before the URL
+    """
+    global _matcher
+
+    pattern = r'https?://(?:{host})(?::\d+)?{path}'.format(host=host, path=path)
+
+    with _matcher_lock:
+        provider_subscribers.append({
+            'name': name,
+            'pattern': pattern,
+            'prog': re.compile(pattern, re.IGNORECASE),
+            'func': func,
+            'requires': requires,
+            'args': args
+        })
+
+        # Recompiled on next lookup
+        _matcher = None
+
+
+def is_enabled(p: dict) -> bool:
+    """Check whether a provider's required configuration is present"""
+    return not p['requires'] or bool(os.environ.get(p['requires']))
+
+
+def resolve(p: dict) -> callable:
+    """Return a provider's callable, importing its module on first use"""
+    if callable(p['func']):
+        return p['func']
+
+    with _import_lock:
+        if isinstance(p['func'], str):
+            module_name, func_name = p['func'].split(':')
+
+            start = time.perf_counter()
+            module = importlib.import_module(module_name)
+            logger.info(
+                'Loaded %s provider (%s) in %.1f ms',
+                p['name'], module_name, (time.perf_counter() - start) * 1000)
+
+            p['func'] = getattr(module, func_name)
+
+    return p['func']
+
+
+def invoke(p: dict, url: str, groups: dict) -> '(str | None)':
+    """Run a provider for a URL matched by `match_provider`"""
+    return resolve(p)(*p['args'], url, **groups)
+
+
+def compile_matcher() -> re.Pattern:
+    """Combine every provider pattern into one alternation
+
+    Each provider's pattern becomes a `(?P<_N>...)` branch, where N is
+    its index in `provider_subscribers`.
+    """
+    branches = []
+    for i, p in enumerate(provider_subscribers):
+        stripped = NAMED_GROUP_PATTERN.sub('(?:', p['pattern'])
+        branches.append('(?P<_{}>{})'.format(i, stripped))
+
+    return re.compile('|'.join(branches), re.IGNORECASE)
+
+
+def match_provider(url: str) -> tuple:
+    """Pick the provider for a URL without touching the network
+
+    :return tuple: (provider dict, named groups) or (None, None) if no
+                   enabled provider claims the URL
+    """
+    global _matcher
+
+    with _matcher_lock:
+        if _matcher is None:
+            _matcher = compile_matcher()
+        matcher = _matcher
+
+    match = matcher.match(url)
+    if not match or not match.lastgroup:
+        return None, None
+
+    p = provider_subscribers[int(match.lastgroup[1:])]
+    if not is_enabled(p):
+        return None, None
+
+    return p, p['prog'].match(url).groupdict()
+
+
+# Video IDs are always 11 characters of [A-Za-z0-9_-]
+YOUTUBE_VIDEO_ID = r'(?P<id>[\w-]{11})(?![\w-])'
+
+register(
+    'youtube',
+    host=r'(www\.|m\.|music\.)?youtube\.com',
+    path=r'/(watch\?([^#]*&)?v=|shorts/|embed/)' + YOUTUBE_VIDEO_ID,
+    func='src.cards.youtube:create_card_for_video',
+    requires='YOUTUBE_API_KEY'
+)
+register(
+    'youtube',
+    host=r'youtu\.be',
+    path='/' + YOUTUBE_VIDEO_ID,
+    func='src.cards.youtube:create_card_for_video',
+    requires='YOUTUBE_API_KEY'
+)
+register(
+    'twitter',
+    host=r'(www\.|mobile\.)?(twitter|x)\.com',
+    path=r'/[^/]+/status(es)?/(?P<id>\d+)',
+    func='src.cards.twitter:create_card_for_tweet_url',
+    requires='TWITTER_BEARER_TOKEN'
+)
+register(
+    'steam',
+    host=r'steamcommunity\.com',
+    path=r'/(sharedfiles|workshop)/filedetails/.*\?id=(?P<itemid>[\d]+)',
+    func='src.cards.steam:create_card_for_workshop_url'
+)
+register(
+    'steam',
+    host=r'store\.steampowered\.com',
+    path=r'/app/(?P<appid>[\d]+)',
+    func='src.cards.steam:create_card_for_app_url'
+)
+
+# Video and audio sites with known oEmbed endpoints
+for host, endpoint in [
+    (r'(www\.|player\.)?vimeo\.com', 'https://vimeo.com/api/oembed.json'),
+    (r'(www\.|m\.)?soundcloud\.com', 'https://soundcloud.com/oembed'),
+    (r'open\.spotify\.com', 'https://open.spotify.com/oembed'),
+]:
+    register(
+        'oembed',
+        host=host,
+        path='/',
+        func='src.cards.oembed:create_card_for_endpoint',
+        args=(endpoint,)
+    )
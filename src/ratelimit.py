@@ -0,0 +1,171 @@
+#
+# Rate limit tracking for upstream providers (Steam, YouTube, Twitter).
+#
+# Each provider gets a token bucket sized to its published (or observed)
+# limits. Calls spend tokens before going upstream, and buckets are
+# corrected from rate limit headers on the way back. Once a provider is
+# out of budget, calls fail fast with RateLimited so the card factory
+# can send a degraded card instead of queueing up behind a 429.
+#
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+class RateLimited(Exception):
+    """Raised when a provider has no budget left for another call
+
+    Args:
+        provider:       Name of the exhausted provider
+        retry_after:    Seconds until the provider is expected to have budget
+    """
+
+    def __init__(self, provider: str, retry_after: float = None):
+        super().__init__('Rate limited by {}'.format(provider))
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `capacity` tokens per `period`
+
+    Args:
+        capacity:   Maximum number of tokens (burst size)
+        period:     Seconds to refill an empty bucket
+    """
+
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.blocked_until = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Spend `tokens` if available. Returns False if out of budget"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return False
+
+            self._refill(now)
+            if self.tokens < tokens:
+                return False
+
+            self.tokens -= tokens
+            return True
+
+    def release(self, tokens: float = 1):
+        """Give back tokens that were acquired but not used"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def retry_after(self, tokens: float = 1) -> float:
+        """Estimated seconds until `tokens` can be acquired"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+
+            wait = max(0, (tokens - self.tokens) / self.rate)
+            return max(wait, self.blocked_until - now)
+
+    def set_remaining(self, remaining: float):
+        """Clamp the bucket to what the provider says is remaining"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, remaining)
+
+    def block_for(self, seconds: float):
+        """Refuse all acquires for the next `seconds`"""
+        with self._lock:
+            now = time.monotonic()
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = 0
+            self._updated = now
+
+
+# Budgets per provider:
+#   - YouTube Data API: 10,000 quota units per day
+#   - Twitter API v2 tweet lookup: 300 requests per 15 minute window (app auth)
+#   - Steam store/community: undocumented, roughly 200 requests per 5 minutes
+#     before scrapers start getting 429s
+buckets = {
+    'youtube': TokenBucket(10000, 24 * 60 * 60),
+    'twitter': TokenBucket(300, 15 * 60),
+    'steam': TokenBucket(200, 5 * 60),
+}
+
+
+def acquire(provider: str, cost: float = 1):
+    """Spend budget for a call to `provider`
+
+    :param provider: Key in `buckets`
+    :param cost: Tokens to spend (e.g. YouTube quota units)
+
+    :raises RateLimited: if the provider is out of budget
+    """
+    bucket = buckets[provider]
+    if not bucket.try_acquire(cost):
+        raise RateLimited(provider, bucket.retry_after(cost))
+
+
+def parse_retry_after(value: str) -> '(float | None)':
+    """Parse a Retry-After header, either delta-seconds or an HTTP date"""
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def update_from_headers(provider: str, headers: dict, status_code: int = None):
+    """Correct a provider's budget from rate limit response headers
+
+    Understands `x-rate-limit-remaining`/`x-rate-limit-reset` (Twitter)
+    and `Retry-After` (everyone else).
+
+    :param provider: Key in `buckets`
+    :param headers: Response headers (case-insensitive mapping)
+    :param status_code: Response status, 429 blocks the provider even
+                        without any usable headers
+    """
+    bucket = buckets[provider]
+
+    remaining = headers.get('x-rate-limit-remaining')
+    if remaining is not None:
+        remaining = int(remaining)
+        bucket.set_remaining(remaining)
+
+        reset = headers.get('x-rate-limit-reset')
+        if remaining < 1 and reset is not None:
+            bucket.block_for(int(reset) - time.time())
+
+    retry_after = headers.get('Retry-After')
+    if retry_after is not None:
+        seconds = parse_retry_after(retry_after)
+        if seconds is not None:
+            bucket.block_for(seconds)
+    elif status_code == 429 and remaining is None:
+        # Throttled without telling us for how long. Back off for a minute.
+        bucket.block_for(60)
+
+
+def check_response(provider: str, headers: dict, status_code: int):
+    """Correct a provider's budget from a response, failing fast on a 429
+
+    :raises RateLimited: if the response itself was rate limited, so the
+                         caller gets a degraded card rather than an error
+    """
+    update_from_headers(provider, headers, status_code)
+
+    if status_code == 429:
+        raise RateLimited(provider, buckets[provider].retry_after())
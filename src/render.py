@@ -0,0 +1,92 @@
+#
+# Card rendering.
+#
+# Everything we render goes over Ice to Murmur and then out to every
+# client in the channel, so templates are minified once at import and
+# values are HTML-escaped on the way in unless explicitly marked safe.
+#
+import re
+import html
+import string
+
+COMMENT_PATTERN = re.compile(r'<!--.*?-->', re.DOTALL)
+
+# Whitespace spanning a line break is template indentation, not content.
+# Next to a tag it's dropped, anywhere else it's collapsed to one space.
+# Single spaces (e.g. `</b> Retweets`) are left alone.
+INDENT_AFTER_TAG_PATTERN = re.compile(r'(?<=>)\s*\n\s*')
+INDENT_BEFORE_TAG_PATTERN = re.compile(r'\s*\n\s*(?=<)')
+INDENT_PATTERN = re.compile(r'\s*\n\s*')
+
+EMPTY_ATTRIBUTE_PATTERN = re.compile(r'\s+(style|class|id)=""')
+SELF_CLOSING_PATTERN = re.compile(r'\s+/>')
+STYLE_PATTERN = re.compile(r'style="([^"{}]*)"')
+STYLE_SPACING_PATTERN = re.compile(r'\s*([:;])\s*')
+
+
+class Markup(str):
+    """HTML that's already safe to embed and won't be escaped again"""
+    pass
+
+
+def escape(value) -> Markup:
+    """Escape a value for use in HTML text or attributes"""
+    if isinstance(value, Markup):
+        return value
+
+    return Markup(html.escape(str(value), quote=True))
+
+
+def minify_style(match: re.Match) -> str:
+    style = STYLE_SPACING_PATTERN.sub(r'\1', match.group(1)).strip().rstrip(';')
+    return 'style="{}"'.format(style)
+
+
+def minify(source: str) -> str:
+    """Strip insignificant whitespace, comments and attributes from HTML"""
+    source = COMMENT_PATTERN.sub('', source)
+    source = INDENT_AFTER_TAG_PATTERN.sub('', source)
+    source = INDENT_BEFORE_TAG_PATTERN.sub('', source)
+    source = INDENT_PATTERN.sub(' ', source)
+    source = STYLE_PATTERN.sub(minify_style, source)
+    source = EMPTY_ATTRIBUTE_PATTERN.sub('', source)
+    source = SELF_CLOSING_PATTERN.sub('/>', source)
+    return source.strip()
+
+
+class Template:
+    """An HTML card template, minified and parsed once when created
+
+    Uses `str.format` syntax. Every value is escaped unless it's `Markup`,
+    such as the output of another template.
+
+    Args:
+        source: Template source, indented however is most readable
+    """
+
+    formatter = string.Formatter()
+
+    def __init__(self, source: str):
+        self.source = minify(source)
+        self.parts = list(self.formatter.parse(self.source))
+
+    def render(self, **kwargs) -> Markup:
+        out = []
+        for literal, field, spec, conversion in self.parts:
+            out.append(literal)
+            if field is None:
+                continue
+
+            value, _ = self.formatter.get_field(field, (), kwargs)
+            if conversion:
+                value = self.formatter.convert_field(value, conversion)
+
+            formatted = format(value, spec)
+            out.append(formatted if isinstance(value, Markup) else escape(formatted))
+
+        return Markup(''.join(out))
+
+
+def join(fragments: list, separator: str = '') -> Markup:
+    """Join rendered fragments, escaping anything that isn't Markup"""
+    return Markup(escape(separator).join(escape(f) for f in fragments))
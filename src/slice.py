@@ -0,0 +1,85 @@
+#
+# Loading of the MumbleServer Slice definitions.
+#
+# Parsing and code-generating the Slice file at runtime takes a noticeable
+# chunk of startup, so the Python bindings are generated once ahead of time
+# with `python -m src.slice` (the Docker image does this at build time).
+# At runtime the generated modules are imported if they're present and
+# were built from the current .ice file and Ice version, otherwise we fall
+# back to compiling the Slice file in-process.
+#
+import os
+import sys
+import hashlib
+import Ice
+import IcePy
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+SLICE_FILE = os.path.join(PROJECT_DIR, 'ice', 'MumbleServer.ice')
+GENERATED_DIR = os.path.join(PROJECT_DIR, 'ice', 'generated')
+STAMP_FILE = os.path.join(GENERATED_DIR, 'MumbleServer.stamp')
+
+
+def slice_fingerprint() -> str:
+    """Hash of the Slice file and the Ice version that will consume it"""
+    with open(SLICE_FILE, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+
+    return '{} {}'.format(digest, Ice.stringVersion())
+
+
+def is_generated_current() -> bool:
+    """Check that the generated bindings exist and match the Slice file"""
+    try:
+        with open(STAMP_FILE, 'r') as f:
+            stamp = f.read().strip()
+    except FileNotFoundError:
+        return False
+
+    return stamp == slice_fingerprint() and os.path.isfile(
+        os.path.join(GENERATED_DIR, 'MumbleServer', '__init__.py'))
+
+
+def build():
+    """Generate Python bindings for the Slice file with slice2py"""
+    os.makedirs(GENERATED_DIR, exist_ok=True)
+
+    result = IcePy.compile([
+        'slice2py',
+        '-I' + Ice.getSliceDir(),
+        '--output-dir', GENERATED_DIR,
+        SLICE_FILE
+    ])
+
+    if result != 0:
+        raise RuntimeError('slice2py failed with exit code {}'.format(result))
+
+    with open(STAMP_FILE, 'w') as f:
+        f.write(slice_fingerprint())
+
+
+def load_slice(logger=None):
+    """Make the `MumbleServer` module importable
+
+    Uses the pregenerated bindings if they're current, otherwise
+    compiles the Slice file at runtime.
+    """
+    if 'MumbleServer' in sys.modules:
+        return
+
+    if is_generated_current():
+        if GENERATED_DIR not in sys.path:
+            sys.path.insert(0, GENERATED_DIR)
+        return
+
+    if logger:
+        logger.warning(
+            'Pregenerated Slice bindings are missing or stale, '
+            'compiling %s at runtime. Run `python -m src.slice` to fix.', SLICE_FILE)
+
+    Ice.loadSlice('', ['-I' + Ice.getSliceDir(), SLICE_FILE])
+
+
+if __name__ == '__main__':
+    build()
+    print('Generated Slice bindings in ' + GENERATED_DIR)
@@ -0,0 +1,191 @@
+#
+# Span tracing for individual cards.
+#
+# Metrics tell us cards are slow in aggregate, but not why one card took
+# nine seconds. Each stage of a card opens a span that records its parent
+# (tracked per thread with contextvars), timings and a few attributes.
+#
+# When TRACE_FILE is set, finished spans are appended to it as Chrome
+# trace events, one JSON object per line, with size-based rotation.
+# The file is written from the log listener's thread (see src/logs.py),
+# so card workers never wait on disk.
+#
+# Batched API calls (see src/batch.py) are traced once, in the trace of
+# whichever card made the call. Cards that shared the batch record its
+# trace ID in a `batch_trace_id` attribute instead.
+# `python -m src.tracing TRACE_FILE [TRACE_ID]` turns that into a trace
+# that can be opened in chrome://tracing or https://ui.perfetto.dev
+#
+import os
+import sys
+import json
+import time
+import random
+import logging
+import threading
+import contextlib
+import contextvars
+import logging.handlers
+
+from .logs import add_queued_handler
+
+# Rotated once the file reaches this size, keeping TRACE_BACKUPS old files
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+
+# Spans are written through their own logger so that rotation and
+# thread safety come from the logging handlers
+exporter = logging.getLogger('Mumble.trace')
+exporter.propagate = False
+
+_current_span = contextvars.ContextVar('span', default=None)
+
+
+def new_id() -> str:
+    return '{:016x}'.format(random.getrandbits(64))
+
+
+class Span:
+    """A timed operation within a trace
+
+    Args:
+        name:       Operation name, e.g. `create_card` or `thumbnail`
+        parent:     Enclosing span. Without one, this span starts a new trace.
+        attributes: Details worth seeing in the trace viewer (URL, bytes, ...)
+    """
+
+    def __init__(self, name: str, parent: 'Span' = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else new_id()
+        self.span_id = new_id()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes or {}
+        self.thread_id = threading.get_ident()
+        self.start = time.time()
+        self.duration = None
+
+    def set(self, key: str, value):
+        """Set an attribute, ignoring None"""
+        if value is not None:
+            self.attributes[key] = value
+
+    def finish(self):
+        self.duration = time.time() - self.start
+
+    def to_event(self) -> dict:
+        """Chrome trace "complete" event for this span"""
+        args = {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+        }
+        args.update(self.attributes)
+
+        return {
+            'name': self.name,
+            'cat': 'card',
+            'ph': 'X',
+            'ts': int(self.start * 1e6),
+            'dur': int((self.duration or 0) * 1e6),
+            'pid': os.getpid(),
+            'tid': self.thread_id,
+            'args': args,
+        }
+
+
+def configure(
+    path: str,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+    backups: int = DEFAULT_BACKUPS,
+    listener: logging.handlers.QueueListener = None
+):
+    """Start writing finished spans to a rotating JSON lines file
+
+    Args:
+        path:       Trace file
+        max_bytes:  Size to rotate the trace file at
+        backups:    Number of rotated files to keep
+        listener:   Log listener (see `logs.configure_logging`) to write
+                    spans from. Without one, they're written by whichever
+                    thread finishes the span.
+    """
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+
+    for existing in list(exporter.handlers):
+        exporter.removeHandler(existing)
+        existing.close()
+
+    if listener:
+        add_queued_handler(listener, exporter, handler)
+    else:
+        exporter.addHandler(handler)
+
+    exporter.setLevel(logging.INFO)
+
+
+def is_enabled() -> bool:
+    return bool(exporter.handlers)
+
+
+def current_span() -> '(Span | None)':
+    return _current_span.get()
+
+
+def annotate(**attributes):
+    """Set attributes on the current span, if there is one"""
+    span = _current_span.get()
+    if span:
+        for key, value in attributes.items():
+            span.set(key, value)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Trace a block as a child of the current span
+
+    Attributes that are None are left out. Exceptions are recorded in
+    an `error` attribute and re-raised.
+    """
+    s = Span(name, _current_span.get(), {k: v for k, v in attributes.items() if v is not None})
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.set('error', repr(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        s.finish()
+
+        if exporter.handlers:
+            exporter.info(json.dumps(s.to_event(), default=str))
+
+
+def export(path: str, trace_id: str = None) -> dict:
+    """Collect spans from a trace file into a Chrome trace
+
+    Args:
+        path:       TRACE_FILE to read
+        trace_id:   Only include spans from this trace (e.g. one card)
+    """
+    events = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            event = json.loads(line)
+            if trace_id is None or event['args'].get('trace_id') == trace_id:
+                events.append(event)
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python -m src.tracing TRACE_FILE [TRACE_ID] > trace.json')
+        sys.exit(1)
+
+    json.dump(export(*sys.argv[1:3]), sys.stdout)
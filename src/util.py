@@ -4,15 +4,18 @@ from sys import platform
 import datetime
 import re
 import base64
-from PIL import Image, ImageDraw
 import requests
 import humanize
 
+from .metrics import stage
+
 
 def crop_to_circle(img):
     """Circular crop, preserving alpha.
     Author: https://stackoverflow.com/a/59804079
     """
+    from PIL import Image, ImageDraw
+
     bigsize = (img.size[0] * 3, img.size[1] * 3)
     mask = Image.new('L', bigsize, 0)
     ImageDraw.Draw(mask).ellipse((0, 0) + bigsize, fill=255)
@@ -32,21 +35,27 @@ def url_to_data_uri(url: str, size: int = 128, round: bool = False):
     if not url:
         return None
 
-    r = requests.get(url)
-    img = Image.open(BytesIO(r.content))
+    # Pillow is only loaded once we actually have something to thumbnail
+    from PIL import Image
+
+    with stage('thumbnail', url=url) as span:
+        r = requests.get(url)
+        span.set('bytes', len(r.content))
+
+        img = Image.open(BytesIO(r.content))
 
-    if round:
-        crop_to_circle(img)
+        if round:
+            crop_to_circle(img)
 
-    # Resize thumbnail
-    # TODO: Skip resize if it's already small enough?
-    # TODO: Customize resize based on website? (E.g. youtube should be bigger)
-    img.thumbnail((size, size), Image.ANTIALIAS)
+        # Resize thumbnail
+        # TODO: Skip resize if it's already small enough?
+        # TODO: Customize resize based on website? (E.g. youtube should be bigger)
+        img.thumbnail((size, size), Image.ANTIALIAS)
 
-    # Return b64 encoded version
-    buffered = BytesIO()
-    img.save(buffered, format='PNG')
-    return 'data:image/png;base64,' + base64.b64encode(buffered.getvalue()).decode('utf-8')
+        # Return b64 encoded version
+        buffered = BytesIO()
+        img.save(buffered, format='PNG')
+        return 'data:image/png;base64,' + base64.b64encode(buffered.getvalue()).decode('utf-8')
 
 
 def first_or_default(value, default=None):
@@ -0,0 +1,166 @@
+#
+# Benchmark card generation over the test_cards corpus.
+#
+# Runs offline from recorded fixtures by default, so results only change
+# when the pipeline does. Record fixtures first with:
+#
+#   python test/test_cards.py --record
+#
+# then compare runs with:
+#
+#   python test/benchmark.py [--concurrency N] [--repeat N] [--warm]
+#
+# Reports cards/sec, latency percentiles per provider, CPU time and
+# peak memory for the whole corpus. Each URL is carded once per pass,
+# and every cache is emptied before each pass so card generation is
+# what gets timed. --warm keeps caches between passes instead.
+#
+import os
+import sys
+import math
+import time
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src.cache import clear_caches  # nopep8
+from src.factories import create_card, recent_cards  # nopep8
+from src.providers import match_provider  # nopep8
+from fixtures import FIXTURES_DIR, http_fixtures  # nopep8
+from test_cards import test_cases  # nopep8
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile of already sorted values"""
+    if not values:
+        return 0
+
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def provider_name(url: str) -> str:
+    provider, _ = match_provider(url)
+    return provider['name'] if provider else 'generic'
+
+
+def peak_memory_mb() -> '(float | None)':
+    if resource is None:
+        return None
+
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_benchmark(urls: list, concurrency: int = 1) -> dict:
+    """Card every URL and collect latencies by provider
+
+    :return dict: provider -> list of (seconds, succeeded)
+    """
+    results = defaultdict(list)
+    lock = threading.Lock()
+
+    def card(url):
+        start = time.perf_counter()
+        try:
+            create_card(url)
+            ok = True
+        except Exception:
+            ok = False
+
+        elapsed = time.perf_counter() - start
+        with lock:
+            results[provider_name(url)].append((elapsed, ok))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(card, urls))
+
+    return results
+
+
+def run_passes(urls: list, concurrency: int = 1, repeat: int = 1, warm: bool = False) -> dict:
+    """Card the corpus `repeat` times, from cold caches unless `warm`
+
+    :return dict: provider -> list of (seconds, succeeded) across all passes
+    """
+    results = defaultdict(list)
+    for i in range(repeat):
+        if i == 0 or not warm:
+            clear_caches()
+            recent_cards.clear()
+
+        for name, latencies in run_benchmark(urls, concurrency).items():
+            results[name] += latencies
+
+    return results
+
+
+def format_report(results: dict, wall: float, cpu: float, memory: float, warm: bool = False) -> str:
+    total = sum(len(r) for r in results.values())
+    failures = sum(1 for r in results.values() for _, ok in r if not ok)
+
+    lines = [
+        '{:<12} {:>6} {:>6} {:>9} {:>9} {:>9}'.format(
+            'provider', 'cards', 'failed', 'p50 ms', 'p95 ms', 'p99 ms')
+    ]
+    for name in sorted(results):
+        latencies = sorted(seconds * 1000 for seconds, _ in results[name])
+        lines.append('{:<12} {:>6} {:>6} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            name,
+            len(latencies),
+            sum(1 for _, ok in results[name] if not ok),
+            percentile(latencies, 50),
+            percentile(latencies, 95),
+            percentile(latencies, 99)))
+
+    lines.append('')
+    lines.append('{} cards ({} failed, {} caches) in {:.2f}s: {:.1f} cards/sec'.format(
+        total, failures, 'warm' if warm else 'cold', wall, total / wall if wall else 0))
+    lines.append('CPU time: {:.2f}s'.format(cpu))
+    if memory is not None:
+        lines.append('Peak memory: {:.1f} MB'.format(memory))
+
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark card generation')
+    parser.add_argument('--live', action='store_true',
+                        help='Use the live sites instead of recorded fixtures')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR,
+                        help='Fixture directory (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Cards generated in parallel (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Passes over the corpus (default: %(default)s)')
+    parser.add_argument('--warm', action='store_true',
+                        help='Keep caches between passes, timing cache hits after the first')
+    args = parser.parse_args()
+
+    # Repeats within a pass would only time cache hits
+    urls = list(dict.fromkeys(test_cases))
+
+    with http_fixtures(None if args.live else 'replay', args.fixtures):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        results = run_passes(urls, args.concurrency, args.repeat, args.warm)
+
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+    print(format_report(results, wall, cpu, peak_memory_mb(), args.warm))
+
+
+if __name__ == '__main__':
+    main()
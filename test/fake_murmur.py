@@ -0,0 +1,332 @@
+#
+# Fake Murmur Ice server and load generator.
+#
+# Implements enough of the MumbleServer.Meta and MumbleServer.Server
+# Slice interfaces for `mumble_connect` to attach its callbacks, then
+# plays streams of `userTextMessage` events at the bot. Every event is
+# sent to its own channel ID so each `sendMessageChannel` reply can be
+# matched back to the event that caused it, measuring end-to-end
+# latency and how many events never got a reply. Events turned away
+# by flood control are reported separately from those dropped.
+#
+# Upstream sites are served from recorded fixtures (see fixtures.py):
+#
+#   python test/fake_murmur.py --messages 200 --rate 20 --burst 10
+#
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import threading
+from unittest.mock import patch
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+import Ice  # nopep8
+from src.slice import load_slice  # nopep8
+load_slice()
+
+import MumbleServer  # nopep8
+from benchmark import percentile  # nopep8
+from fixtures import FIXTURES_DIR, http_fixtures  # nopep8
+from src import admission  # nopep8
+
+SECRET = 'fake-murmur'
+
+
+class FakeServer(MumbleServer.Server):
+    """A virtual server that records replies instead of sending them to clients"""
+
+    def __init__(self, id: int):
+        self._id = id
+        self.callbacks = []
+        self.replies = {}
+        self.lock = threading.Lock()
+
+    def isRunning(self, current=None):
+        return True
+
+    def id(self, current=None):
+        return self._id
+
+    def addCallback(self, cb, current=None):
+        with self.lock:
+            self.callbacks.append(cb.ice_oneway())
+
+    def removeCallback(self, cb, current=None):
+        with self.lock:
+            self.callbacks = [c for c in self.callbacks if c.ice_getIdentity() != cb.ice_getIdentity()]
+
+    def sendMessageChannel(self, channelid, tree, text, current=None):
+        with self.lock:
+            self.replies[channelid] = (time.perf_counter(), text)
+
+    def sendMessage(self, session, text, current=None):
+        pass
+
+    def user_text_message(self, user: MumbleServer.User, text: str, channel: int):
+        """Deliver a text message from `user` to every attached callback"""
+        msg = MumbleServer.TextMessage([], [channel], [], text)
+        with self.lock:
+            callbacks = list(self.callbacks)
+
+        for cb in callbacks:
+            cb.userTextMessage(user, msg)
+
+
+class FakeMeta(MumbleServer.Meta):
+    def __init__(self, adapter, servers: int = 1):
+        self.adapter = adapter
+        self.callbacks = []
+        self.servers = []
+        self.proxies = []
+        for i in range(servers):
+            self.boot_server()
+
+    def boot_server(self) -> FakeServer:
+        """Add a running virtual server, telling attached MetaCallbacks about it"""
+        server = FakeServer(len(self.servers) + 1)
+        proxy = MumbleServer.ServerPrx.uncheckedCast(
+            self.adapter.add(server, Ice.stringToIdentity('s/{}'.format(server.id()))))
+
+        self.servers.append(server)
+        self.proxies.append(proxy)
+
+        for cb in self.callbacks:
+            cb.started(proxy)
+
+        return server
+
+    def getBootedServers(self, current=None):
+        return list(self.proxies)
+
+    def getServer(self, id, current=None):
+        return self.proxies[id - 1] if 0 < id <= len(self.proxies) else None
+
+    def addCallback(self, cb, current=None):
+        self.callbacks.append(cb.ice_oneway())
+
+    def removeCallback(self, cb, current=None):
+        self.callbacks = [c for c in self.callbacks if c.ice_getIdentity() != cb.ice_getIdentity()]
+
+
+class FakeMurmur:
+    """Fake Murmur listening on a free local port
+
+    Args:
+        servers:    Number of booted virtual servers
+    """
+
+    def __init__(self, servers: int = 1):
+        self.communicator = Ice.initialize()
+        self.adapter = self.communicator.createObjectAdapterWithEndpoints(
+            'FakeMurmur', 'tcp -h 127.0.0.1')
+        self.meta = FakeMeta(self.adapter, servers)
+        self.adapter.add(self.meta, Ice.stringToIdentity('Meta'))
+        self.adapter.activate()
+
+    @property
+    def port(self) -> int:
+        return self.adapter.getEndpoints()[0].getInfo().port
+
+    @property
+    def servers(self) -> list:
+        return self.meta.servers
+
+    def environ(self) -> dict:
+        """Envvars for `mumble_connect` to find this server"""
+        return {
+            'ICE_HOST': '127.0.0.1',
+            'ICE_PORT': str(self.port),
+            'ICE_SECRET': SECRET,
+        }
+
+    def destroy(self):
+        self.communicator.destroy()
+
+
+class LoadTestScheduler(admission.FairScheduler):
+    """Card scheduler that remembers which channels had a request rejected
+
+    Flood control defaults are meant for real users, so load tests
+    should pass limits that only reject what they mean to measure.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rejected = set()
+
+    def submit(self, user, channels: list, func: callable, *args, kind: str = None) -> bool:
+        admitted = super().submit(user, channels, func, *args, kind=kind)
+        if not admitted:
+            with self._cond:
+                self.rejected.update(channels)
+
+        return admitted
+
+    def rejected_channels(self) -> set:
+        with self._cond:
+            return set(self.rejected)
+
+
+class LoadGenerator:
+    """Play text messages containing URLs at a fake Murmur's callbacks
+
+    Args:
+        murmur:     FakeMurmur the bot is connected to
+        urls:       URLs to pick messages from
+        users:      Number of distinct users sending messages
+        rate:       Bursts per second
+        burst:      Messages sent at once in each burst
+        seed:       Random seed for the URL, user and server mix
+    """
+
+    def __init__(
+        self,
+        murmur: FakeMurmur,
+        urls: list,
+        users: int = 5,
+        rate: float = 10,
+        burst: int = 1,
+        seed: int = 0
+    ):
+        self.murmur = murmur
+        self.urls = urls
+        self.users = []
+        for i in range(users):
+            user = MumbleServer.User()
+            user.session = i + 1
+            user.userid = i + 1
+            user.name = 'user{}'.format(i + 1)
+            self.users.append(user)
+
+        self.rate = rate
+        self.burst = burst
+        self.random = random.Random(seed)
+        self.sent = {}
+
+    def run(self, messages: int):
+        """Send `messages` events, `burst` at a time, `rate` bursts per second"""
+        channel = len(self.sent)
+        next_burst = time.perf_counter()
+
+        while len(self.sent) < messages:
+            for _ in range(min(self.burst, messages - len(self.sent))):
+                channel += 1
+                url = self.random.choice(self.urls)
+                server = self.random.choice(self.murmur.servers)
+
+                # Murmur delivers links as HTML anchors
+                text = '<a href="{url}">{url}</a>'.format(url=url)
+                self.sent[channel] = (time.perf_counter(), server, url)
+                server.user_text_message(self.random.choice(self.users), text, channel)
+
+            next_burst += 1 / self.rate
+            time.sleep(max(0, next_burst - time.perf_counter()))
+
+    def wait(self, timeout: float, scheduler: LoadTestScheduler = None) -> dict:
+        """Wait up to `timeout` seconds for outstanding replies
+
+        :param scheduler: Scheduler the bot submits cards to. Events it
+                          rejected won't get a reply and aren't waited for.
+
+        :return dict: `sent`, `replied`, `rejected`, `dropped` and reply
+                      `latencies` in seconds
+        """
+        def count_rejected():
+            return len(scheduler.rejected_channels() & self.sent.keys()) if scheduler else 0
+
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline and len(self.latencies()) + count_rejected() < len(self.sent):
+            time.sleep(0.01)
+
+        latencies = self.latencies()
+        rejected = count_rejected()
+        return {
+            'sent': len(self.sent),
+            'replied': len(latencies),
+            'rejected': rejected,
+            'dropped': len(self.sent) - len(latencies) - rejected,
+            'latencies': latencies,
+        }
+
+    def latencies(self) -> list:
+        latencies = []
+        for channel, (sent, server, _) in self.sent.items():
+            with server.lock:
+                reply = server.replies.get(channel)
+            if reply:
+                latencies.append(reply[0] - sent)
+
+        return sorted(latencies)
+
+
+def format_report(results: dict, duration: float) -> str:
+    latencies = [seconds * 1000 for seconds in results['latencies']]
+    lines = [
+        '{sent} events, {replied} replies, {rejected} rejected by flood control, {dropped} dropped ({rate:.1%})'.format(
+            rate=results['dropped'] / results['sent'] if results['sent'] else 0, **results),
+        '{:.1f} replies/sec over {:.2f}s'.format(results['replied'] / duration, duration),
+    ]
+    if latencies:
+        lines.append('Event to send latency: p50 {:.1f} ms, p95 {:.1f} ms, p99 {:.1f} ms, max {:.1f} ms'.format(
+            percentile(latencies, 50),
+            percentile(latencies, 95),
+            percentile(latencies, 99),
+            latencies[-1]))
+
+    return '\n'.join(lines)
+
+
+def main():
+    from test_cards import test_cases
+
+    parser = argparse.ArgumentParser(description='Load test the bot against a fake Murmur')
+    parser.add_argument('--messages', type=int, default=100, help='Events to send (default: %(default)s)')
+    parser.add_argument('--rate', type=float, default=10, help='Bursts per second (default: %(default)s)')
+    parser.add_argument('--burst', type=int, default=1, help='Events per burst (default: %(default)s)')
+    parser.add_argument('--users', type=int, default=5, help='Distinct users (default: %(default)s)')
+    parser.add_argument('--servers', type=int, default=1, help='Virtual servers (default: %(default)s)')
+    parser.add_argument('--url', action='append', dest='urls',
+                        help='URL to send, may be repeated (default: the test_cards corpus)')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='Seconds to wait for replies after the last event (default: %(default)s)')
+    parser.add_argument('--live', action='store_true',
+                        help='Use the live sites instead of recorded fixtures')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR,
+                        help='Fixture directory (default: %(default)s)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger('Mumble')
+
+    # Lift per-user rate limits so the pipeline is measured, not flood control.
+    # Queue and channel limits still apply, and their rejections are reported.
+    scheduler = LoadTestScheduler(user_rate=(1000, 1))
+
+    murmur = FakeMurmur(args.servers)
+    with patch.dict(os.environ, murmur.environ()), \
+            patch.object(admission, 'scheduler', scheduler), \
+            http_fixtures(None if args.live else 'replay', args.fixtures):
+        from src.mumble import mumble_connect
+        comm = mumble_connect(logger)
+
+        load = LoadGenerator(murmur, args.urls or test_cases, args.users, args.rate, args.burst)
+        start = time.perf_counter()
+        load.run(args.messages)
+        results = load.wait(args.timeout, scheduler)
+        duration = time.perf_counter() - start
+
+        scheduler.stop()
+        comm.destroy()
+
+    murmur.destroy()
+    print(format_report(results, duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#
+# Record and replay upstream HTTP traffic.
+#
+# Every request made through `requests` (including tweepy and
+# metadata_parser, which use it underneath) goes through
+# `HTTPAdapter.send`. While recording, each response is saved to a JSON
+# file named after its request. While replaying, those files are served
+# instead and nothing touches the network, so card tests and benchmarks
+# give the same results offline.
+#
+# API keys in query strings (e.g. YouTube's `key`) are never written to
+# disk and aren't part of the fixture name, so fixtures recorded with one
+# key replay with any other.
+#
+import os
+import json
+import base64
+import hashlib
+import threading
+import contextlib
+from io import BytesIO
+from unittest.mock import patch
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'http')
+
+# Query parameters that are credentials rather than part of the request
+SECRET_PARAMS = {'key', 'api_key', 'access_token'}
+
+# Providers are only enabled when their credentials are configured.
+# Replays don't need real ones, but should use the same providers as
+# the recording did.
+REPLAY_CREDENTIALS = {
+    'YOUTUBE_API_KEY': 'replay',
+    'TWITTER_BEARER_TOKEN': 'replay',
+}
+
+
+class MissingFixture(requests.ConnectionError):
+    """Raised while replaying a request that was never recorded"""
+    pass
+
+
+def normalize_url(url: str) -> str:
+    """Drop credentials from a URL's query string"""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k not in SECRET_PARAMS]
+
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def fixture_name(request: requests.PreparedRequest) -> str:
+    """Stable file name for a request, e.g. `GET-store.steampowered.com-1a2b3c4d5e6f.json`"""
+    url = normalize_url(request.url)
+    body = request.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+
+    digest = hashlib.sha1(request.method.encode() + b' ' + url.encode() + b'\n' + body).hexdigest()
+    return '{}-{}-{}.json'.format(request.method, urlsplit(url).hostname, digest[:12])
+
+
+def save_response(directory: str, request: requests.PreparedRequest, response: requests.Response):
+    # Reading the body here is fine for streamed responses too,
+    # requests serves `iter_content` from it once it's been read
+    content = response.content
+
+    fixture = {
+        'method': request.method,
+        'url': normalize_url(request.url),
+        'status': response.status_code,
+        'reason': response.reason,
+        'headers': dict(response.headers),
+        'body': base64.b64encode(content).decode('ascii'),
+    }
+
+    with open(os.path.join(directory, fixture_name(request)), 'w', encoding='utf-8') as f:
+        json.dump(fixture, f, indent=2)
+
+
+def load_response(directory: str, request: requests.PreparedRequest) -> requests.Response:
+    path = os.path.join(directory, fixture_name(request))
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            fixture = json.load(f)
+    except FileNotFoundError:
+        raise MissingFixture(
+            'No fixture for {} {}'.format(request.method, normalize_url(request.url)),
+            request=request)
+
+    content = base64.b64decode(fixture['body'])
+
+    response = requests.Response()
+    response.status_code = fixture['status']
+    response.reason = fixture['reason']
+    response.headers = CaseInsensitiveDict(fixture['headers'])
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.url = request.url
+    response.request = request
+    response.raw = BytesIO(content)
+    response._content = content
+    response._content_consumed = True
+    return response
+
+
+@contextlib.contextmanager
+def recording(directory: str = FIXTURES_DIR):
+    """Make real requests, saving every response to `directory`"""
+    os.makedirs(directory, exist_ok=True)
+    send = HTTPAdapter.send
+    lock = threading.Lock()
+
+    def record(adapter, request, *args, **kwargs):
+        response = send(adapter, request, *args, **kwargs)
+        with lock:
+            save_response(directory, request, response)
+        return response
+
+    with patch.object(HTTPAdapter, 'send', record):
+        yield
+
+
+@contextlib.contextmanager
+def replaying(directory: str = FIXTURES_DIR):
+    """Serve every request from `directory` without touching the network
+
+    Requests that weren't recorded raise `MissingFixture`. Provider
+    credentials that aren't configured are filled with placeholders.
+    """
+    def replay(adapter, request, *args, **kwargs):
+        return load_response(directory, request)
+
+    credentials = {k: v for k, v in REPLAY_CREDENTIALS.items() if not os.environ.get(k)}
+
+    with patch.object(HTTPAdapter, 'send', replay), patch.dict(os.environ, credentials):
+        yield
+
+
+def http_fixtures(mode: str = None, directory: str = FIXTURES_DIR):
+    """Context manager for `--record`/`--replay` command line modes
+
+    :param mode: 'record', 'replay', or None for live requests
+    """
+    if mode == 'record':
+        return recording(directory)
+    if mode == 'replay':
+        return replaying(directory)
+
+    return contextlib.nullcontext()
@@ -0,0 +1,174 @@
+import os
+import sys
+import threading
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src.admission import REJECTED, FairScheduler  # nopep8
+
+
+class FairSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.order = []
+        self.done = threading.Semaphore(0)
+        self.gate = threading.Event()
+
+    def tearDown(self):
+        self.gate.set()
+
+    def record(self, name):
+        self.order.append(name)
+        self.done.release()
+
+    def blocked(self):
+        self.gate.wait()
+        self.done.release()
+
+    def wait_for(self, count):
+        for _ in range(count):
+            self.assertTrue(self.done.acquire(timeout=5))
+
+    def test_round_robin_across_users(self):
+        scheduler = FairScheduler(workers=1, user_rate=(100, 1))
+
+        # Hold the only worker while the queue fills up
+        scheduler.submit('blocker', [], self.blocked)
+        for i in range(3):
+            scheduler.submit('noisy', [], self.record, 'noisy{}'.format(i))
+        scheduler.submit('quiet', [], self.record, 'quiet0')
+        scheduler.submit('other', [], self.record, 'other0')
+
+        self.gate.set()
+        self.wait_for(6)
+        scheduler.stop()
+
+        self.assertEqual(self.order, ['noisy0', 'quiet0', 'other0', 'noisy1', 'noisy2'])
+
+    def test_user_concurrency_limit(self):
+        scheduler = FairScheduler(workers=3, user_rate=(100, 1), user_concurrency=1)
+        running = []
+
+        def job(name):
+            running.append(name)
+            self.gate.wait()
+            self.done.release()
+
+        scheduler.submit('a', [], job, 'a0')
+        scheduler.submit('a', [], job, 'a1')
+        scheduler.submit('b', [], job, 'b0')
+
+        for _ in range(50):
+            if len(running) == 2:
+                break
+            threading.Event().wait(0.01)
+
+        self.assertEqual(sorted(running), ['a0', 'b0'])
+
+        self.gate.set()
+        self.wait_for(3)
+        scheduler.stop()
+        self.assertEqual(sorted(running), ['a0', 'a1', 'b0'])
+
+    def test_user_and_channel_rates(self):
+        scheduler = FairScheduler(workers=1, user_rate=(2, 60), channel_rate=(3, 60))
+        before = REJECTED.value(reason='user_rate')
+
+        self.assertTrue(scheduler.submit('a', [1], self.record, 'a'))
+        self.assertTrue(scheduler.submit('a', [1], self.record, 'a'))
+        self.assertFalse(scheduler.submit('a', [1], self.record, 'a'))
+        self.assertEqual(REJECTED.value(reason='user_rate') - before, 1)
+
+        # Channel 1 has one token left, channel 2 has plenty
+        self.assertTrue(scheduler.submit('b', [1], self.record, 'b'))
+        self.assertFalse(scheduler.submit('c', [2, 1], self.record, 'c'))
+
+        # Rejected by channel 1, so neither user c nor channel 2 were charged
+        self.assertTrue(scheduler.submit('c', [2], self.record, 'c'))
+        self.assertTrue(scheduler.submit('c', [2], self.record, 'c'))
+
+        self.wait_for(5)
+        scheduler.stop()
+
+    def test_user_queue_limit(self):
+        scheduler = FairScheduler(workers=1, user_rate=(100, 1), user_queue=2)
+
+        scheduler.submit('blocker', [], self.blocked)
+        self.assertTrue(scheduler.submit('a', [], self.record, 'a'))
+        self.assertTrue(scheduler.submit('a', [], self.record, 'a'))
+        self.assertFalse(scheduler.submit('a', [], self.record, 'a'))
+
+        self.gate.set()
+        self.wait_for(3)
+        scheduler.stop()
+
+    def test_stop_finishes_running_jobs(self):
+        scheduler = FairScheduler(workers=1, user_rate=(100, 1))
+
+        started = threading.Event()
+
+        def blocked():
+            started.set()
+            self.blocked()
+
+        scheduler.submit('blocker', [], blocked)
+        self.assertTrue(started.wait(timeout=5))
+        scheduler.submit('a', [], self.record, 'a')
+
+        # Release the running job while stop() is waiting on it
+        threading.Timer(0.1, self.gate.set).start()
+        with self.assertLogs('Mumble.admission', level='WARNING') as logs:
+            scheduler.stop(timeout=5)
+
+        self.assertTrue(self.done.acquire(timeout=0))
+        self.assertEqual(self.order, [])
+        self.assertIn('Dropped 1 queued card request(s)', logs.output[0])
+
+    def test_fast_lane_bypasses_slow_jobs(self):
+        scheduler = FairScheduler(workers=2, user_rate=(100, 1), fast_reserved=1)
+
+        # Slow jobs may only use the unreserved worker
+        scheduler.submit('a', [], self.blocked, kind='twitter')
+        scheduler.submit('b', [], self.record, 'steam', kind='steam')
+        scheduler.submit('c', [], self.record, 'cached', kind='cache')
+
+        self.wait_for(1)
+        self.assertEqual(self.order, ['cached'])
+
+        self.gate.set()
+        self.wait_for(2)
+        scheduler.stop()
+        self.assertEqual(self.order, ['cached', 'steam'])
+
+    def test_slow_lane_workers(self):
+        scheduler = FairScheduler(workers=4, user_rate=(100, 1), fast_reserved=0, slow_lane_workers=1)
+
+        # Twitter only gets one worker, so Steam goes ahead of the second Twitter job
+        scheduler.submit('a', [], self.blocked, kind='twitter')
+        scheduler.submit('b', [], self.record, 'twitter', kind='twitter')
+        scheduler.submit('c', [], self.record, 'steam', kind='steam')
+
+        self.wait_for(1)
+        self.assertEqual(self.order, ['steam'])
+
+        self.gate.set()
+        self.wait_for(2)
+        scheduler.stop()
+        self.assertEqual(self.order, ['steam', 'twitter'])
+
+    def test_lanes_follow_run_times(self):
+        scheduler = FairScheduler(workers=1, user_rate=(100, 1), fast_threshold=0.5)
+
+        self.assertEqual(scheduler.lane_for('cache'), 'fast')
+        self.assertEqual(scheduler.lane_for('twitter'), 'twitter')
+
+        # Twitter turns out to be quick, and moves to the fast lane
+        for _ in range(10):
+            scheduler.submit('a', [], self.record, 'twitter', kind='twitter')
+        self.wait_for(10)
+        scheduler.stop()
+
+        self.assertLess(scheduler.expected_cost('twitter'), 0.5)
+        self.assertEqual(scheduler.lane_for('twitter'), 'fast')
@@ -0,0 +1,76 @@
+import os
+import sys
+import threading
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src import tracing  # nopep8
+from src.batch import Batcher  # nopep8
+
+
+class BatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def lookup(self, keys):
+        self.calls.append(sorted(keys))
+        return {key: key * 2 for key in keys if key != 0}
+
+    def test_concurrent_keys_share_a_call(self):
+        batcher = Batcher(self.lookup, window=0.1)
+        results = {}
+
+        def worker(key):
+            results[key] = batcher.get(key)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(1, 6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(self.calls, [[1, 2, 3, 4, 5]])
+        self.assertEqual(results, {1: 2, 2: 4, 3: 6, 4: 8, 5: 10})
+
+    def test_missing_keys_resolve_to_none(self):
+        batcher = Batcher(self.lookup, window=0)
+        self.assertIsNone(batcher.get(0))
+
+    def test_max_size_splits_batches(self):
+        batcher = Batcher(self.lookup, window=0, max_size=2)
+        results = batcher.get_many([1, 2, 3])
+
+        self.assertEqual(self.calls, [[1, 2], [3]])
+        self.assertEqual(results, {1: 2, 2: 4, 3: 6})
+
+    def test_errors_propagate_to_callers(self):
+        def fail(keys):
+            raise ValueError('upstream down')
+
+        batcher = Batcher(fail, window=0)
+        with self.assertRaises(ValueError):
+            batcher.get(1)
+
+    def test_followers_link_to_the_batch_trace(self):
+        batcher = Batcher(self.lookup, window=0.1)
+        spans = {}
+
+        def worker(key):
+            with tracing.span('card') as span:
+                batcher.get(key)
+            spans[key] = span
+
+        leader = threading.Thread(target=worker, args=(1,))
+        leader.start()
+        threading.Event().wait(0.02)
+        follower = threading.Thread(target=worker, args=(2,))
+        follower.start()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(self.calls, [[1, 2]])
+        self.assertNotIn('batch_trace_id', spans[1].attributes)
+        self.assertEqual(spans[2].attributes['batch_trace_id'], spans[1].trace_id)
@@ -0,0 +1,184 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+import unittest
+import multiprocessing
+from unittest.mock import patch
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src.cache import SharedCache, TTLCache, Uncached, clear_caches, create_cache  # nopep8
+
+
+def fill_shared(path, calls_path, results):
+    """Fill the same key from another process, counting calls to the filler"""
+    cache = SharedCache(path, 'test', ttl=60)
+
+    def slow():
+        with open(calls_path, 'a') as f:
+            f.write('call\n')
+        time.sleep(0.3)
+        return {'card': '<b>shared</b>'}
+
+    results.put(cache.get_or_set('https://example.com/', slow))
+
+
+class TTLCacheTestCase(unittest.TestCase):
+    def test_get_or_set_calls_once(self):
+        cache = TTLCache(ttl=60)
+        calls = []
+
+        def slow():
+            calls.append(True)
+            time.sleep(0.1)
+            return 'value'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_set('key', slow)))
+            for _ in range(5)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_get_or_set_errors_are_not_cached(self):
+        cache = TTLCache(ttl=60)
+
+        def fails():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            cache.get_or_set('key', fails)
+
+        self.assertEqual(cache.get_or_set('key', lambda: 'value'), 'value')
+
+    def test_get_or_set_uncached(self):
+        cache = TTLCache(ttl=60)
+
+        self.assertEqual(cache.get_or_set('key', lambda: Uncached('fallback')), 'fallback')
+        self.assertNotIn('key', cache)
+        self.assertEqual(cache.get_or_set('key', lambda: 'value'), 'value')
+        self.assertEqual(cache.get('key'), 'value')
+
+
+class SharedCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'cache.db')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_get_set_delete(self):
+        cache = SharedCache(self.path, 'test', ttl=60)
+        other = SharedCache(self.path, 'other', ttl=60)
+
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', {'price': 999})
+        cache.set(('tuple', 1), [1, 2])
+
+        self.assertEqual(cache.get('a'), {'price': 999})
+        self.assertEqual(cache.get(('tuple', 1)), [1, 2])
+        self.assertIsNone(other.get('a'))
+        self.assertIn('a', cache)
+        self.assertNotIn('a', other)
+        self.assertEqual(len(cache), 2)
+
+        cache.delete('a')
+        self.assertEqual(cache.get('a', 'default'), 'default')
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_values_are_json(self):
+        cache = SharedCache(self.path, 'test', ttl=60)
+
+        cache.set('card', ('<b>card</b>', 'generic'))
+        self.assertEqual(cache.get('card'), ['<b>card</b>', 'generic'])
+
+        # Anything else in the file is a miss, never unpickled
+        cache._connect().execute(
+            'UPDATE entries SET value = ? WHERE key = ?', (b'\x80\x04\x95', repr('card')))
+        self.assertIsNone(cache.get('card'))
+
+        with self.assertRaises(TypeError):
+            cache.set('object', object())
+
+    def test_expiry(self):
+        cache = SharedCache(self.path, 'test', ttl=60)
+        cache.set('a', 1)
+
+        with patch('time.time', return_value=time.time() + 61):
+            self.assertIsNone(cache.get('a'))
+
+    def test_purge_keeps_max_size(self):
+        cache = SharedCache(self.path, 'test', ttl=60, max_size=3)
+        for i in range(5):
+            cache.set(i, i)
+        cache.purge()
+
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get(4), 4)
+        self.assertIsNone(cache.get(0))
+
+    def test_stampede_across_processes(self):
+        calls_path = os.path.join(self.dir.name, 'calls')
+        SharedCache(self.path, 'test', ttl=60)
+
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        processes = [
+            context.Process(target=fill_shared, args=(self.path, calls_path, results))
+            for _ in range(3)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join(30)
+
+        values = [results.get(timeout=5) for _ in processes]
+        self.assertEqual(values, [{'card': '<b>shared</b>'}] * 3)
+
+        with open(calls_path) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+        # And it's there for this process too
+        self.assertEqual(
+            SharedCache(self.path, 'test', ttl=60).get('https://example.com/'),
+            {'card': '<b>shared</b>'})
+
+    def test_get_or_set_uncached(self):
+        cache = SharedCache(self.path, 'test', ttl=60)
+
+        self.assertEqual(cache.get_or_set('key', lambda: Uncached('fallback')), 'fallback')
+        self.assertNotIn('key', cache)
+        self.assertEqual(cache.get_or_set('key', lambda: 'value'), 'value')
+        self.assertEqual(cache.get('key'), 'value')
+
+    def test_create_cache(self):
+        self.assertIsInstance(create_cache('test', 60), TTLCache)
+
+        with patch.dict(os.environ, {'CACHE_PATH': self.path}):
+            self.assertIsInstance(create_cache('test', 60), SharedCache)
+
+    @patch('src.cache.named_caches', [])
+    def test_clear_caches(self):
+        memory = create_cache('memory', 60)
+        with patch.dict(os.environ, {'CACHE_PATH': self.path}):
+            shared = create_cache('shared', 60)
+
+        memory.set('key', 'value')
+        shared.set('key', 'value')
+        clear_caches()
+
+        self.assertNotIn('key', memory)
+        self.assertNotIn('key', shared)
@@ -5,8 +5,13 @@
 # and copy/pasting into a Mumble client to inspect how Mumble's HTML renderer
 # handles the results.
 #
+# Pass --record to save every upstream response to test/fixtures/http
+# while running against the live sites, and --replay to run offline
+# from those recordings instead.
+#
 import os
 import sys
+import argparse
 import traceback
 
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,6 +19,7 @@ PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
 sys.path.insert(0, PROJECT_DIR)
 
 from src.factories import create_card  # nopep8
+from fixtures import FIXTURES_DIR, http_fixtures  # nopep8
 from tqdm import tqdm  # nopep8
 
 
@@ -110,4 +116,15 @@ def run_tests():
 
 
 if __name__ == '__main__':
-    run_tests()
+    parser = argparse.ArgumentParser(description='Generate cards for every test case')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--record', action='store_const', dest='mode', const='record',
+                      help='Save upstream responses while running live')
+    mode.add_argument('--replay', action='store_const', dest='mode', const='replay',
+                      help='Serve upstream responses from saved fixtures')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR,
+                        help='Fixture directory (default: %(default)s)')
+    args = parser.parse_args()
+
+    with http_fixtures(args.mode, args.fixtures):
+        run_tests()
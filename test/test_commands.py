@@ -1,22 +1,35 @@
 
-import MumbleServer
-from src.commands import publish
 import os
 import sys
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
 sys.path.insert(0, PROJECT_DIR)
 
+import Ice  # nopep8
+from src.slice import load_slice  # nopep8
+load_slice()
+
+import MumbleServer  # nopep8
+from src.commands import TextMessage, publish, reply_to_channels  # nopep8
+
 
 class MockServer(MumbleServer.Server):
+    def ice_getIdentity(self):
+        return Ice.stringToIdentity('s/1')
+
     def sendMessageChannel(self, channel, tree, text):
         self.text = text
 
+    def sendMessageChannelAsync(self, channel, tree, text):
+        self.sendMessageChannel(channel, tree, text)
+        return Ice.Future.completed(None)
+
     def sendMessage(self, session, text):
         self.text = text
+        self.session = session
 
     def getUsers():
         return [create_mock_user()]
@@ -29,6 +42,7 @@ def create_mock_text(text):
 def create_mock_user():
     user = MumbleServer.User()
     user.name = 'Mock'
+    user.session = 1
 
     return user
 
@@ -40,8 +54,92 @@ class CommandsTestCase(unittest.TestCase):
     def test_link(self):
         server = MockServer()
         user = create_mock_user()
+        url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+        # Run the card job right away instead of on a worker
+        def submit(user, channels, func, *args, kind=None):
+            func(*args)
+            return True
+
+        scheduler = Mock(submit=Mock(side_effect=submit))
+
+        # Murmur delivers links as HTML anchors
+        text = create_mock_text('<a href="{url}">{url}</a>'.format(url=url))
 
-        text = create_mock_text('https://www.youtube.com/watch?v=dQw4w9WgXcQ')
-        publish(server, user, text)
+        with patch('src.admission.scheduler', scheduler), \
+                patch('src.commands.create_card', return_value='<b>card</b>') as create_card:
+            publish(server, user, text)
 
-        self.assertTrue(len(server.text) > 0)
+        create_card.assert_called_once_with(url)
+        self.assertEqual(server.text, '<b>card</b>')
+
+        args = scheduler.submit.call_args[0]
+        self.assertEqual(args[0], ('1', 1))
+        self.assertEqual(args[1], [0])
+
+    def test_profile_requires_admin(self):
+        server = MockServer()
+        user = create_mock_user()
+        server.text = None
+
+        with patch.dict(os.environ, {'ADMIN_USERS': 'Someone Else'}), \
+                patch('src.profiler.start') as start:
+            publish(server, user, create_mock_text('!profile 5'))
+            start.assert_not_called()
+            self.assertIsNone(server.text)
+
+        with patch.dict(os.environ, {'ADMIN_USERS': 'Someone Else, Mock'}), \
+                patch('src.profiler.start', return_value='profile.folded') as start:
+            publish(server, user, create_mock_text('!profile 5'))
+            self.assertEqual(start.call_args[0][0], 5)
+            self.assertEqual(server.session, 1)
+            self.assertEqual(server.text, 'Profiling for 5 seconds')
+
+    def test_profile_requires_registered_user(self):
+        server = MockServer()
+        user = create_mock_user()
+        user.userid = -1
+        server.text = None
+
+        with patch.dict(os.environ, {'ADMIN_USERS': 'Mock'}), \
+                patch('src.profiler.start') as start:
+            publish(server, user, create_mock_text('!profile 5'))
+            start.assert_not_called()
+            self.assertIsNone(server.text)
+
+
+class ReplyTestCase(unittest.TestCase):
+    def create_message(self, channels, trees):
+        return TextMessage(server=Mock(), channels=channels, trees=trees, text='link')
+
+    def test_trees(self):
+        msg = self.create_message(channels=[1, 2, 3], trees=[2])
+        msg.server.sendMessageChannelAsync.return_value = Ice.Future.completed(None)
+
+        reply_to_channels(msg, 'card')
+
+        # Channel 2 is covered by its tree
+        self.assertEqual(msg.server.sendMessageChannelAsync.call_args_list, [
+            ((2, True, 'card'),),
+            ((1, False, 'card'),),
+            ((3, False, 'card'),),
+        ])
+
+    def test_failed_sends_are_logged(self):
+        def send(channel, tree, text):
+            future = Ice.Future()
+            if channel == 2:
+                future.set_exception(MumbleServer.InvalidChannelException())
+            else:
+                future.set_result(None)
+            return future
+
+        msg = self.create_message(channels=[1, 2, 3], trees=[])
+        msg.server.sendMessageChannelAsync.side_effect = send
+
+        with self.assertLogs('Mumble.commands', level='ERROR') as logs:
+            reply_to_channels(msg, 'card')
+
+        self.assertEqual(msg.server.sendMessageChannelAsync.call_count, 3)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('Failed to send to channel 2', logs.output[0])
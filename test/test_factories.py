@@ -0,0 +1,132 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src import factories  # nopep8
+from src.metrics import CARDS  # nopep8
+
+
+class SiteDefaultsTestCase(unittest.TestCase):
+    def setUp(self):
+        factories.site_cache.clear()
+        patcher = patch.object(factories, 'url_to_data_uri', side_effect=lambda url: 'data:' + url)
+        self.url_to_data_uri = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        factories.site_cache.clear()
+
+    def test_default_image_is_reused(self):
+        logo = 'https://wiki.test/logo.png'
+
+        self.assertEqual(factories.site_defaults('wiki.test', 'Wiki', logo), ('Wiki', 'data:' + logo))
+        self.assertEqual(factories.site_defaults('wiki.test', 'Wiki', logo), ('Wiki', 'data:' + logo))
+        self.assertEqual(factories.site_defaults('wiki.test', 'Wiki', logo), ('Wiki', 'data:' + logo))
+        self.assertEqual(self.url_to_data_uri.call_count, 1)
+
+        # Pages with their own image still get it, and the logo stays the default
+        photo = 'https://wiki.test/photo.jpg'
+        self.assertEqual(factories.site_defaults('wiki.test', 'Wiki', photo), ('Wiki', 'data:' + photo))
+        self.assertEqual(factories.site_defaults('wiki.test', 'Wiki', logo), ('Wiki', 'data:' + logo))
+        self.assertEqual(self.url_to_data_uri.call_count, 2)
+
+    def test_page_images_are_not_defaults(self):
+        factories.site_defaults('news.test', None, 'https://news.test/a.jpg')
+        factories.site_defaults('news.test', None, 'https://news.test/b.jpg')
+
+        # Neither image was shared, so a page without one gets no thumbnail
+        self.assertEqual(factories.site_defaults('news.test', None, None), (None, None))
+        self.assertEqual(self.url_to_data_uri.call_count, 2)
+
+    def test_missing_values_fall_back_to_site(self):
+        logo = 'https://code.test/logo.png'
+        factories.site_defaults('code.test', 'Code', logo)
+        factories.site_defaults('code.test', None, logo)
+
+        self.assertEqual(factories.site_defaults('code.test', None, None), ('Code', 'data:' + logo))
+        self.assertEqual(factories.site_defaults('other.test', None, None), (None, None))
+
+
+
+class HtmlCardTestCase(unittest.TestCase):
+    URL = 'https://example.com/post'
+    HEAD = '<head><link type="application/json+oembed" href="/oembed?url=post" /></head>'
+
+    def setUp(self):
+        info = {
+            'url': self.URL,
+            'site': 'Example',
+            'title': 'A Post',
+            'description': 'Words',
+            'thumbnail': None,
+        }
+        patcher = patch.object(factories, 'meta_from_url', return_value=info)
+        self.meta_from_url = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_oembed_card(self):
+        with patch.object(factories, 'read_head', return_value=self.HEAD), \
+                patch.object(factories, 'create_oembed_card', return_value='oembed card') as create:
+            self.assertEqual(factories.create_card_for_html(self.URL), 'oembed card')
+
+        create.assert_called_once_with(self.URL, 'https://example.com/oembed?url=post', media_only=True)
+        self.meta_from_url.assert_not_called()
+
+    def test_scrape_reuses_head(self):
+        with patch.object(factories, 'read_head', return_value=self.HEAD) as read_head, \
+                patch.object(factories, 'create_oembed_card', return_value=None):
+            card = factories.create_card_for_html(self.URL)
+
+        read_head.assert_called_once()
+        self.meta_from_url.assert_called_once_with(self.URL, self.HEAD)
+        self.assertIn('A Post', card)
+
+    def test_unreadable_head_falls_back_to_scrape(self):
+        with patch.object(factories, 'read_head', return_value=None):
+            card = factories.create_card_for_html(self.URL)
+
+        self.meta_from_url.assert_called_once_with(self.URL, None)
+        self.assertIn('A Post', card)
+
+
+class CardCacheTestCase(unittest.TestCase):
+    URL = 'https://example.com/cached'
+
+    def setUp(self):
+        for cache in (factories.card_cache, factories.recent_cards):
+            cache.delete(self.URL)
+            self.addCleanup(cache.delete, self.URL)
+
+    def test_hits_are_counted_under_their_provider(self):
+        def build(url):
+            factories.count_card('steam')
+            return '<b>card</b>'
+
+        before = CARDS.value(provider='steam')
+        with patch.object(factories, 'create_card_for_url', side_effect=build) as create:
+            self.assertEqual(factories.create_card(self.URL), '<b>card</b>')
+            self.assertEqual(factories.create_card(self.URL), '<b>card</b>')
+
+        create.assert_called_once()
+        self.assertEqual(CARDS.value(provider='steam') - before, 2)
+        self.assertEqual(factories.card_kind(self.URL), 'cache')
+
+    def test_fallbacks_are_not_cached(self):
+        def fallback(url):
+            factories.annotate(fallback='steam')
+            factories.count_card('generic')
+            return '<b>generic</b>'
+
+        for build in (fallback, lambda url: ''):
+            with patch.object(factories, 'create_card_for_url', side_effect=build) as create:
+                factories.create_card(self.URL)
+                factories.create_card(self.URL)
+
+            self.assertEqual(create.call_count, 2)
+            self.assertNotIn(self.URL, factories.card_cache)
+            self.assertEqual(factories.card_kind(self.URL), 'generic')
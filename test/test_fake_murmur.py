@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import logging
+import unittest
+from unittest.mock import patch
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from fake_murmur import FakeMurmur, LoadGenerator, LoadTestScheduler  # nopep8
+from src import admission  # nopep8
+from src.mumble import mumble_connect, server_filter  # nopep8
+
+
+def fake_card(url):
+    if 'broken' in url:
+        raise ValueError('Cannot card ' + url)
+
+    return '<a href="{url}">{url}</a>'.format(url=url)
+
+
+class FakeMurmurTestCase(unittest.TestCase):
+    def setUp(self):
+        self.murmur = FakeMurmur(servers=2)
+
+        # Flood control isn't under test here
+        self.scheduler = LoadTestScheduler(user_rate=(1000, 1))
+        patcher = patch.object(admission, 'scheduler', self.scheduler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with patch.dict(os.environ, self.murmur.environ()):
+            self.comm = mumble_connect(logging.getLogger('Mumble.test'))
+
+    def tearDown(self):
+        self.scheduler.stop()
+        self.comm.destroy()
+        self.murmur.destroy()
+
+    def test_callbacks_attached_to_booted_servers(self):
+        for server in self.murmur.servers:
+            self.assertEqual(len(server.callbacks), 1)
+        self.assertEqual(len(self.murmur.meta.callbacks), 1)
+
+    def wait_for_callbacks(self, server, count):
+        deadline = time.perf_counter() + 5
+        while len(server.callbacks) < count and time.perf_counter() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(len(server.callbacks), count)
+
+    def test_servers_started_later_are_attached(self):
+        server = self.murmur.meta.boot_server()
+        self.wait_for_callbacks(server, 1)
+
+    def test_sharded_by_server_id(self):
+        with patch.dict(os.environ, self.murmur.environ()):
+            comm = mumble_connect(logging.getLogger('Mumble.test'), server_filter(1, 2))
+        self.addCleanup(comm.destroy)
+
+        first, second = self.murmur.servers
+        self.assertEqual(len(first.callbacks), 2)
+        self.assertEqual(len(second.callbacks), 1)
+
+        # Server 3 belongs to the same shard as server 1
+        third = self.murmur.meta.boot_server()
+        self.wait_for_callbacks(third, 2)
+
+        fourth = self.murmur.meta.boot_server()
+        self.wait_for_callbacks(fourth, 1)
+
+    @patch('src.commands.create_card', fake_card)
+    def test_every_event_gets_a_reply(self):
+        load = LoadGenerator(self.murmur, ['https://example.com/a', 'https://example.com/b'],
+                             rate=100, burst=5)
+        load.run(20)
+        results = load.wait(timeout=10)
+
+        self.assertEqual(results['sent'], 20)
+        self.assertEqual(results['dropped'], 0)
+        self.assertEqual(len(results['latencies']), 20)
+
+        for channel, (_, server, url) in load.sent.items():
+            self.assertIn(url, server.replies[channel][1])
+
+    @patch('src.commands.create_card', fake_card)
+    def test_failed_cards_are_dropped(self):
+        load = LoadGenerator(self.murmur, ['https://example.com/broken'], rate=100)
+        load.run(3)
+        results = load.wait(timeout=0.5, scheduler=self.scheduler)
+
+        self.assertEqual(results['rejected'], 0)
+        self.assertEqual(results['dropped'], 3)
+
+    @patch('src.commands.create_card', fake_card)
+    def test_rejections_are_not_drops(self):
+        scheduler = LoadTestScheduler(user_rate=(2, 60))
+        self.addCleanup(scheduler.stop)
+
+        load = LoadGenerator(self.murmur, ['https://example.com/a'], users=1, rate=100)
+        with patch.object(admission, 'scheduler', scheduler):
+            load.run(8)
+            results = load.wait(timeout=5, scheduler=scheduler)
+
+        # Two requests per user on each of the two servers get through
+        self.assertLessEqual(results['replied'], 4)
+        self.assertEqual(results['rejected'], 8 - results['replied'])
+        self.assertEqual(results['dropped'], 0)
@@ -0,0 +1,84 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from fixtures import MissingFixture, recording, replaying  # nopep8
+from benchmark import percentile  # nopep8
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/old':
+            self.send_response(301)
+            self.send_header('Location', '/page')
+            self.end_headers()
+            return
+
+        body = '<html><head><title>{}</title></head></html>'.format(self.path).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_HEAD = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixturesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.dir.cleanup()
+
+    def test_replay_without_network(self):
+        with recording(self.dir.name):
+            live = requests.get(self.base + '/page?key=secret&id=1')
+            requests.head(self.base + '/old', allow_redirects=True)
+
+        self.server.shutdown()
+
+        with replaying(self.dir.name):
+            # Credentials aren't part of the fixture
+            replayed = requests.get(self.base + '/page?id=1&key=other')
+            self.assertEqual(replayed.status_code, 200)
+            self.assertEqual(replayed.text, live.text)
+            self.assertEqual(replayed.headers['content-type'], 'text/html; charset=utf-8')
+
+            with requests.get(self.base + '/page?id=1', stream=True) as r:
+                self.assertEqual(b''.join(r.iter_content(8)), live.content)
+
+            redirected = requests.head(self.base + '/old', allow_redirects=True)
+            self.assertEqual(redirected.url, self.base + '/page')
+            self.assertEqual(len(redirected.history), 1)
+
+            with self.assertRaises(MissingFixture):
+                requests.get(self.base + '/never-recorded')
+
+        for name in os.listdir(self.dir.name):
+            with open(os.path.join(self.dir.name, name)) as f:
+                self.assertNotIn('secret', f.read())
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([5], 95), 5)
+        self.assertEqual(percentile([], 50), 0)
@@ -0,0 +1,91 @@
+import os
+import sys
+import logging
+import tempfile
+import threading
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src.logs import StructuredFormatter, add_queued_handler, configure_logging  # nopep8
+
+
+class LogsTestCase(unittest.TestCase):
+    def test_structured_fields(self):
+        formatter = StructuredFormatter('%(levelname)s %(message)s')
+        record = logging.LogRecord('Mumble', logging.INFO, __file__, 1, 'Created card', (), None)
+        record.url = 'https://example.com/'
+        record.provider = 'generic'
+        record.duration = None
+
+        self.assertEqual(
+            formatter.format(record),
+            'INFO Created card | url=https://example.com/ provider=generic')
+
+    def test_queued_rotating_file(self):
+        logger = logging.getLogger('Mumble.test.logs')
+        logger.propagate = False
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'output.log')
+            listener = configure_logging(logger, logging.INFO, path, max_bytes=200, backups=2)
+            try:
+                for i in range(20):
+                    logger.info('Message %d', i, extra={'url': 'https://example.com/'})
+                logger.debug('Not logged')
+            finally:
+                listener.stop()
+                for handler in list(logger.handlers):
+                    logger.removeHandler(handler)
+                for handler in listener.handlers:
+                    handler.close()
+
+            files = sorted(os.listdir(directory))
+            self.assertEqual(files, ['output.log', 'output.log.1', 'output.log.2'])
+
+            with open(path) as f:
+                content = f.read()
+
+        self.assertIn('Message 19', content)
+        self.assertIn('url=https://example.com/', content)
+        self.assertNotIn('Not logged', content)
+
+    def test_queued_handler_routing(self):
+        app = logging.getLogger('Mumble.test.app')
+        app.propagate = False
+        spans = logging.getLogger('Mumble.test.spans')
+        spans.propagate = False
+        spans.setLevel(logging.INFO)
+
+        written = []
+
+        class CaptureHandler(logging.Handler):
+            def emit(self, record):
+                written.append((record.getMessage(), threading.current_thread()))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'output.log')
+            listener = configure_logging(app, logging.INFO, path)
+            add_queued_handler(listener, spans, CaptureHandler())
+            try:
+                app.info('Card created')
+                spans.info('{"name": "card"}')
+            finally:
+                listener.stop()
+                for logger in (app, spans):
+                    for handler in list(logger.handlers):
+                        logger.removeHandler(handler)
+                for handler in listener.handlers:
+                    handler.close()
+
+            with open(path) as f:
+                content = f.read()
+
+        self.assertIn('Card created', content)
+        self.assertNotIn('"name"', content)
+
+        # Written from the listener's thread, not the one that logged it
+        self.assertEqual([message for message, _ in written], ['{"name": "card"}'])
+        self.assertIsNot(written[0][1], threading.current_thread())
@@ -0,0 +1,86 @@
+import os
+import sys
+import unittest
+import urllib.request
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src import metrics  # nopep8
+from src.cache import TTLCache  # nopep8
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.original = list(metrics.registry)
+
+    def tearDown(self):
+        metrics.registry[:] = self.original
+
+    def test_counter_exposition(self):
+        counter = metrics.Counter('test_total', 'Test counter', ('kind',))
+        counter.inc(kind='a')
+        counter.inc(2, kind='a')
+        counter.inc(kind='b"c')
+
+        self.assertEqual(counter.expose(), '\n'.join([
+            '# HELP test_total Test counter',
+            '# TYPE test_total counter',
+            'test_total{kind="a"} 3',
+            'test_total{kind="b\\"c"} 1',
+        ]))
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test histogram', buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        lines = histogram.expose().split('\n')[2:]
+        self.assertEqual(lines, [
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            'test_seconds_sum 5.55',
+            'test_seconds_count 3',
+        ])
+
+    def test_stage_counts_failures(self):
+        before, _ = metrics.STAGE_DURATION.value(stage='test', provider='x')
+
+        with metrics.stage('test', 'x'):
+            pass
+
+        with self.assertRaises(ValueError):
+            with metrics.stage('test', 'x'):
+                raise ValueError()
+
+        count, _ = metrics.STAGE_DURATION.value(stage='test', provider='x')
+        self.assertEqual(count - before, 2)
+        self.assertEqual(metrics.FAILURES.value(stage='test', provider='x'), 1)
+
+    def test_named_cache_reports_hits(self):
+        cache = TTLCache(ttl=60, name='metrics_test')
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+
+        self.assertEqual(metrics.CACHE_REQUESTS.value(cache='metrics_test', result='hit'), 1)
+        self.assertEqual(metrics.CACHE_REQUESTS.value(cache='metrics_test', result='miss'), 1)
+
+    def test_server(self):
+        metrics.CARDS.inc(provider='test')
+
+        server = metrics.start_server(0, '127.0.0.1')
+        try:
+            url = 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+            with urllib.request.urlopen(url) as r:
+                body = r.read().decode('utf-8')
+                self.assertTrue(r.headers['Content-Type'].startswith('text/plain'))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertIn('mumble_cards_total{provider="test"}', body)
+        self.assertIn('# TYPE mumble_card_stage_duration_seconds histogram', body)
@@ -0,0 +1,113 @@
+import os
+import sys
+import logging
+import threading
+import unittest
+from unittest.mock import patch
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+import Ice  # nopep8
+from src.mumble import ServerCallback, ice_properties, server_filter  # nopep8
+import MumbleServer  # nopep8
+from src.main import parse_server_ids, shard_path  # nopep8
+
+
+class IcePropertiesTestCase(unittest.TestCase):
+    def test_defaults_dispatch_in_parallel(self):
+        props = ice_properties({})
+
+        self.assertGreater(int(props['Ice.ThreadPool.Server.Size']), 1)
+        self.assertGreaterEqual(
+            int(props['Ice.ThreadPool.Server.SizeMax']),
+            int(props['Ice.ThreadPool.Server.Size']))
+        self.assertEqual(props['Ice.ThreadPool.Server.Serialize'], '0')
+        self.assertEqual(props['Ice.ImplicitContext'], 'Shared')
+        self.assertEqual(props['Ice.MessageSizeMax'], '65535')
+
+    def test_envvar_overrides(self):
+        props = ice_properties({
+            'ICE_SERVER_THREADS': '8',
+            'ICE_SERVER_THREADS_MAX': '32',
+            'ICE_ACM_HEARTBEAT': '1',
+        })
+
+        self.assertEqual(props['Ice.ThreadPool.Server.Size'], '8')
+        self.assertEqual(props['Ice.ThreadPool.Server.SizeMax'], '32')
+        self.assertEqual(props['Ice.ACM.Heartbeat'], '1')
+
+    def test_properties_are_valid_for_ice(self):
+        props = Ice.createProperties()
+        for name, value in ice_properties({}).items():
+            props.setProperty(name, value)
+
+        idd = Ice.InitializationData()
+        idd.properties = props
+
+        comm = Ice.initialize(idd)
+        try:
+            self.assertEqual(
+                comm.getProperties().getPropertyAsInt('Ice.ThreadPool.Server.Size'), 4)
+        finally:
+            comm.destroy()
+
+    def test_text_messages_are_handled_concurrently(self):
+        # Each handler waits for the other, so this only finishes if
+        # both messages from the one connection are dispatched at once
+        barrier = threading.Barrier(2, timeout=5)
+        handled = []
+
+        def publish(server, user, msg):
+            barrier.wait()
+            handled.append(msg.text)
+
+        props = Ice.createProperties()
+        for name, value in ice_properties({}).items():
+            props.setProperty(name, value)
+
+        idd = Ice.InitializationData()
+        idd.properties = props
+
+        bot = Ice.initialize(idd)
+        murmur = Ice.initialize()
+        try:
+            adapter = bot.createObjectAdapterWithEndpoints('Callback.Client', 'tcp -h 127.0.0.1')
+            proxy = adapter.addWithUUID(ServerCallback(logging.getLogger('Mumble.test'), None, adapter))
+            adapter.activate()
+
+            callback = MumbleServer.ServerCallbackPrx.uncheckedCast(
+                murmur.stringToProxy(bot.proxyToString(proxy)))
+
+            with patch('src.mumble.publish', publish):
+                futures = [
+                    callback.userTextMessageAsync(
+                        MumbleServer.User(), MumbleServer.TextMessage([], [1], [], text))
+                    for text in ('first', 'second')
+                ]
+                for future in futures:
+                    future.result(10)
+        finally:
+            murmur.destroy()
+            bot.destroy()
+
+        self.assertEqual(sorted(handled), ['first', 'second'])
+
+
+class ShardingTestCase(unittest.TestCase):
+    def test_server_filter(self):
+        accepts = server_filter()
+        self.assertTrue(all(accepts(i) for i in range(1, 10)))
+
+        shards = [server_filter(i, 3) for i in range(3)]
+        for server_id in range(1, 10):
+            self.assertEqual(sum(accepts(server_id) for accepts in shards), 1)
+
+        accepts = server_filter(0, 1, parse_server_ids('1, 3'))
+        self.assertEqual([i for i in range(1, 5) if accepts(i)], [1, 3])
+
+    def test_shard_path(self):
+        self.assertEqual(shard_path('output.log', 0, 1), 'output.log')
+        self.assertEqual(shard_path('logs/output.log', 1, 4), 'logs/output.shard1.log')
+        self.assertEqual(shard_path('trace.jsonl', 2, 4), 'trace.shard2.jsonl')
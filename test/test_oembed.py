@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import unittest
+from unittest.mock import MagicMock, Mock, patch
+
+import requests
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src import factories, providers  # nopep8
+from src.cards import oembed  # nopep8
+
+
+def create_streamed_response(chunks: list, status_code: int = 200, content_type: str = 'text/html'):
+    """Response for `requests.get(..., stream=True)` that records how many chunks were read"""
+    response = MagicMock(ok=status_code < 400, status_code=status_code, encoding='utf-8')
+    response.headers = {'Content-Type': content_type}
+    if 'charset=' not in content_type:
+        # What requests assumes for text/* without a charset
+        response.encoding = 'ISO-8859-1'
+    else:
+        response.encoding = content_type.split('charset=')[1]
+    response.__enter__.return_value = response
+    response.read = []
+
+    def iter_content(chunk_size):
+        for chunk in chunks:
+            response.read.append(chunk)
+            yield chunk
+
+    response.iter_content = iter_content
+    return response
+
+
+def create_json_response(body: str, status_code: int = 200):
+    response = Mock(status_code=status_code, content=body.encode())
+    response.json = Mock(side_effect=lambda: json.loads(body))
+    return response
+
+
+class RegistryTestCase(unittest.TestCase):
+    def test_known_sites_use_their_endpoints(self):
+        for url, endpoint in [
+            ('https://vimeo.com/76979871', 'https://vimeo.com/api/oembed.json'),
+            ('https://player.vimeo.com/video/76979871', 'https://vimeo.com/api/oembed.json'),
+            ('https://soundcloud.com/artist/track', 'https://soundcloud.com/oembed'),
+            ('https://open.spotify.com/track/abc', 'https://open.spotify.com/oembed'),
+        ]:
+            provider, _ = providers.match_provider(url)
+            self.assertEqual(provider['name'], 'oembed', url)
+            self.assertEqual(provider['func'], 'src.cards.oembed:create_card_for_endpoint')
+            self.assertEqual(provider['args'], (endpoint,), url)
+
+    def test_known_sites_are_scheduled_as_oembed(self):
+        self.assertEqual(factories.card_kind('https://vimeo.com/76979871'), 'oembed')
+        self.assertEqual(factories.card_kind('https://open.spotify.com/track/abc'), 'oembed')
+
+    def test_endpoint_request(self):
+        with patch.object(oembed, 'create_oembed_card', return_value='card') as create:
+            oembed.create_card_for_endpoint('https://vimeo.com/api/oembed.json', 'https://vimeo.com/1')
+
+        request_url = create.call_args[0][1]
+        self.assertTrue(request_url.startswith('https://vimeo.com/api/oembed.json?'))
+        self.assertIn('url=https%3A%2F%2Fvimeo.com%2F1', request_url)
+        self.assertIn('format=json', request_url)
+
+
+class ReadHeadTestCase(unittest.TestCase):
+    def test_stops_at_end_of_head(self):
+        response = create_streamed_response([
+            b'<html><head><title>Page</title>',
+            b'</head><body>',
+            b'<p>Never read</p>',
+        ])
+
+        with patch('requests.get', return_value=response):
+            head = oembed.read_head('https://example.com/')
+
+        self.assertEqual(head, '<html><head><title>Page</title></head>')
+        self.assertEqual(len(response.read), 2)
+
+    def test_encoding(self):
+        title = 'Café – naïve'
+
+        # No charset from the server, so the page's own declaration is used
+        for meta in [
+            '<meta charset="utf-8">',
+            '<meta http-equiv="Content-Type" content="text/html; charset=utf-8">',
+            '',
+        ]:
+            response = create_streamed_response(
+                ['<head>{}<title>{}</title></head>'.format(meta, title).encode('utf-8')])
+
+            with patch('requests.get', return_value=response):
+                self.assertIn(title, oembed.read_head('https://example.com/'), meta)
+
+        response = create_streamed_response(
+            ['<head><meta charset="windows-1252"><title>{}</title></head>'.format(title).encode('cp1252')])
+        with patch('requests.get', return_value=response):
+            self.assertIn(title, oembed.read_head('https://example.com/'))
+
+        # The header wins when there is one
+        response = create_streamed_response(
+            ['<head><meta charset="utf-8"><title>{}</title></head>'.format(title).encode('cp1252')],
+            content_type='text/html; charset=windows-1252')
+        with patch('requests.get', return_value=response):
+            self.assertIn(title, oembed.read_head('https://example.com/'))
+
+    def test_truncated_head(self):
+        chunk = b'<meta name="filler" content="' + b'x' * 8192 + b'">'
+        response = create_streamed_response([b'<html><head>'] + [chunk] * 100)
+
+        with patch('requests.get', return_value=response):
+            self.assertIsNone(oembed.read_head('https://example.com/'))
+
+        self.assertLess(len(response.read), 100)
+
+    def test_errors(self):
+        with patch('requests.get', side_effect=requests.ConnectionError('refused')):
+            self.assertIsNone(oembed.read_head('https://example.com/'))
+
+        with patch('requests.get', side_effect=requests.Timeout('slow')):
+            self.assertIsNone(oembed.read_head('https://example.com/'))
+
+        response = create_streamed_response([b'<html><head></head>'], status_code=404)
+        with patch('requests.get', return_value=response):
+            self.assertIsNone(oembed.read_head('https://example.com/'))
+
+
+class FindEndpointTestCase(unittest.TestCase):
+    def create_head(self, href):
+        return '<head><link rel="alternate" type="application/json+oembed" href="{}" /></head>'.format(href)
+
+    def test_absolute(self):
+        head = self.create_head('https://www.example.com/oembed?url=https%3A%2F%2Fexample.com%2Fa&amp;format=json')
+        self.assertEqual(
+            oembed.find_endpoint('https://example.com/a', head),
+            'https://www.example.com/oembed?url=https%3A%2F%2Fexample.com%2Fa&format=json')
+
+    def test_relative(self):
+        self.assertEqual(
+            oembed.find_endpoint('https://example.com/posts/a', self.create_head('/oembed?url=a')),
+            'https://example.com/oembed?url=a')
+        self.assertEqual(
+            oembed.find_endpoint('https://example.com/posts/a', self.create_head('oembed?url=a')),
+            'https://example.com/posts/oembed?url=a')
+        self.assertEqual(
+            oembed.find_endpoint('http://blog.example.co.uk/a', self.create_head('//api.example.co.uk/oembed')),
+            'http://api.example.co.uk/oembed')
+
+    def test_other_sites_are_ignored(self):
+        for href in [
+            'https://evil.test/oembed',
+            'http://127.0.0.1:8080/oembed',
+            '//169.254.169.254/latest/meta-data',
+            'https://other.co.uk/oembed',
+            'file:///etc/passwd',
+            'javascript:alert(1)',
+        ]:
+            self.assertIsNone(oembed.find_endpoint('https://example.co.uk/a', self.create_head(href)), href)
+
+    def test_no_link(self):
+        self.assertIsNone(oembed.find_endpoint('https://example.com/', '<head><title>a</title></head>'))
+        self.assertIsNone(oembed.find_endpoint(
+            'https://example.com/', '<head><link rel="alternate" type="application/json+oembed"></head>'))
+
+
+class OEmbedCardTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(oembed, 'url_to_data_uri', side_effect=lambda url: 'data:' + str(url))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_card(self):
+        body = json.dumps({
+            'title': 'A Video',
+            'provider_name': 'Vimeo',
+            'author_name': 'Someone',
+            'duration': 253,
+            'thumbnail_url': 'https://i.vimeocdn.com/1.jpg',
+        })
+
+        with patch('requests.get', return_value=create_json_response(body)):
+            card = oembed.create_oembed_card('https://vimeo.com/1', 'https://vimeo.com/api/oembed.json?url=x')
+
+        self.assertIn('A Video', card)
+        self.assertIn('Vimeo · Someone · 0:04:13', card)
+        self.assertIn('data:https://i.vimeocdn.com/1.jpg', card)
+
+    def test_media_only(self):
+        url, endpoint = 'https://example.com/a', 'https://example.com/oembed'
+
+        for data in [
+            {'type': 'video', 'title': 'A Video'},
+            {'type': 'photo', 'title': 'A Photo'},
+            {'type': 'rich', 'title': 'A Track', 'thumbnail_url': 'https://example.com/1.jpg'},
+        ]:
+            with patch('requests.get', return_value=create_json_response(json.dumps(data))):
+                self.assertIn(data['title'], oembed.create_oembed_card(url, endpoint, media_only=True))
+
+        # e.g. WordPress posts, which have better meta tags
+        for data in [
+            {'type': 'rich', 'title': 'A Post', 'html': '<blockquote>...</blockquote>'},
+            {'type': 'link', 'title': 'A Post'},
+        ]:
+            with patch('requests.get', return_value=create_json_response(json.dumps(data))):
+                self.assertIsNone(oembed.create_oembed_card(url, endpoint, media_only=True))
+                self.assertIsNotNone(oembed.create_oembed_card(url, endpoint))
+
+    def test_nothing_to_card(self):
+        endpoint = 'https://example.com/oembed'
+
+        for response in [
+            create_json_response('{"title": "Gone"}', status_code=404),
+            create_json_response('<html>Not JSON</html>'),
+            create_json_response('["title"]'),
+            create_json_response('{"type": "rich"}'),
+        ]:
+            with patch('requests.get', return_value=response):
+                self.assertIsNone(oembed.create_oembed_card('https://example.com/a', endpoint))
+
+        with patch('requests.get', side_effect=requests.Timeout('slow')):
+            self.assertIsNone(oembed.create_oembed_card('https://example.com/a', endpoint))
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src import profiler  # nopep8
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=busy_loop, args=(self.stop,), name='busy')
+        self.thread.start()
+
+    def tearDown(self):
+        self.stop.set()
+        self.thread.join()
+
+    def test_samples_other_threads(self):
+        counts = profiler.profile(0.1, interval=0.001)
+
+        busy = [stack for stack in counts if stack.startswith('busy;')]
+        self.assertTrue(busy)
+        self.assertIn('busy_loop (test_profiler.py:', busy[0])
+        self.assertFalse(any('profile (profiler.py' in stack for stack in counts))
+
+    def test_background_profile_writes_collapsed_stacks(self):
+        done = threading.Event()
+        written = []
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = profiler.start(0.1, directory, lambda p: (written.append(p), done.set()))
+            self.assertIsNotNone(path)
+
+            # Only one profile at a time
+            self.assertIsNone(profiler.start(0.1, directory))
+
+            self.assertTrue(done.wait(5))
+            self.assertEqual(written, [path])
+
+            with open(path) as f:
+                lines = f.read().splitlines()
+
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
@@ -0,0 +1,64 @@
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src import factories, providers  # nopep8
+
+
+class ProvidersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.original = providers.provider_subscribers
+        providers.provider_subscribers = []
+        providers._matcher = None
+
+        providers.register('video', r'(www\.)?video\.test', r'/watch/(?P<id>\w+)', None)
+        providers.register('short', r'vid\.test', r'/(?P<id>\w+)', None)
+        providers.register('store', r'store\.test', r'/app/(?P<id>\d+)', None)
+
+    def tearDown(self):
+        providers.provider_subscribers = self.original
+        providers._matcher = None
+
+    def test_match_by_host_and_path(self):
+        provider, groups = providers.match_provider('https://www.video.test/watch/abc')
+        self.assertEqual(provider['name'], 'video')
+        self.assertEqual(groups, {'id': 'abc'})
+
+        provider, groups = providers.match_provider('http://vid.test/xyz')
+        self.assertEqual(provider['name'], 'short')
+        self.assertEqual(groups, {'id': 'xyz'})
+
+    def test_duplicate_group_names_across_providers(self):
+        provider, groups = providers.match_provider('https://store.test/app/42/Name')
+        self.assertEqual(provider['name'], 'store')
+        self.assertEqual(groups, {'id': '42'})
+
+    def test_unknown_urls(self):
+        for url in [
+            'https://example.com/watch/abc',
+            'https://store.test/profile/42',
+            'https://video.test.example.com/watch/abc',
+        ]:
+            self.assertEqual(providers.match_provider(url), (None, None), url)
+
+    def test_card_kind(self):
+        self.assertEqual(factories.card_kind('https://store.test/app/42'), 'store')
+        self.assertEqual(factories.card_kind('https://example.com/cat.JPG'), 'image')
+        self.assertEqual(factories.card_kind('https://example.com/post'), 'generic')
+
+        factories.recent_cards.set('https://example.com/post', True)
+        try:
+            self.assertEqual(factories.card_kind('https://example.com/post'), 'cache')
+        finally:
+            factories.recent_cards.delete('https://example.com/post')
+
+    def test_late_registration_recompiles(self):
+        self.assertEqual(providers.match_provider('https://late.test/'), (None, None))
+
+        providers.register('late', r'late\.test', r'/', None)
+        provider, _ = providers.match_provider('https://late.test/')
+        self.assertEqual(provider['name'], 'late')
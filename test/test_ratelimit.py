@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src import ratelimit  # nopep8
+from src.ratelimit import RateLimited, TokenBucket  # nopep8
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def test_burst_up_to_capacity(self):
+        bucket = TokenBucket(3, 60)
+
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire(2))
+        self.assertFalse(bucket.try_acquire())
+        self.assertGreater(bucket.retry_after(), 0)
+
+    def test_block_for(self):
+        bucket = TokenBucket(100, 1)
+        bucket.block_for(30)
+
+        self.assertFalse(bucket.try_acquire())
+        self.assertGreater(bucket.retry_after(), 29)
+
+
+class HeadersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.original = ratelimit.buckets
+        ratelimit.buckets = {'test': TokenBucket(10, 60)}
+
+    def tearDown(self):
+        ratelimit.buckets = self.original
+
+    def test_remaining_clamps_budget(self):
+        ratelimit.update_from_headers('test', {'x-rate-limit-remaining': '1'})
+
+        ratelimit.acquire('test')
+        with self.assertRaises(RateLimited):
+            ratelimit.acquire('test')
+
+    def test_exhausted_window_blocks_until_reset(self):
+        ratelimit.update_from_headers('test', {
+            'x-rate-limit-remaining': '0',
+            'x-rate-limit-reset': str(int(time.time()) + 120),
+        })
+
+        with self.assertRaises(RateLimited) as ctx:
+            ratelimit.acquire('test')
+
+        self.assertGreater(ctx.exception.retry_after, 100)
+
+    def test_retry_after(self):
+        ratelimit.update_from_headers('test', {'Retry-After': '30'}, 429)
+
+        with self.assertRaises(RateLimited):
+            ratelimit.acquire('test')
+
+    def test_429_without_headers_backs_off(self):
+        ratelimit.update_from_headers('test', {}, 429)
+
+        with self.assertRaises(RateLimited):
+            ratelimit.acquire('test')
+
+    def test_429_response_raises(self):
+        ratelimit.check_response('test', {}, 200)
+
+        with self.assertRaises(RateLimited) as ctx:
+            ratelimit.check_response('test', {'Retry-After': '30'}, 429)
+
+        self.assertGreater(ctx.exception.retry_after, 20)
@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src.render import Markup, Template, join, minify  # nopep8
+
+
+class RenderTestCase(unittest.TestCase):
+    def test_minify_strips_indentation(self):
+        html = minify('''
+            <table>
+                <tr>
+                    <td style="font-size: small; color: #666666" class="">
+                        <!-- comment -->
+                        {date} · <b>{views}</b> Views
+                        <br />
+                    </td>
+                </tr>
+            </table>
+        ''')
+
+        self.assertEqual(
+            html,
+            '<table><tr><td style="font-size:small;color:#666666">'
+            '{date} · <b>{views}</b> Views<br/></td></tr></table>'
+        )
+
+    def test_values_are_escaped(self):
+        template = Template('<a href="{url}">{title}</a>')
+        html = template.render(url='https://a.test/?x=1&y="2"', title='<b>Hi</b>')
+
+        self.assertEqual(
+            html,
+            '<a href="https://a.test/?x=1&amp;y=&quot;2&quot;">&lt;b&gt;Hi&lt;/b&gt;</a>'
+        )
+
+    def test_markup_is_not_escaped(self):
+        inner = Template('<b>{name}</b>').render(name='A & B')
+        outer = Template('<p>{inner} {note}</p>').render(inner=inner, note=Markup('<i>!</i>'))
+
+        self.assertEqual(outer, '<p><b>A &amp; B</b> <i>!</i></p>')
+
+    def test_format_specs(self):
+        html = Template('{views:,} Views').render(views=1234567)
+        self.assertEqual(html, '1,234,567 Views')
+
+    def test_join(self):
+        parts = [Markup('<br/>'), '<script>']
+        self.assertEqual(join(parts, ' · '), '<br/> · &lt;script&gt;')
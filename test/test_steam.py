@@ -0,0 +1,164 @@
+import os
+import sys
+import unittest
+from unittest.mock import Mock, patch
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src import ratelimit  # nopep8
+from src.cards import steam  # nopep8
+
+
+def create_mock_details():
+    return {
+        'name': 'Valheim',
+        'is_free': False,
+        'short_description': 'A brutal exploration and survival game',
+        'genres': [{'description': 'Early Access'}],
+        'release_date': {'coming_soon': False, 'date': 'Feb 2, 2021'},
+        'price_overview': {'final': 999, 'discount_percent': 50},
+    }
+
+
+class SteamAppCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        steam.static_app_cache.clear()
+        steam.price_cache.clear()
+
+        self.details = Mock(return_value=create_mock_details())
+        self.prices = Mock(return_value={
+            'price_overview': {'final': 1999, 'discount_percent': 0}
+        })
+
+        patches = [
+            patch.object(steam, 'get_app_details', self.details),
+            patch.object(steam.app_prices, 'get', self.prices),
+            patch.object(steam.SteamApp, 'scrape_reviews', Mock(return_value=[])),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_first_load_fetches_details(self):
+        app = steam.SteamApp('892970')
+
+        self.assertEqual(app.title, 'Valheim')
+        self.assertEqual(app.discount, '-50%')
+        self.details.assert_called_once_with('892970')
+        self.prices.assert_not_called()
+
+    def test_repeat_load_is_served_from_cache(self):
+        steam.SteamApp('892970').load_from_api()
+        steam.SteamApp('892970').load_from_api()
+
+        self.details.assert_called_once()
+        self.prices.assert_not_called()
+
+    def test_expired_price_only_refreshes_price(self):
+        steam.SteamApp('892970').load_from_api()
+        steam.price_cache.clear()
+
+        app = steam.SteamApp('892970')
+        app.load_from_api()
+
+        self.details.assert_called_once()
+        self.prices.assert_called_once_with('892970')
+        self.assertEqual(app.price, '$19.99')
+        self.assertEqual(app.discount, '')
+
+
+class SteamAppDetailsTestCase(unittest.TestCase):
+    def create_response(self, body):
+        return Mock(status_code=200, json=Mock(return_value=body))
+
+    def test_details_are_requested_per_app(self):
+        body = {'892970': {'success': True, 'data': create_mock_details()}}
+        with patch.object(steam, 'steam_request', return_value=self.create_response(body)) as request:
+            self.assertEqual(steam.get_app_details('892970')['name'], 'Valheim')
+
+        params = request.call_args[1]['params']
+        self.assertEqual(params['appids'], '892970')
+        self.assertEqual(params['filters'], steam.APP_DETAILS_FILTERS)
+
+    def test_invalid_app(self):
+        body = {'1': {'success': False}}
+        with patch.object(steam, 'steam_request', return_value=self.create_response(body)):
+            self.assertIsNone(steam.get_app_details('1'))
+
+    def test_prices_are_batched(self):
+        body = {
+            '10': {'success': True, 'data': {'price_overview': {'final': 999}}},
+            '20': {'success': True, 'data': []},
+        }
+        with patch.object(steam, 'steam_request', return_value=self.create_response(body)) as request:
+            prices = steam.get_app_prices(['10', '20'])
+
+        request.assert_called_once()
+        self.assertEqual(request.call_args[1]['params']['filters'], steam.APP_PRICE_FILTERS)
+        self.assertEqual(prices, {
+            '10': {'price_overview': {'final': 999}},
+            '20': {'price_overview': None},
+        })
+
+
+class SteamWorkshopTestCase(unittest.TestCase):
+    def setUp(self):
+        steam.static_app_cache.clear()
+        steam.app_name_cache.clear()
+
+        details = {
+            'publishedfileid': '123',
+            'consumer_app_id': 286160,
+            'title': 'Chess',
+            'description': '[b]Classic[/b] chess',
+        }
+        patcher = patch.object(steam.workshop_details, 'get', Mock(return_value=details))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_app_name_is_cached(self):
+        body = {'286160': {'success': True, 'data': {'name': 'Tabletop Simulator'}}}
+        response = Mock(status_code=200, json=Mock(return_value=body))
+
+        with patch.object(steam, 'steam_request', return_value=response) as request:
+            for _ in range(2):
+                item = steam.SteamWorkshopItem('123')
+                item.load_from_api()
+                self.assertEqual(item.appname, 'Tabletop Simulator')
+
+        request.assert_called_once()
+        self.assertEqual(request.call_args[1]['params']['filters'], 'basic')
+
+    def test_missing_app_name_keeps_the_card(self):
+        response = Mock(status_code=500, json=Mock(return_value=None))
+
+        with patch.object(steam, 'steam_request', return_value=response):
+            item = steam.SteamWorkshopItem('123')
+            item.load_from_api()
+
+        self.assertIsNone(item.appname)
+        self.assertEqual(item.title, 'Chess')
+
+        card = steam.create_content_for_workshop_item({'url': 'https://example.com', 'thumbnail': ''}, item)
+        self.assertIn('Chess', card)
+        self.assertNotIn(' for ', card)
+
+
+class SteamRateLimitTestCase(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.dict(ratelimit.buckets, {'steam': ratelimit.TokenBucket(10, 60)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_429_raises_rate_limited(self):
+        response = Mock(status_code=429, headers={'Retry-After': '30'}, content=b'')
+
+        with patch('requests.request', return_value=response):
+            with self.assertRaises(ratelimit.RateLimited) as ctx:
+                steam.steam_request('GET', steam.APP_DETAILS_API)
+
+        self.assertEqual(ctx.exception.provider, 'steam')
+        with self.assertRaises(ratelimit.RateLimited):
+            ratelimit.acquire('steam')
@@ -0,0 +1,83 @@
+import os
+import sys
+import json
+import logging
+import tempfile
+import unittest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src import tracing  # nopep8
+from src.cache import TTLCache  # nopep8
+from src.metrics import stage  # nopep8
+
+
+class TracingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'trace.jsonl')
+        tracing.configure(self.path)
+
+    def tearDown(self):
+        for handler in list(tracing.exporter.handlers):
+            tracing.exporter.removeHandler(handler)
+            handler.close()
+        self.dir.cleanup()
+
+    def read_events(self) -> list:
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_parent_child_relationships(self):
+        with tracing.span('publish') as root:
+            with stage('card', url='https://example.com/') as card:
+                with tracing.span('thumbnail', bytes=None):
+                    pass
+
+        with tracing.span('other') as other:
+            pass
+
+        self.assertIsNone(root.parent_id)
+        self.assertEqual(card.parent_id, root.span_id)
+        self.assertEqual(card.trace_id, root.trace_id)
+        self.assertNotEqual(other.trace_id, root.trace_id)
+
+        events = {e['name']: e for e in self.read_events()}
+        self.assertEqual(set(events), {'publish', 'card', 'thumbnail', 'other'})
+        self.assertEqual(events['thumbnail']['args']['parent_id'], card.span_id)
+        self.assertEqual(events['card']['args']['url'], 'https://example.com/')
+        self.assertNotIn('bytes', events['thumbnail']['args'])
+        self.assertEqual(events['card']['ph'], 'X')
+
+    def test_errors_are_recorded(self):
+        with self.assertRaises(ValueError):
+            with tracing.span('fails'):
+                raise ValueError('nope')
+
+        event, = self.read_events()
+        self.assertIn('nope', event['args']['error'])
+        self.assertIsNone(tracing.current_span())
+
+    def test_cache_hits_annotate_current_span(self):
+        cache = TTLCache(ttl=60, name='test')
+        cache.set('a', 1)
+
+        with tracing.span('lookup') as s:
+            cache.get('a')
+
+        self.assertEqual(s.attributes['cache.test'], 'hit')
+
+    def test_export_single_trace(self):
+        with tracing.span('first') as first:
+            with tracing.span('child'):
+                pass
+
+        with tracing.span('second'):
+            pass
+
+        trace = tracing.export(self.path, first.trace_id)
+        self.assertEqual(
+            sorted(e['name'] for e in trace['traceEvents']), ['child', 'first'])
+        self.assertEqual(len(tracing.export(self.path)['traceEvents']), 3)
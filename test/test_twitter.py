@@ -0,0 +1,159 @@
+import os
+import sys
+import threading
+import unittest
+from unittest.mock import Mock, patch
+
+import tweepy
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src import factories, ratelimit  # nopep8
+from src.cards import twitter  # nopep8
+
+
+def create_mock_tweet(tweet_id, author_id='10', text='Hello', **fields):
+    return tweepy.Tweet(dict({
+        'id': tweet_id,
+        'text': text,
+        'author_id': author_id,
+        'edit_history_tweet_ids': [tweet_id],
+        'created_at': '2022-05-02T06:30:00.000Z',
+        'public_metrics': {'retweet_count': 1200, 'reply_count': 3, 'like_count': 45000, 'quote_count': 7},
+    }, **fields))
+
+
+def create_mock_user(user_id='10', username='someone'):
+    return tweepy.User({
+        'id': user_id,
+        'name': username.title(),
+        'username': username,
+        'profile_image_url': 'https://pbs.twimg.com/{}.jpg'.format(username),
+    })
+
+
+def create_mock_response(tweets, users, media=()):
+    return tweepy.Response(
+        data=tweets,
+        includes={'users': list(users), 'media': list(media)},
+        errors=[],
+        meta={}
+    )
+
+
+class TwitterTestCase(unittest.TestCase):
+    def setUp(self):
+        patches = [
+            patch.dict(os.environ, {'TWITTER_BEARER_TOKEN': 'token'}),
+            patch.object(twitter, 'TWITTER_API_BEARER_TOKEN', 'token'),
+            patch.object(twitter, 'client', None),
+            patch.dict(ratelimit.buckets, {'twitter': ratelimit.TokenBucket(300, 15 * 60)}),
+            patch.object(twitter, 'url_to_data_uri', side_effect=lambda url, *args: 'data:' + str(url)),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+
+class TweetsTestCase(TwitterTestCase):
+    def setUp(self):
+        super().setUp()
+
+        response = create_mock_response(
+            tweets=[
+                create_mock_tweet('1', author_id='10', attachments={'media_keys': ['3_1', '3_2']}),
+                create_mock_tweet('2', author_id='20'),
+            ],
+            users=[create_mock_user('10', 'someone'), create_mock_user('20', 'other')],
+            media=[
+                tweepy.Media({'media_key': '3_1', 'type': 'photo', 'url': 'https://pbs.twimg.com/media/1.jpg'}),
+                tweepy.Media({
+                    'media_key': '3_2',
+                    'type': 'video',
+                    'preview_image_url': 'https://pbs.twimg.com/media/2.jpg'
+                }),
+            ]
+        )
+
+        self.client = Mock(get_tweets=Mock(return_value=response))
+        patcher = patch.object(twitter, 'get_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tweets_are_batched(self):
+        results = twitter.tweets.get_many(['1', '2', '3'])
+
+        self.client.get_tweets.assert_called_once()
+        self.assertEqual(sorted(self.client.get_tweets.call_args[0][0]), ['1', '2', '3'])
+
+        # Deleted or protected tweets don't come back
+        self.assertIsNone(results['3'])
+
+    def test_includes_are_mapped_to_tweets(self):
+        results = twitter.get_tweets(['1', '2'])
+
+        self.assertEqual(results['1']['user'].username, 'someone')
+        self.assertEqual([m.media_key for m in results['1']['media']], ['3_1', '3_2'])
+        self.assertEqual(results['2']['user'].username, 'other')
+        self.assertEqual(results['2']['media'], [])
+
+    def test_card(self):
+        card = twitter.create_card_for_tweet('1')
+
+        self.assertIn('@someone', card)
+        self.assertIn('data:https://pbs.twimg.com/someone.jpg', card)
+        self.assertIn('<b>1,200</b> Retweets', card)
+        self.assertIn('<b>45,000</b> Likes', card)
+
+        # Photos link to themselves, videos to the tweet
+        photo = 'https://pbs.twimg.com/media/1.jpg'
+        self.assertIn('<a href="{0}"><img src="data:{0}"'.format(photo), card)
+        preview = 'https://pbs.twimg.com/media/2.jpg'
+        self.assertIn('<a href="https://twitter.com/twitter/status/1"><img src="data:{}"'.format(preview), card)
+
+    def test_text_is_escaped(self):
+        response = create_mock_response(
+            tweets=[create_mock_tweet('5', text='Fish &amp; chips &lt;3\n<b>not bold</b>')],
+            users=[create_mock_user()]
+        )
+        self.client.get_tweets.return_value = response
+
+        card = twitter.create_card_for_tweet('5')
+
+        self.assertIn('Fish &amp; chips &lt;3<br/>&lt;b&gt;not bold&lt;/b&gt;', card)
+
+
+class TwitterClientTestCase(TwitterTestCase):
+    def test_shared_client(self):
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(twitter.get_client())) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIsInstance(clients[0], twitter.RateLimitedClient)
+        self.assertEqual(clients[0].bearer_token, 'token')
+        self.assertTrue(all(client is clients[0] for client in clients))
+
+    def test_429_degrades_card(self):
+        url = 'https://twitter.com/someone/status/1'
+        response = Mock(
+            status_code=429,
+            reason='Too Many Requests',
+            headers={'x-rate-limit-remaining': '0', 'x-rate-limit-reset': '9999999999'},
+            json=Mock(return_value={})
+        )
+        factories.card_cache.clear()
+
+        with patch('tweepy.Client.request', side_effect=tweepy.TooManyRequests(response)) as request:
+            card = factories.create_card(url)
+
+        request.assert_called_once()
+        self.assertEqual(card, factories.create_degraded_card(url))
+
+        # The budget is gone, so nothing else is sent
+        with self.assertRaises(ratelimit.RateLimited):
+            ratelimit.acquire('twitter')
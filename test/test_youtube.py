@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import unittest
+from unittest.mock import Mock, patch
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.abspath(os.path.join(TEST_DIR, os.pardir))
+sys.path.insert(0, PROJECT_DIR)
+
+from src import providers, ratelimit  # nopep8
+from src.cards import youtube  # nopep8
+
+VIDEO_ID = 'dQw4w9WgXcQ'
+
+
+def create_mock_video(video_id=VIDEO_ID, statistics=None):
+    return {
+        'id': video_id,
+        'snippet': {
+            'title': 'Never Gonna Give You Up',
+            'channelTitle': 'Rick Astley',
+            'publishedAt': '2009-10-25T06:57:33Z',
+            'thumbnails': {
+                'default': {'url': 'https://i.ytimg.com/vi/{}/default.jpg'.format(video_id)},
+                'medium': {'url': 'https://i.ytimg.com/vi/{}/mqdefault.jpg'.format(video_id)},
+            },
+        },
+        'contentDetails': {'duration': 'PT3M33S'},
+        'statistics': {'viewCount': '1500000000'} if statistics is None else statistics,
+    }
+
+
+def create_response(items=None, status_code=200, text=''):
+    body = json.dumps({'items': items or []})
+    return Mock(
+        status_code=status_code,
+        headers={},
+        content=body.encode(),
+        text=text or body,
+        json=Mock(return_value=json.loads(body))
+    )
+
+
+class YouTubeTestCase(unittest.TestCase):
+    def setUp(self):
+        patches = [
+            patch.dict(os.environ, {'YOUTUBE_API_KEY': 'key'}),
+            patch.dict(ratelimit.buckets, {'youtube': ratelimit.TokenBucket(10000, 24 * 60 * 60)}),
+            patch.object(youtube, 'url_to_data_uri', side_effect=lambda url: 'data:' + str(url)),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+
+class YouTubeCardTestCase(YouTubeTestCase):
+    def test_video_urls(self):
+        for url in [
+            'https://www.youtube.com/watch?v=' + VIDEO_ID,
+            'https://www.youtube.com/watch?list=PL1&v={}&t=42'.format(VIDEO_ID),
+            'https://m.youtube.com/watch?v=' + VIDEO_ID,
+            'https://music.youtube.com/watch?v=' + VIDEO_ID,
+            'https://www.youtube.com/shorts/' + VIDEO_ID,
+            'https://www.youtube.com/embed/' + VIDEO_ID,
+            'https://youtu.be/{}?t=42'.format(VIDEO_ID),
+        ]:
+            provider, groups = providers.match_provider(url)
+            self.assertEqual(provider['name'], 'youtube', url)
+            self.assertEqual(groups, {'id': VIDEO_ID}, url)
+
+            with patch('requests.get', return_value=create_response([create_mock_video()])):
+                card = providers.invoke(provider, url, groups)
+
+            self.assertIn('Never Gonna Give You Up', card)
+            self.assertIn('Rick Astley', card)
+            self.assertIn('0:03:33', card)
+            self.assertIn('1,500,000,000', card)
+            self.assertIn('data:https://i.ytimg.com/vi/{}/mqdefault.jpg'.format(VIDEO_ID), card)
+
+    def test_other_urls(self):
+        for url in [
+            'https://www.youtube.com/channel/UCuAXFkgsw1L7xaCfnd5JJOw',
+            'https://www.youtube.com/watch?v=short',
+            'https://youtu.be/{}more'.format(VIDEO_ID),
+        ]:
+            provider, _ = providers.match_provider(url)
+            self.assertTrue(provider is None or provider['name'] != 'youtube', url)
+
+    def test_requires_api_key(self):
+        with patch.dict(os.environ, clear=True):
+            provider, _ = providers.match_provider('https://youtu.be/' + VIDEO_ID)
+            self.assertIsNone(provider)
+
+            with patch('requests.get') as get:
+                self.assertIsNone(youtube.create_card_for_video('https://youtu.be/' + VIDEO_ID, VIDEO_ID))
+            get.assert_not_called()
+
+    def test_partial_response(self):
+        with patch('requests.get', return_value=create_response([create_mock_video()])) as get:
+            youtube.create_card_for_video('https://youtu.be/' + VIDEO_ID, VIDEO_ID)
+
+        params = get.call_args[1]['params']
+        self.assertEqual(get.call_args[0][0], youtube.VIDEOS_API)
+        self.assertEqual(params['id'], VIDEO_ID)
+        self.assertEqual(params['key'], 'key')
+        self.assertEqual(params['part'], 'snippet,contentDetails,statistics')
+        self.assertEqual(params['fields'], youtube.VIDEOS_API_FIELDS)
+
+    def test_missing_video(self):
+        with patch('requests.get', return_value=create_response([])):
+            self.assertIsNone(youtube.create_card_for_video('https://youtu.be/' + VIDEO_ID, VIDEO_ID))
+
+    def test_hidden_view_count(self):
+        video = create_mock_video(statistics={})
+
+        with patch('requests.get', return_value=create_response([video])):
+            card = youtube.create_card_for_video('https://youtu.be/' + VIDEO_ID, VIDEO_ID)
+
+        self.assertIn('Never Gonna Give You Up', card)
+        self.assertIn('<b>0</b> Views', card)
+
+    def test_live_video(self):
+        video = create_mock_video()
+        video['contentDetails']['duration'] = 'P0D'
+
+        with patch('requests.get', return_value=create_response([video])):
+            card = youtube.create_card_for_video('https://youtu.be/' + VIDEO_ID, VIDEO_ID)
+
+        self.assertIn('<b>Live</b>', card)
+
+
+class YouTubeQuotaTestCase(YouTubeTestCase):
+    def setUp(self):
+        super().setUp()
+
+        patcher = patch.dict(youtube.quota_usage, {'units': 0, 'videos': 0})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_videos(self, url, params):
+        ids = params['id'].split(',')
+        return create_response([create_mock_video(video_id) for video_id in ids])
+
+    def test_batches_of_50(self):
+        video_ids = ['video{:06d}'.format(i) for i in range(120)]
+
+        with patch('requests.get', side_effect=self.get_videos) as get:
+            videos = youtube.videos.get_many(video_ids)
+
+        self.assertEqual(sorted(videos), video_ids)
+        self.assertEqual(
+            [len(call[1]['params']['id'].split(',')) for call in get.call_args_list],
+            [50, 50, 20])
+
+    def test_quota_usage(self):
+        with patch('requests.get', side_effect=self.get_videos):
+            youtube.get_videos(['video{:06d}'.format(i) for i in range(50)])
+            youtube.get_videos(['video000050'])
+
+        self.assertEqual(youtube.quota_usage, {'units': 2, 'videos': 51})
+        self.assertAlmostEqual(ratelimit.buckets['youtube'].tokens, 10000 - 2, places=0)
+
+    def test_quota_exceeded_blocks_for_an_hour(self):
+        response = create_response(status_code=403, text=json.dumps({
+            'error': {'errors': [{'reason': 'quotaExceeded'}]}
+        }))
+
+        with patch('requests.get', return_value=response) as get:
+            with self.assertRaises(ratelimit.RateLimited) as ctx:
+                youtube.get_videos([VIDEO_ID])
+            self.assertEqual(ctx.exception.provider, 'youtube')
+
+            # Nothing else is sent until the hour is up
+            with self.assertRaises(ratelimit.RateLimited) as ctx:
+                youtube.get_videos([VIDEO_ID])
+
+        get.assert_called_once()
+        self.assertGreater(ctx.exception.retry_after, 59 * 60)
+        self.assertEqual(youtube.quota_usage, {'units': 0, 'videos': 0})